@@ -16,6 +16,12 @@ import datetime as dt
 import analytics
 from pytz import timezone
 
+## journal is shared with the sibling backtests package
+BACKTESTS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtests'))
+if BACKTESTS not in sys.path:
+    sys.path.append(BACKTESTS)
+import journal
+
 """
 This application runs a series of machine learning algorithms on a variety of data slices 
 extracted from a kdb database
@@ -23,18 +29,23 @@ extracted from a kdb database
 
 def run(args):
     try:
-        status = analytics.performAnalysis(args)
-        logger.info('completed analysis %s' % status)
+        if args.load and args.workers > 1:
+            rows = analytics.ingestMarketData(args)
+            logger.info('ingested %s rows into %s' % (rows, args.dbdir))
+        elif args.load:
+            rows = analytics.loadMarketData(args)
+            logger.info('loaded %s rows into %s' % (rows, args.dbdir))
+        else:
+            status = analytics.performAnalysis(args)
+            logger.info('completed analysis %s' % status)
     except Exception as ex:
         logger.error('error performing analysis\n%r' % ex)
 
 def initLogger():
     root = '/var/tmp/analysis/' if 'linux' in sys.platform else '../data/output'
-    fh = logging.FileHandler(root + 'analysis-{:%Y-%m-%d-%H-%M-%S}.log'.format(dt.datetime.now()))
-    formatter = logging.Formatter('%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
-    logger.addHandler(logging.StreamHandler())
+    name = root + 'analysis-{:%Y-%m-%d-%H-%M-%S}'.format(dt.datetime.now())
+    # the log and the journal of q query events are written by a background thread
+    journal.startLogging(name + '.log', stream=True, journalfile=name + '.jsonl')
 
 def main(appname):
     ####################################################################################################################
@@ -55,10 +66,17 @@ def main(appname):
     # process command line args
     ####################################################################################################################
     parser = argparse.ArgumentParser(prog='BloombergReader')
+    parser.add_argument('-d', '--dbdir', help='kdb database directory to load into', default='../../data/kdb/marketdata')
     parser.add_argument('-i', '--inputs', help='tickers and fields to extract from spreadsheet instead of database',default=None)
+    parser.add_argument('-j', '--jobs', help='json file of the slices, models and hyperparameters to run', default=None)
+    parser.add_argument('-l', '--load', help='bloomberg download file or directory to load into the kdb database', default=None)
+    parser.add_argument('-n', '--processes', help='number of processes to fit the models with, all cores by default', type=int, default=None)
     parser.add_argument('-o', '--outdir', help='output director to write files', default='../../data/output1')
+    parser.add_argument('-ps', '--poolsize', help='number of q connections to fetch data slices with', type=int, default=4)
     parser.add_argument('-qp', '--qpath', help='path to q executable')
-    parser.add_argument('-qi', '--qinstance', help='for debugging a running qinstance host:port', default=None)
+    parser.add_argument('-qi', '--qinstance', help='for debugging a running qinstance host:port, or a comma separated list for the ingest workers', default=None)
+    parser.add_argument('-s', '--slicedir', help='directory to keep the data slices in, outdir/slices by default', default=None)
+    parser.add_argument('-w', '--workers', help='number of q processes to load with in parallel', type=int, default=1)
 
     args = parser.parse_args()
 
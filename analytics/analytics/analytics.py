@@ -2,8 +2,36 @@
 
 import os
 import sys
+import json
 import qconnection
+import kdbLoader
+import kdbIngest
+import modelRunner
 
 def performAnalysis(args):
+    ## run the model jobs of args.jobs, or the default ones, over slices of the database at args.dbdir
+    jobs = json.load(open(args.jobs)) if args.jobs else modelRunner.DEFAULT_JOBS
+    pool = qconnection.connectPool(args, args.poolsize)
+    try:
+        loader = kdbLoader.KdbLoader(pool, args.dbdir)
+        if not args.qinstance:
+            ## a spawned q process starts without the database
+            loader.open()
+        workdir = args.slicedir or os.path.join(args.outdir, 'slices')
+        results = modelRunner.runJobs(pool, jobs, workdir, args.processes, version=loader.version())
+    finally:
+        pool.close()
+    os.makedirs(args.outdir, exist_ok=True)
+    results.to_csv(os.path.join(args.outdir, 'analysis-results.csv'))
+    return '%s fits, %s failed' % (len(results), results['error'].notnull().sum() if 'error' in results else 0)
+
+def loadMarketData(args):
+    ## bulk load a Bloomberg download file or directory into the date partitioned database
     qconn = qconnection.QConnection()
     q = qconn.connect(args)
+    return kdbLoader.loadMarketData(q, args.load, args.dbdir)
+
+def ingestMarketData(args):
+    ## the same load spread over args.workers q processes, one database segment each
+    stats = kdbIngest.ingest(args, args.load, args.dbdir, args.workers)
+    return stats.rows.sum()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+'''
+Wall clock and peak memory of a (date x ticker x field) tensor built by FeatureMatrix against a
+select of the long rows pivoted with pandas, on a database written by KdbLoader into the fakeQ
+stand-in, whose answers are built the way qpython decodes them
+
+    python benchMatrix.py -n 500 -f 10 -d 250 -b 50
+'''
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import fakeQ
+fakeQ.install()
+from qpython import qconnection
+from kdbLoader import KdbLoader
+from featureMatrix import FeatureMatrix
+
+logger = logging.getLogger(__name__)
+
+
+def makeDatabase(q, dbdir, numTickers, numFields, numDates):
+    dates = pd.bdate_range('2019-01-02', periods=numDates)
+    tickers = ['T%04d US EQUITY' % n for n in range(numTickers)]
+    fields = ['FIELD_%02d' % n for n in range(numFields)]
+    index = pd.MultiIndex.from_product([dates, tickers, fields], names=['Date', 'Ticker', 'Field']).to_frame(index=False)
+    index['Value'] = np.random.default_rng(0).random(len(index))
+    loader = KdbLoader(q, dbdir)
+    loader.load(index)
+    loader.finish()
+    return loader, dates
+
+
+def pandasPivot(loader, startdate, enddate):
+    df = loader.select(startdate, enddate)
+    wide = df.pivot_table(index='DATE', columns=['TICKER', 'FIELD'], values='VALUE', aggfunc='last')
+    tickers = wide.columns.levels[0]
+    fields = wide.columns.levels[1]
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([tickers, fields]))
+    return wide.values.reshape(len(wide), len(tickers), len(fields))
+
+
+def measure(build, repeat):
+    best = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        values = build()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        best = elapsed if best is None else min(best, elapsed)
+    return values, best, peak
+
+
+def runBenchmark(numTickers=500, numFields=10, numDates=250, blockDays=50, repeat=3):
+    dbdir = tempfile.mkdtemp(prefix='benchMatrix')
+    try:
+        q = qconnection.QConnection(host='localhost', port=0)
+        q.open()
+        loader, dates = makeDatabase(q, dbdir, numTickers, numFields, numDates)
+        start, end = dates[0].strftime('%Y%m%d'), dates[-1].strftime('%Y%m%d')
+        builder = FeatureMatrix(q)
+        builder32 = FeatureMatrix(q, dtype='float32')
+        runs = [('pandas pivot', lambda: pandasPivot(loader, start, end)),
+                ('q pivot float64', lambda: builder.build(start, end).values),
+                ('q pivot float32', lambda: builder32.build(start, end).values),
+                ('q pivot blocks', lambda: builder.build(start, end, blockDays=blockDays).values)]
+        rows = []
+        reference = None
+        for name, build in runs:
+            values, seconds, peak = measure(build, repeat)
+            reference = values if reference is None else reference
+            rows.append({'method': name, 'seconds': seconds, 'peakMB': peak / 1e6, 'resultMB': values.nbytes / 1e6,
+                         'identical': np.allclose(values, reference, equal_nan=True)})
+        df = pd.DataFrame(rows).set_index('method')
+        df['speedup'] = df.seconds.iloc[0] / df.seconds
+        return df
+    finally:
+        shutil.rmtree(dbdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BenchMatrix')
+    parser.add_argument('-n', '--tickers', help='number of tickers', type=int, default=500)
+    parser.add_argument('-f', '--fields', help='number of fields', type=int, default=10)
+    parser.add_argument('-d', '--dates', help='number of dates', type=int, default=250)
+    parser.add_argument('-b', '--blockDays', help='dates per block for the streamed build', type=int, default=50)
+    parser.add_argument('-k', '--repeat', help='best of k runs', type=int, default=3)
+    args = parser.parse_args()
+    return runBenchmark(args.tickers, args.fields, args.dates, args.blockDays, args.repeat)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('matrix builds\n%s' % main().to_string())
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+'''
+Local stand-in for the parts of qpython and a q process used by the analytics package
+
+A q process cannot be run everywhere, so the functions the analytics modules define in q
+(.loader.*, .matrix.*) are answered here in Python over the same on-disk layout: a date partitioned
+database <db>/<yyyy.mm.dd>/<table>/ with one .npy file per column, TICKER and FIELD
+enumerated against the symbols in <root>/sym.json, and par.txt listing the segments of a
+segmented database.  Connections to the same port share one fake process, and as the state
+is on disk, connections from other Python processes see it too.  Statements that define one of
+those q functions are checked against its signature and recorded; a call to a function not yet
+defined, or anything else, raises QException.  The arguments of every function call are typed the
+way qpython's QWriter would send them and checked against the types the q function expects, so an
+argument q would reject with 'type is rejected here too.  Run as a script,
+fakeQ.py -p port takes the place of the q executable for the code that spawns q processes.
+
+    import fakeQ
+    fakeQ.install()
+    import kdbLoader
+'''
+import os
+import re
+import sys
+import json
+import time
+import types
+import threading
+import numpy as np
+import pandas as pd
+
+Q_EPOCH = np.datetime64('2000-01-01', 'D')
+SYM_FILE = 'sym.json'
+PAR_FILE = 'par.txt'
+
+QSYMBOL_LIST = -11
+QSTRING = 10
+QSTRING_LIST = 0
+
+# q types as QWriter sends python values: atoms negative, lists positive, 0 a general list
+QTYPES = {np.bool_: -1, bool: -1, np.int16: -5, np.int32: -6, int: -6, np.int64: -7, np.float32: -8, float: -9, np.float64: -9}
+QLIST_TYPES = {'b1': 1, 'i2': 5, 'i4': 6, 'i8': 7, 'f4': 8, 'f8': 9, 'S': 11, 'U': 11}
+
+# the argument types of the q functions; a list gives the item types of a general list, a tuple
+# (0, t) a general list of any length whose items all have type t.  .loader.part is only called
+# from within q, its definition is checked against the signature
+SIGNATURES = {'.loader.part': [-11, -11, -11, 98, 14],
+              '.loader.write': [-11, -11, 11, [6, 11, 11, 9], [6, 11, 11, (0, QSTRING)]],
+              '.loader.sort': [11],
+              '.loader.finish': [-11, 11],
+              '.loader.sym': [-11, 11],
+              '.loader.segments': [-11, (0, QSTRING)],
+              '.loader.select': [-11, -6, -6, 11, 11],
+              '.loader.open': [-11],
+              '.loader.version': [-11],
+              '.matrix.axes': [-11, -6, -6, 11, 11],
+              '.matrix.dates': [-6, -6],
+              '.matrix.pivot': [-11, -6, -6, 11, 11, -10]}
+
+# seconds each query holds the process, q answers the queries of a process one at a time
+LATENCY = 0.0
+# constant expressions answered as q would, e.g. the pool health check
+LITERALS = {'1b': True, '::': None}
+
+STATS = {'queries': 0, 'partitionsRead': 0}
+PROCESSES = {}
+_lock = threading.Lock()
+
+DEFINITION = re.compile(r'^\s*(\.[\w.]+)\s*:')
+PARAMETERS = re.compile(r'\s*\{\[([^\]]*)\]')
+
+
+class QException(Exception):
+    pass
+
+
+def qlist(array, adjust_dtype=True, **meta):
+    return np.asarray(array)
+
+
+def configure(latency=None):
+    global LATENCY
+    if latency is not None:
+        LATENCY = latency
+
+
+def resetStats():
+    for key in STATS:
+        STATS[key] = 0
+
+
+def install():
+    ## make "from qpython import qconnection" and friends resolve to this module
+    module = sys.modules[__name__]
+    package = types.ModuleType('qpython')
+    package.__path__ = []
+    package.qconnection = module
+    package.qcollection = module
+    package.qtype = module
+    sys.modules['qpython'] = package
+    for name in ('qconnection', 'qcollection', 'qtype'):
+        sys.modules['qpython.' + name] = module
+    return module
+
+
+def qtype(value, singleCharStrings=False):
+    ## the q type QWriter serializes value as
+    if value is None:
+        return 101
+    if isinstance(value, np.bytes_):
+        return -11
+    if isinstance(value, (str, bytes)):
+        return -10 if len(value) == 1 and not singleCharStrings else QSTRING
+    if isinstance(value, (list, tuple)):
+        return 0
+    if isinstance(value, pd.DataFrame):
+        return 98
+    if isinstance(value, np.ndarray):
+        kind = value.dtype.kind + ('' if value.dtype.kind in 'SU' else str(value.dtype.itemsize))
+        return QLIST_TYPES.get(kind, 0)
+    return QTYPES.get(type(value))
+
+
+def checkTypes(name, params, signature, singleCharStrings=False):
+    ## raise QException('type) where q would not accept the argument types of a function call
+    if len(params) != len(signature):
+        raise QException('rank: %s takes %s arguments, got %s' % (name, len(signature), len(params)))
+    for n, (value, expected) in enumerate(zip(params, signature)):
+        if isinstance(expected, list):
+            if qtype(value, singleCharStrings) != 0:
+                raise QException('type: argument %s of %s is %s, expected a general list' % (n, name, qtype(value, singleCharStrings)))
+            checkTypes(name, value, expected, singleCharStrings)
+        elif isinstance(expected, tuple):
+            if qtype(value, singleCharStrings) != 0:
+                raise QException('type: argument %s of %s is %s, expected a general list' % (n, name, qtype(value, singleCharStrings)))
+            checkTypes(name, value, [expected[1]] * len(value), singleCharStrings)
+        elif qtype(value, singleCharStrings) != expected:
+            raise QException('type: argument %s of %s is %s, expected %s' % (n, name, qtype(value, singleCharStrings), expected))
+
+
+def decode(value):
+    if isinstance(value, (bytes, np.bytes_)):
+        return value.decode('latin-1')
+    return str(value)
+
+
+def dbPath(db):
+    return decode(db).lstrip(':')
+
+
+def partitionName(day):
+    return str(Q_EPOCH + np.timedelta64(int(day), 'D')).replace('-', '.')
+
+
+def partitionDate(name):
+    try:
+        return np.datetime64(name.replace('.', '-'), 'D')
+    except ValueError:
+        return None
+
+
+class Database(object):
+    ## the symbols and the partitions of a database directory
+    def __init__(self, path):
+        self.path = path
+        symFile = os.path.join(path, SYM_FILE)
+        self.syms = json.load(open(symFile)) if os.path.exists(symFile) else []
+        self.index = dict((sym, n) for n, sym in enumerate(self.syms))
+
+    def enumerate(self, values):
+        values = [decode(v) for v in values]
+        codes = np.array([self.index.setdefault(v, len(self.index)) for v in values], dtype=np.int32)
+        if len(self.index) > len(self.syms):
+            self.syms = sorted(self.index, key=self.index.get)
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, SYM_FILE), 'w') as f:
+                json.dump(self.syms, f)
+        return codes
+
+    def segments(self):
+        parFile = os.path.join(self.path, PAR_FILE)
+        if os.path.exists(parFile):
+            return [line.strip() for line in open(parFile) if line.strip()]
+        return [self.path]
+
+    def partitions(self):
+        ## (date, partition directory) over all segments, a date may be in several segments
+        partitions = []
+        for segment in self.segments():
+            if os.path.isdir(segment):
+                partitions += [(partitionDate(name), os.path.join(segment, name)) for name in os.listdir(segment) if partitionDate(name) is not None]
+        return sorted(partitions)
+
+
+def readSplay(path):
+    meta = json.load(open(os.path.join(path, '.d')))
+    return dict((column, np.load(os.path.join(path, column + '.npy'), allow_pickle=True)) for column in meta['columns']), meta
+
+
+def writeSplay(path, columns, attributes=None):
+    os.makedirs(path, exist_ok=True)
+    for column, values in columns.items():
+        np.save(os.path.join(path, column + '.npy'), values, allow_pickle=values.dtype == object)
+    with open(os.path.join(path, '.d'), 'w') as f:
+        json.dump({'columns': list(columns), 'attributes': attributes or {}}, f)
+
+
+class FakeQProcess(object):
+    def __init__(self, port):
+        self.port = port
+        self.lock = threading.RLock()
+        self.defined = {}
+        self.loaded = None
+        self.functions = {'.loader.write': self.write,
+                          '.loader.sort': self.sort,
+                          '.loader.finish': self.finish,
+                          '.loader.sym': self.sym,
+                          '.loader.segments': self.loadSegments,
+                          '.loader.select': self.select,
+                          '.loader.open': self.open,
+                          '.loader.version': self.version,
+                          '.matrix.axes': self.axes,
+                          '.matrix.dates': self.dates,
+                          '.matrix.pivot': self.pivot}
+
+    def execute(self, query, *params, **options):
+        with self.lock:
+            STATS['queries'] += 1
+            if LATENCY:
+                time.sleep(LATENCY)
+            query = decode(query)
+            if not params and query.strip() in LITERALS:
+                return LITERALS[query.strip()]
+            if not params:
+                match = DEFINITION.match(query)
+                if match:
+                    self.define(match.group(1), query[match.end():])
+                    self.defined[match.group(1)] = query
+                    return None
+            function = self.functions.get(query.strip())
+            if function is None:
+                raise QException('fake q does not evaluate: %s' % query[:80])
+            if query.strip() not in self.defined:
+                ## q reports an undefined name with the name itself
+                raise QException(query.strip())
+            checkTypes(query.strip(), params, SIGNATURES[query.strip()], options.get('single_char_strings', False))
+            return function(*params)
+
+    def define(self, name, body):
+        ## a definition must be of a function stood in for here, taking the arguments its signature checks
+        if name not in SIGNATURES:
+            raise QException('fake q does not stand in for %s' % name)
+        match = PARAMETERS.match(body)
+        count = len(match.group(1).split(';')) if match else 0
+        if count != len(SIGNATURES[name]):
+            raise QException('rank: %s is defined with %s parameters, fake q checks %s' % (name, count, len(SIGNATURES[name])))
+
+    def calls(self, name):
+        ## a q function calls name, which must be defined in the process as well
+        if name not in self.defined:
+            raise QException(name)
+
+    def part(self, root, db, table, days, tickers, fields, values, allDays):
+        ## append the rows to their date partitions of table, the partition paths written
+        parts = []
+        tickers = root.enumerate(tickers)
+        fields = root.enumerate(fields)
+        for day in allDays:
+            rows = np.flatnonzero(days == day)
+            path = os.path.join(db, partitionName(day), table)
+            columns = {'TICKER': tickers[rows], 'FIELD': fields[rows], 'VALUE': values[rows]}
+            if os.path.exists(os.path.join(path, '.d')):
+                existing, meta = readSplay(path)
+                columns = dict((c, np.concatenate([existing[c], columns[c]])) for c in columns)
+            writeSplay(path, columns)
+            parts.append(':' + path + '/')
+        return parts
+
+    def write(self, root, db, tables, floats, strings):
+        self.calls('.loader.part')
+        root = Database(dbPath(root))
+        db = dbPath(db)
+        floatDays, floatTickers, floatFields, floatValues = floats
+        stringDays, stringTickers, stringFields, stringValues = strings
+        floatDays, stringDays = np.asarray(floatDays), np.asarray(stringDays)
+        ## both tables in every date of the batch
+        allDays = np.unique(np.concatenate([floatDays, stringDays]))
+        parts = self.part(root, db, decode(tables[0]), floatDays, floatTickers, floatFields, np.asarray(floatValues, dtype=float), allDays)
+        parts += self.part(root, db, decode(tables[1]), stringDays, stringTickers, stringFields,
+                           np.array(list(stringValues) + [None], dtype=object)[:-1], allDays)
+        return [p.encode('latin-1') for p in parts]
+
+    def sort(self, parts):
+        ## xasc by TICKER then FIELD on the symbol text, p# on TICKER
+        parts = list(dict.fromkeys(dbPath(p).rstrip('/') for p in parts))
+        for part in parts:
+            root = self.rootOf(part)
+            columns, meta = readSplay(part)
+            syms = np.array(root.syms, dtype=object)
+            order = np.lexsort((syms[columns['FIELD']], syms[columns['TICKER']]))
+            writeSplay(part, dict((c, v[order]) for c, v in columns.items()), {'TICKER': 'p'})
+        return len(parts)
+
+    def rootOf(self, part):
+        ## the database whose sym file the partition is enumerated against
+        path = os.path.dirname(os.path.dirname(part))
+        while not os.path.exists(os.path.join(path, SYM_FILE)) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return Database(path)
+
+    def finish(self, db, parts):
+        self.calls('.loader.sort')
+        count = self.sort(parts)
+        self.loaded = dbPath(db)
+        return count
+
+    def open(self, db):
+        self.loaded = dbPath(db)
+        return len(set(day for day, path in Database(self.loaded).partitions()))
+
+    def sym(self, root, syms):
+        return len(Database(dbPath(root)).enumerate(syms))
+
+    def loadSegments(self, root, segments):
+        root = dbPath(root)
+        with open(os.path.join(root, PAR_FILE), 'w') as f:
+            f.write(''.join(decode(segment) + '\n' for segment in segments))
+        self.loaded = root
+        return len(segments)
+
+    def select(self, table, d0, d1, tickers, fields):
+        if self.loaded is None:
+            raise QException('no database loaded')
+        db = Database(self.loaded)
+        table = decode(table)
+        start = Q_EPOCH + np.timedelta64(int(d0), 'D')
+        end = Q_EPOCH + np.timedelta64(int(d1), 'D')
+        syms = np.array(db.syms, dtype=object)
+        tickerCodes = [db.index[decode(t)] for t in tickers if decode(t) in db.index]
+        fieldCodes = [db.index[decode(f)] for f in fields if decode(f) in db.index]
+        frames = []
+        ## only the partitions in the date range are mapped
+        for day, path in db.partitions():
+            if not start <= day <= end:
+                continue
+            STATS['partitionsRead'] += 1
+            columns, meta = readSplay(os.path.join(path, table))
+            mask = np.ones(len(columns['VALUE']), dtype=bool)
+            if len(tickers):
+                mask &= np.isin(columns['TICKER'], tickerCodes)
+            if len(fields):
+                mask &= np.isin(columns['FIELD'], fieldCodes)
+            frames.append(pd.DataFrame({'date': np.full(mask.sum(), day).astype('datetime64[ns]'),
+                                        'TICKER': [s.encode('latin-1') for s in syms[columns['TICKER'][mask]]],
+                                        'FIELD': [s.encode('latin-1') for s in syms[columns['FIELD'][mask]]],
+                                        'VALUE': columns['VALUE'][mask]}))
+        if not frames:
+            return pd.DataFrame(columns=['date', 'TICKER', 'FIELD', 'VALUE'])
+        return pd.concat(frames, ignore_index=True)
+
+    def rows(self, table, d0, d1, tickers, fields):
+        ## (date, ticker code, field code, value) of the matching rows, the symbols of the database
+        if self.loaded is None:
+            raise QException('no database loaded')
+        db = Database(self.loaded)
+        start = Q_EPOCH + np.timedelta64(int(d0), 'D')
+        end = Q_EPOCH + np.timedelta64(int(d1), 'D')
+        tickerCodes = [db.index[decode(t)] for t in tickers if decode(t) in db.index]
+        fieldCodes = [db.index[decode(f)] for f in fields if decode(f) in db.index]
+        parts = []
+        for day, path in db.partitions():
+            if not start <= day <= end:
+                continue
+            STATS['partitionsRead'] += 1
+            columns, meta = readSplay(os.path.join(path, decode(table)))
+            mask = np.ones(len(columns['VALUE']), dtype=bool)
+            if len(tickers):
+                mask &= np.isin(columns['TICKER'], tickerCodes)
+            if len(fields):
+                mask &= np.isin(columns['FIELD'], fieldCodes)
+            parts.append((np.full(mask.sum(), day), columns['TICKER'][mask], columns['FIELD'][mask], columns['VALUE'][mask]))
+        if not parts:
+            return (np.array([], dtype='datetime64[D]'), np.array([], dtype=np.int32), np.array([], dtype=np.int32), np.array([])), db
+        return tuple(np.concatenate(column) for column in zip(*parts)), db
+
+    def axes(self, table, d0, d1, tickers, fields):
+        (days, tickerCodes, fieldCodes, values), db = self.rows(table, d0, d1, tickers, fields)
+        syms = np.array(db.syms, dtype=object)
+        return [np.array(sorted(syms[np.unique(codes)]), dtype=object).astype('S') for codes in (tickerCodes, fieldCodes)]
+
+    def dates(self, d0, d1):
+        start = Q_EPOCH + np.timedelta64(int(d0), 'D')
+        end = Q_EPOCH + np.timedelta64(int(d1), 'D')
+        days = sorted(set(day for day, path in Database(self.loaded).partitions() if start <= day <= end))
+        return (np.array(days, dtype='datetime64[D]') - Q_EPOCH).astype(np.int32)
+
+    def pivot(self, table, d0, d1, tickers, fields, dtype):
+        ## the scatter of .matrix.pivot into a flat date, ticker, field vector
+        (days, tickerCodes, fieldCodes, values), db = self.rows(table, d0, d1, tickers, fields)
+        dates = self.dates(d0, d1)
+        ## position of each symbol code on the ticker and field axes
+        tickerIndex, fieldIndex = np.zeros(len(db.syms), dtype=np.int64), np.zeros(len(db.syms), dtype=np.int64)
+        for index, axis in ((tickerIndex, tickers), (fieldIndex, fields)):
+            for n, sym in enumerate(decode(s) for s in axis):
+                if sym in db.index:
+                    index[db.index[sym]] = n
+        nt, nf = len(tickers), len(fields)
+        out = np.full(len(dates) * nt * nf, np.nan, dtype=np.float32 if decode(dtype) == 'e' else np.float64)
+        dayIndex = np.searchsorted(dates, (days - Q_EPOCH).astype(np.int32))
+        out[(dayIndex * nt + tickerIndex[tickerCodes]) * nf + fieldIndex[fieldCodes]] = values
+        return [dates, out]
+
+    def version(self, table):
+        ## the rows of table in each date partition, summed over the segments
+        if self.loaded is None:
+            raise QException('no database loaded')
+        table = decode(table)
+        rows = {}
+        for day, path in Database(self.loaded).partitions():
+            meta = os.path.join(path, table, 'VALUE.npy')
+            if os.path.exists(meta):
+                rows[day] = rows.get(day, 0) + len(np.load(meta, mmap_mode='r', allow_pickle=True))
+        return pd.DataFrame({'date': np.array(sorted(rows), dtype='datetime64[D]').astype('datetime64[ns]'),
+                             'rows': np.array([rows[day] for day in sorted(rows)], dtype=np.int64)})
+
+
+class QConnection(object):
+    ## the qpython QConnection calls used by the analytics package
+    def __init__(self, host, port, username=None, password=None, timeout=None, encoding='latin-1', reader_class=None, writer_class=None, **options):
+        self.host = host
+        self.port = port
+        self.options = options
+        self.process = None
+        # set to make the next queries fail as on a dropped socket
+        self.broken = False
+
+    def open(self):
+        with _lock:
+            self.process = PROCESSES.setdefault(self.port, FakeQProcess(self.port))
+
+    def close(self):
+        self.process = None
+
+    def is_connected(self):
+        return self.process is not None
+
+    def sendSync(self, query, *parameters, **options):
+        if self.process is None:
+            raise QException('connection is closed')
+        if self.broken:
+            raise ConnectionResetError('fake q connection reset')
+        return self.process.execute(query, *parameters, **options)
+
+    def __call__(self, *parameters, **options):
+        return self.sendSync(parameters[0], *parameters[1:], **options)
+
+
+if __name__ == '__main__':
+    ## stands in for the q executable when a process is spawned: holds the port until terminated
+    import socket
+    import argparse
+    parser = argparse.ArgumentParser(prog='fakeQ')
+    parser.add_argument('-p', '--port', type=int, default=5000)
+    args = parser.parse_args()
+    server = socket.socket()
+    server.bind(('', args.port))
+    server.listen(1)
+    while True:
+        time.sleep(60)
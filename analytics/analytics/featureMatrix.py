@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+'''
+Dense (date x ticker x field) feature tensors from the long format kdb+ market data tables
+
+The pivot is done in q: the rows of a date range are scattered into one flat float vector in
+date, ticker, field order with nulls where there is no value, and sent with the three axes.
+qpython decodes the vector straight into a numpy array, which is reshaped without a copy, so no
+DataFrame is built on either side.  The tickers and fields are given, or the distinct ones of
+the range are looked up first; the dates are the date partitions in the range.  Values come as
+float64 or, to halve the transfer, float32.
+
+For ranges that do not fit in memory, blocks() yields the tensor blockDays partition dates at a
+time over fixed ticker and field axes, fetching the next block on a background thread while the
+current one is used (give q a QConnectionPool if the caller queries too), and build() can write the blocks into a .npy file memory mapped on disk:
+
+    builder = FeatureMatrix(q)
+    m = builder.build('20190101', '20191231', fields=['PX_LAST', 'PX_VOLUME'])
+    m.values[:, m.tickers.index('IBM US EQUITY'), 0]
+    for block in builder.blocks('20100101', '20191231', blockDays=250):
+        model.partial_fit(block.values.reshape(len(block.dates), -1))
+'''
+import logging
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from kdbLoader import FLOAT_TABLE, Q_EPOCH, toQDates, toSymbols, fromSymbols
+
+logger = logging.getLogger(__name__)
+
+BLOCK_DAYS = 250
+# the q type of the values, sent as a char atom
+DTYPES = {'float64': 'f', 'float32': 'e'}
+
+##############################################################################################
+# q functions defined in the target process
+##############################################################################################
+Q_FUNCTIONS = [
+    ('.matrix.axes', '''{[t;d0;d1;tk;fd]
+        c:enlist (within;`date;"d"$d0,d1);
+        if[count tk; c,:enlist (in;`TICKER;enlist tk)];
+        if[count fd; c,:enlist (in;`FIELD;enlist fd)];
+        x:?[t;c;0b;`TICKER`FIELD!`TICKER`FIELD];
+        (asc distinct x`TICKER;asc distinct x`FIELD)}'''),
+    ('.matrix.dates', '''{[d0;d1]
+        "i"$asc distinct .Q.pv where .Q.pv within "d"$d0,d1}'''),
+    ('.matrix.pivot', '''{[t;d0;d1;tk;fd;ty]
+        c:(enlist (within;`date;"d"$d0,d1)),enlist (in;`TICKER;enlist tk);
+        c,:enlist (in;`FIELD;enlist fd);
+        x:?[t;c;0b;`date`TICKER`FIELD`VALUE!`date`TICKER`FIELD`VALUE];
+        ds:asc distinct .Q.pv where .Q.pv within "d"$d0,d1; nt:count tk; nf:count fd;
+        v:(count[ds]*nt*nf)#$[ty="e";0Ne;0n];
+        v:@[v;(nt*nf*ds?x`date)+(nf*tk?x`TICKER)+fd?x`FIELD;:;ty$x`VALUE];
+        ("i"$ds;v)}'''),
+]
+
+FeatureBlock = namedtuple('FeatureBlock', ['dates', 'tickers', 'fields', 'values'])
+
+
+def fromQDates(days):
+    return Q_EPOCH + np.asarray(days, dtype='timedelta64[D]')
+
+
+class FeatureMatrix(object):
+    def __init__(self, q, table=FLOAT_TABLE, dtype='float64'):
+        if dtype not in DTYPES:
+            raise ValueError('dtype must be one of %s' % ', '.join(DTYPES))
+        self.q = q
+        self.table = table
+        self.dtype = np.dtype(dtype)
+        self.defined = False
+
+    def define(self):
+        if not self.defined:
+            ## a connection pool runs the definitions on each of its connections
+            send = getattr(self.q, 'broadcast', self.q.sendSync)
+            for name, body in Q_FUNCTIONS:
+                send('%s:%s' % (name, ' '.join(line.strip() for line in body.splitlines())))
+            self.defined = True
+
+    def axes(self, startdate, enddate, tickers=None, fields=None):
+        ## the ticker and field axes: as given, or the distinct ones with data in the range
+        if tickers and fields:
+            return list(tickers), list(fields)
+        self.define()
+        d0, d1 = toQDates([startdate, enddate])
+        found = self.q.sendSync('.matrix.axes', np.bytes_(self.table.encode()), int(d0), int(d1), toSymbols(tickers or []), toSymbols(fields or []))
+        return list(tickers or fromSymbols(found[0])), list(fields or fromSymbols(found[1]))
+
+    def dates(self, startdate, enddate):
+        ## the partition dates in the range
+        self.define()
+        d0, d1 = toQDates([startdate, enddate])
+        return fromQDates(self.q.sendSync('.matrix.dates', int(d0), int(d1)))
+
+    def pivot(self, d0, d1, tickers, fields):
+        ## one block of the partition dates d0..d1 over fixed axes; the values are reshaped in place
+        self.define()
+        days, values = self.q.sendSync('.matrix.pivot', np.bytes_(self.table.encode()), int(d0), int(d1), toSymbols(tickers), toSymbols(fields),
+                                       DTYPES[self.dtype.name])
+        values = np.asarray(values)
+        if values.dtype != self.dtype:
+            values = values.astype(self.dtype)
+        return FeatureBlock(fromQDates(days), tickers, fields, values.reshape(len(days), len(tickers), len(fields)))
+
+    def build(self, startdate, enddate, tickers=None, fields=None, blockDays=None, path=None):
+        '''
+        the tensor of a date range in one query, or with blockDays assembled block by block,
+        into memory or into a .npy file at path whose values are returned memory mapped
+        '''
+        tickers, fields = self.axes(startdate, enddate, tickers, fields)
+        if path is None and blockDays is None:
+            d0, d1 = toQDates([startdate, enddate])
+            return self.pivot(d0, d1, tickers, fields)
+        dates = self.dates(startdate, enddate)
+        blocks = self.blocks(startdate, enddate, tickers, fields, blockDays or BLOCK_DAYS, dates)
+        if path is None:
+            values = np.empty((len(dates), len(tickers), len(fields)), self.dtype)
+        else:
+            values = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=(len(dates), len(tickers), len(fields)))
+        start = 0
+        for block in blocks:
+            values[start:start + len(block.dates)] = block.values
+            start += len(block.dates)
+        if path is not None:
+            values.flush()
+        return FeatureBlock(dates, tickers, fields, values)
+
+    def blocks(self, startdate, enddate, tickers=None, fields=None, blockDays=BLOCK_DAYS, dates=None):
+        '''
+        generator of FeatureBlocks of up to blockDays partition dates over the same ticker and
+        field axes; the next block is fetched by a background thread while one is consumed
+        '''
+        tickers, fields = self.axes(startdate, enddate, tickers, fields)
+        dates = self.dates(startdate, enddate) if dates is None else dates
+        days = toQDates(dates)
+        ranges = [(days[n], days[min(n + blockDays, len(days)) - 1]) for n in range(0, len(days), blockDays)]
+        if not ranges:
+            return
+        with ThreadPoolExecutor(1, thread_name_prefix='matrix') as prefetch:
+            pending = prefetch.submit(self.pivot, ranges[0][0], ranges[0][1], tickers, fields)
+            for d0, d1 in ranges[1:]:
+                block = pending.result()
+                pending = prefetch.submit(self.pivot, d0, d1, tickers, fields)
+                yield block
+            yield pending.result()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+'''
+Parallel ingest of Bloomberg downloads into a segmented kdb+ database
+
+ingest() starts one q process per worker with qconnection's spawnQProcess, or uses the running
+instances given as host:port,host:port, and splits the download files into disjoint sets of
+about equal size.  The symbols of all the files are enumerated into <root>/sym once up front,
+so the workers only read the sym file while they load.  Each worker is a Python process with
+its own connection that loads its files into its own segment <root>/seg<n> with KdbLoader and
+sorts the partitions it wrote; the segments are then listed in <root>/par.txt and the database
+is loaded once.  A date can be in several segments, q unions them in every query.
+
+Process startup, load time and rows per second are reported per worker:
+
+    stats = ingest(args, '/data/bloomberg', '/data/kdb/marketdata', workers=8)
+'''
+import os
+import time
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import qconnection
+
+logger = logging.getLogger(__name__)
+
+SEGMENT = 'seg%d'
+
+
+def splitFiles(files, workers):
+    ## largest first onto the least loaded worker
+    groups = [[] for _ in range(workers)]
+    sizes = np.zeros(workers)
+    for path in sorted(files, key=os.path.getsize, reverse=True):
+        n = int(np.argmin(sizes))
+        groups[n].append(path)
+        sizes[n] += os.path.getsize(path)
+    return [sorted(group) for group in groups]
+
+
+def collectSymbols(files):
+    ## the distinct tickers and fields of the files, only those two columns are read
+    from kdbLoader import readFile
+    syms = set()
+    for path in files:
+        df = readFile(path, columns=['Ticker', 'Field'])
+        syms.update(df.Ticker.unique())
+        syms.update(df.Field.unique())
+    return sorted(syms)
+
+
+def startWorker(args, instance=None):
+    ## (Singleton, startup seconds) of a spawned or running q process
+    started = time.time()
+    worker = qconnection.QConnection.Singleton()
+    workerArgs = argparse.Namespace(**vars(args))
+    workerArgs.qinstance = instance
+    if worker.connect(workerArgs) is None:
+        raise Exception('unable to start q worker %s' % (instance or ''))
+    return worker, time.time() - started
+
+
+def loadSegment(task):
+    '''
+    load the files of one worker into its segment over a connection of its own; runs in a pool
+    process, the qpython modules are imported here so a stand-in can be installed first
+    '''
+    if task.get('fake'):
+        import fakeQ
+        fakeQ.install()
+    from qpython import qconnection as qpython
+    from kdbLoader import KdbLoader
+
+    started = time.time()
+    q = qpython.QConnection(host=task['host'], port=task['port'], pandas=True)
+    q.open()
+    try:
+        loader = KdbLoader(q, task['segment'], batchRows=task['batchRows'], root=task['root'])
+        rows = loader.loadFiles(task['files'])
+        partitions = loader.finish(load=False)
+    finally:
+        q.close()
+    elapsed = time.time() - started
+    return {'worker': task['worker'], 'port': task['port'], 'files': len(task['files']), 'rows': rows, 'partitions': partitions,
+            'loadSeconds': elapsed, 'rowsPerSecond': rows / elapsed if elapsed else 0.0}
+
+
+def ingest(args, path, dbdir, workers=4, batchRows=None, fake=False):
+    '''
+    load a download file or directory into the segmented database at dbdir with workers q
+    processes; args carries qpath for spawning, or qinstance with a comma separated list of
+    running instances.  Returns a frame of the statistics per worker
+    '''
+    from kdbLoader import KdbLoader, listFiles, toSymbols, BATCH_ROWS
+
+    root = os.path.abspath(dbdir)
+    files = listFiles(path)
+    if not files:
+        raise Exception('no download files in %s' % path)
+    instances = args.qinstance.split(',') if getattr(args, 'qinstance', None) else [None] * workers
+    workers = len(instances)
+    started = []
+    try:
+        ## start the q processes together, each spawn waits for its process to come up
+        with ThreadPoolExecutor(workers) as pool:
+            started = list(pool.map(lambda instance: startWorker(args, instance), instances))
+        main = started[0][0].qconn
+
+        os.makedirs(root, exist_ok=True)
+        loader = KdbLoader(main, root)
+        loader.define()
+        syms = collectSymbols(files)
+        main.sendSync('.loader.sym', np.bytes_(root.encode()), toSymbols(syms))
+
+        tasks = [{'worker': n, 'host': worker.qconn.host, 'port': worker.qconn.port, 'files': group,
+                  'root': root, 'segment': os.path.join(root, SEGMENT % n), 'batchRows': batchRows or BATCH_ROWS, 'fake': fake}
+                 for n, ((worker, seconds), group) in enumerate(zip(started, splitFiles(files, workers))) if group]
+        loadStarted = time.time()
+        with ProcessPoolExecutor(len(tasks)) as pool:
+            stats = list(pool.map(loadSegment, tasks))
+        loadSeconds = time.time() - loadStarted
+
+        ## one load of the whole database over all the segments
+        parFile = os.path.join(root, 'par.txt')
+        segments = [line.strip() for line in open(parFile)] if os.path.exists(parFile) else []
+        segments += [task['segment'] for task in tasks if task['segment'] not in segments]
+        main.sendSync('.loader.segments', np.bytes_(root.encode()), [segment for segment in segments if segment], single_char_strings=True)
+    finally:
+        for worker, seconds in started:
+            worker.stop()
+
+    df = pd.DataFrame(stats).set_index('worker')
+    df.insert(2, 'startSeconds', [started[n][1] for n in df.index])
+    total = df.rows.sum()
+    logger.info('ingested %s rows from %s files with %s workers in %.2fs, %.0f rows per second\n%s'
+                % (total, len(files), len(tasks), loadSeconds, total / loadSeconds if loadSeconds else 0.0, df))
+    return df
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+'''
+Bulk loader from Bloomberg downloads into a date partitioned kdb+ database over IPC
+
+The downloads are read as typed columns (parquet or feather written by bloombergReader, or the
+older csv files) and pushed over a qpython connection in batches of BATCH_ROWS rows: dates as
+days since 2000.01.01, TICKER and FIELD as symbol vectors and VALUE as floats, with the text
+values going to the string table in the same call.  The q side splits each batch by date and
+appends it to <db>/<date>/<table>, both tables for every date of the batch, enumerating the
+symbols against <root>/sym, where root is db itself unless db is a segment of a larger database.
+finish() sorts every partition written by TICKER and FIELD, sets the p# attribute on TICKER and
+loads the database.  The date is the partition column, so a query on a
+date range or on tickers maps only the partitions it needs.  With a QueryCache, repeated
+selects are answered from memory or disk for as long as the partitions are unchanged:
+
+    loader = KdbLoader(q, '/data/kdb/marketdata')
+    loader.loadFiles(['/data/bloomberg/marketdata.parquet'])
+    loader.finish()
+    df = loader.select('20190101', '20191231', tickers=['IBM US EQUITY'])
+'''
+import os
+import sys
+import glob
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+from qpython.qcollection import qlist
+from qpython.qtype import QSYMBOL_LIST, QSTRING_LIST
+
+## journal is shared with the sibling backtests package
+BACKTESTS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtests'))
+if BACKTESTS not in sys.path:
+    sys.path.append(BACKTESTS)
+import journal
+
+logger = logging.getLogger(__name__)
+
+FLOAT_TABLE = 'mktdata'
+STRING_TABLE = 'mktstrings'
+BATCH_ROWS = 1000000
+Q_EPOCH = np.datetime64('2000-01-01', 'D')
+FILE_TYPES = ('.parquet', '.feather', '.csv')
+
+##############################################################################################
+# q functions defined in the target process, the tables are passed as symbols
+##############################################################################################
+Q_FUNCTIONS = [
+    ('.loader.part', '''{[root;db;t;x;days]
+        {[root;db;t;x;dt] p:` sv .Q.par[db;dt;t],`; p upsert .Q.en[root] delete d from select from x where d=dt; p}[root;db;t;x] each days}'''),
+    ('.loader.write', '''{[root;db;tables;floats;strings]
+        root:hsym root; db:hsym db;
+        f:update d:"d"$d from flip `d`TICKER`FIELD`VALUE!floats;
+        s:update d:"d"$d from flip `d`TICKER`FIELD`VALUE!strings;
+        days:distinct f[`d],s[`d];
+        .loader.part[root;db;tables 0;f;days],.loader.part[root;db;tables 1;s;days]}'''),
+    ('.loader.sort', '''{[parts]
+        {`TICKER`FIELD xasc x; @[x;`TICKER;`p#]} each distinct parts;
+        count distinct parts}'''),
+    ('.loader.finish', '''{[db;parts]
+        n:.loader.sort parts;
+        system "l ",1_string hsym db;
+        n}'''),
+    ('.loader.sym', '''{[root;syms]
+        count (` sv hsym[root],`sym)?syms}'''),
+    ('.loader.segments', '''{[root;segs]
+        root:hsym root;
+        (` sv root,`par.txt) 0: segs;
+        system "l ",1_string root;
+        count segs}'''),
+    ('.loader.select', '''{[t;d0;d1;tk;fd]
+        c:enlist (within;`date;"d"$d0,d1);
+        if[count tk; c,:enlist (in;`TICKER;enlist tk)];
+        if[count fd; c,:enlist (in;`FIELD;enlist fd)];
+        ?[t;c;0b;()]}'''),
+    ('.loader.open', '''{[db]
+        system "l ",1_string hsym db;
+        count .Q.pv}'''),
+    ('.loader.version', '''{[t]
+        ([] date:.Q.pv; rows:.Q.cn value t)}'''),
+]
+
+
+def toQDates(dates):
+    ## days since the q epoch 2000.01.01, sent as ints and cast to dates in q
+    days = pd.to_datetime(dates).values.astype('datetime64[D]')
+    return (days - Q_EPOCH).astype(np.int32)
+
+
+def toSymbols(values):
+    ## a q symbol vector, each distinct string is encoded once
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    encoded = np.char.encode(np.asarray(uniques, dtype=str), 'latin-1') if len(uniques) else np.array([], dtype='S1')
+    return qlist(encoded[codes], qtype=QSYMBOL_LIST)
+
+
+def fromSymbols(values):
+    return [v.decode('latin-1') if isinstance(v, bytes) else v for v in values]
+
+
+def splitValues(df):
+    '''
+    (floats, strings) frames of Date, Ticker, Field, Value from a download; the files carry the
+    text values in a Text column, csv files written before it in Value itself
+    '''
+    if 'Text' in df.columns:
+        text = df.Text.notnull().values
+        strings = df.loc[text, ['Date', 'Ticker', 'Field', 'Text']].rename(columns={'Text': 'Value'})
+        return df.loc[~text, ['Date', 'Ticker', 'Field', 'Value']], strings
+    values = pd.to_numeric(df.Value, errors='coerce')
+    text = (values.isnull() & df.Value.notnull()).values
+    floats = df.loc[~text, ['Date', 'Ticker', 'Field']].assign(Value=values[~text].values)
+    return floats, df.loc[text, ['Date', 'Ticker', 'Field', 'Value']]
+
+
+def readFile(path, columns=None):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    if path.endswith('.feather'):
+        return pd.read_feather(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def listFiles(path):
+    ## a file, or the completed download files in a directory
+    if os.path.isfile(path):
+        return [path]
+    return sorted(f for ext in FILE_TYPES for f in glob.glob(os.path.join(path, '*' + ext)))
+
+
+class KdbLoader(object):
+    def __init__(self, q, dbdir, floatTable=FLOAT_TABLE, stringTable=STRING_TABLE, batchRows=BATCH_ROWS, root=None, cache=None):
+        self.q = q
+        self.dbdir = os.path.abspath(dbdir)
+        self.root = os.path.abspath(root or dbdir)
+        self.tables = [floatTable, stringTable]
+        self.batchRows = batchRows
+        self.parts = set()
+        self.rows = [0, 0]
+        self.defined = False
+        self.cache = cache
+        self.versions = {}
+
+    def define(self):
+        if not self.defined:
+            ## a connection pool runs the definitions on each of its connections
+            send = getattr(self.q, 'broadcast', self.q.sendSync)
+            for name, body in Q_FUNCTIONS:
+                send('%s:%s' % (name, ' '.join(line.strip() for line in body.splitlines())))
+            self.defined = True
+
+    def columns(self, df, text=False):
+        ## typed vectors for every column, an empty batch too: VALUE is a float vector, or with text a
+        ## general list of char vectors
+        if text:
+            values = qlist(np.array([str(value) for value in df.Value], dtype=object), qtype=QSTRING_LIST)
+        else:
+            values = np.asarray(df.Value.values, dtype=float)
+        return [toQDates(df.Date), toSymbols(df.Ticker.values), toSymbols(df.Field.values), values]
+
+    def load(self, df):
+        ## append a frame of Date, Ticker, Field, Value (and Text) to the partitions, batchRows at a time
+        self.define()
+        for start in range(0, len(df), self.batchRows):
+            floats, strings = splitValues(df.iloc[start:start + self.batchRows])
+            parts = self.q.sendSync('.loader.write', np.bytes_(self.root.encode()), np.bytes_(self.dbdir.encode()), qlist(np.array(self.tables, dtype='S'), qtype=QSYMBOL_LIST),
+                                    self.columns(floats), self.columns(strings, text=True), single_char_strings=True)
+            self.parts.update(fromSymbols(parts))
+            self.rows[0] += len(floats)
+            self.rows[1] += len(strings)
+        return len(df)
+
+    def loadFiles(self, paths):
+        rows = 0
+        for path in paths:
+            rows += self.load(readFile(path))
+            logger.info('loaded %s: %s rows' % (os.path.basename(path), rows))
+        return rows
+
+    def finish(self, load=True):
+        ## sort and index the partitions written and load the database, a segment is only sorted
+        self.define()
+        parts = qlist(np.array(sorted(self.parts), dtype='S'), qtype=QSYMBOL_LIST)
+        if load:
+            count = self.q.sendSync('.loader.finish', np.bytes_(self.dbdir.encode()), parts)
+        else:
+            count = self.q.sendSync('.loader.sort', parts)
+        logger.info('kdb database %s: %s float rows, %s string rows, %s partitions' % (self.dbdir, self.rows[0], self.rows[1], count))
+        self.parts = set()
+        self.versions = {}
+        return count
+
+    def open(self):
+        ## load the database at dbdir in the q process, the number of date partitions
+        self.define()
+        self.versions = {}
+        return self.q.sendSync('.loader.open', np.bytes_(self.dbdir.encode()))
+
+    def version(self, table=None):
+        ## the partitions of table and their row counts, what a cached select of it depends on
+        table = table or self.tables[0]
+        if table not in self.versions:
+            self.define()
+            df = pd.DataFrame(self.q.sendSync('.loader.version', np.bytes_(table.encode())))
+            self.versions[table] = (self.dbdir, table, toQDates(df.date).tolist(), df.rows.astype(np.int64).tolist())
+        return self.versions[table]
+
+    def refresh(self):
+        ## look the versions up again, after the database was reloaded by another connection
+        self.versions = {}
+
+    def select(self, startdate, enddate, tickers=None, fields=None, table=None):
+        ## rows of the float table (or table) for a date range and optionally tickers and fields
+        table = table or self.tables[0]
+        d0, d1 = toQDates([startdate, enddate])
+        ## the rows do not depend on the order of the tickers and fields asked for
+        params = (table, int(d0), int(d1), sorted(set(tickers or [])), sorted(set(fields or [])))
+        if self.cache is None:
+            return self.query(*params)
+        return self.cache.get('.loader.select', params, lambda: self.query(*params), version=self.version(table))
+
+    def query(self, table, d0, d1, tickers, fields):
+        self.define()
+        start = time.time()
+        df = self.q.sendSync('.loader.select', np.bytes_(table.encode()), d0, d1, toSymbols(tickers), toSymbols(fields))
+        df = pd.DataFrame(df)
+        for column in ('TICKER', 'FIELD'):
+            if column in df.columns:
+                df[column] = fromSymbols(df[column])
+        journal.event('select', table=table, d0=d0, d1=d1, tickers=len(tickers), fields=len(fields), rows=len(df), seconds=time.time() - start)
+        return df.rename(columns={'date': 'DATE'})
+
+
+def loadMarketData(q, path, dbdir, batchRows=BATCH_ROWS):
+    ## load a Bloomberg download file or directory into the database at dbdir
+    loader = KdbLoader(q, dbdir, batchRows=batchRows)
+    rows = loader.loadFiles(listFiles(path))
+    loader.finish()
+    return rows
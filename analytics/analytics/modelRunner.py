@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+'''
+Parallel runs of machine learning models over data slices of the kdb+ database
+
+A job list is declarative: each entry names one or more data slices (a date range, tickers,
+feature fields and the target field to predict horizon days ahead), one or more models and a
+grid of hyperparameters per model, and is expanded into every slice x model x parameter
+combination.  Every distinct slice is pivoted in q once by FeatureMatrix, over a connection pool
+so several slices are fetched at once, and stored in workdir as a .npy tensor; a later run
+against an unchanged database finds it there.  The fits are spread over a process pool in chunks
+that never mix slices, ordered by slice, and each worker memory maps a slice and builds its
+training arrays once for all the chunks of that slice it gets.  Every fit is one row of the
+result with its scores and load, fit and predict seconds:
+
+    jobs = [{'slices': [{'startdate': '20150101', 'enddate': '20191231', 'fields': ['PX_LAST', 'PX_VOLUME'], 'target': 'PX_LAST'}],
+             'models': {'ridge': {'alpha': [0.1, 1.0, 10.0]}, 'knn': {'k': [5, 25]}}}]
+    results = runJobs(pool, jobs, '/var/tmp/analysis/slices', processes=8)
+
+Models are the numpy ones in MODELS or the dotted path of any class with fit and predict, e.g.
+sklearn.ensemble.RandomForestRegressor, imported in the workers.
+'''
+import os
+import json
+import time
+import math
+import logging
+import importlib
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from featureMatrix import FeatureMatrix
+from queryCache import cacheKey
+
+logger = logging.getLogger(__name__)
+
+HORIZON = 1
+TRAIN_FRACTION = 0.7
+CHUNKS_PER_PROCESS = 4
+
+DEFAULT_JOBS = [{'slices': [{'startdate': '20150101', 'enddate': '20191231', 'tickers': None, 'fields': None, 'target': 'PX_LAST'}],
+                 'models': {'ridge': {'alpha': [0.1, 1.0, 10.0]}, 'knn': {'k': [5, 25]}}}]
+
+# slices already mapped by this worker process keyed by path
+_SLICES = {}
+
+
+##############################################################################################
+# models
+##############################################################################################
+class RidgeModel(object):
+    ## least squares with an l2 penalty on the standardized features, solved in closed form
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+
+    def fit(self, X, y):
+        self.mean, self.scale = X.mean(axis=0), X.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        Z = (X - self.mean) / self.scale
+        self.intercept = y.mean()
+        self.coef = np.linalg.solve(Z.T @ Z + self.alpha * np.eye(Z.shape[1]), Z.T @ (y - self.intercept))
+        return self
+
+    def predict(self, X):
+        return ((X - self.mean) / self.scale) @ self.coef + self.intercept
+
+
+class KnnModel(object):
+    ## mean target of the k nearest training rows on the standardized features
+    def __init__(self, k=5, batch=1024):
+        self.k = k
+        self.batch = batch
+
+    def fit(self, X, y):
+        self.mean, self.scale = X.mean(axis=0), X.std(axis=0)
+        self.scale[self.scale == 0] = 1.0
+        self.Z = (X - self.mean) / self.scale
+        self.norms = (self.Z ** 2).sum(axis=1)
+        self.y = y
+        return self
+
+    def predict(self, X):
+        Z = (X - self.mean) / self.scale
+        k = min(self.k, len(self.y))
+        out = np.empty(len(Z))
+        for start in range(0, len(Z), self.batch):
+            block = Z[start:start + self.batch]
+            distances = self.norms[None, :] - 2 * block @ self.Z.T
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            out[start:start + len(block)] = self.y[nearest].mean(axis=1)
+        return out
+
+
+MODELS = {'ridge': RidgeModel, 'knn': KnnModel}
+
+
+def modelClass(name):
+    if name in MODELS:
+        return MODELS[name]
+    module, cls = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module), cls)
+
+
+##############################################################################################
+# jobs
+##############################################################################################
+def sliceSpec(spec):
+    ## a slice with its defaults, tickers and fields sorted so equal slices compare equal
+    spec = dict({'tickers': None, 'fields': None, 'horizon': HORIZON}, **spec)
+    for key in ('tickers', 'fields'):
+        spec[key] = sorted(set(spec[key])) if spec[key] else None
+    if spec['fields'] and spec['target'] not in spec['fields']:
+        spec['fields'] = sorted(spec['fields'] + [spec['target']])
+    return spec
+
+
+def expandJobs(jobs):
+    ## every slice x model x parameter combination of the job list, grouped by slice
+    expanded = []
+    for job in jobs:
+        for spec in job['slices']:
+            spec = sliceSpec(spec)
+            for model, grid in job['models'].items():
+                keys = sorted(grid)
+                for values in itertools.product(*[grid[key] if isinstance(grid[key], list) else [grid[key]] for key in keys]):
+                    expanded.append({'slice': spec, 'model': model, 'params': dict(zip(keys, values))})
+    keys = [sliceKey(job['slice']) for job in expanded]
+    order = sorted(range(len(expanded)), key=lambda n: keys[n])
+    return [dict(expanded[n], job=n) for n in order]
+
+
+def sliceKey(spec):
+    ## what the tensor depends on; the target and horizon only select from it
+    return cacheKey('.matrix.pivot', [spec['startdate'], spec['enddate'], spec['tickers'], spec['fields']])
+
+
+##############################################################################################
+# slices, fetched in the parent process
+##############################################################################################
+def fetchSlice(builder, spec, workdir, version):
+    '''
+    the .npy path of the tensor of a slice, pivoted in q unless an earlier run stored it for
+    the same database version; the axes are kept next to it in a .json file
+    '''
+    key = cacheKey('.matrix.pivot', [spec['startdate'], spec['enddate'], spec['tickers'], spec['fields']], version)
+    path = os.path.join(workdir, key + '.npy')
+    if os.path.exists(path) and os.path.exists(path[:-4] + '.json'):
+        return path, 0.0
+    start = time.time()
+    block = builder.build(spec['startdate'], spec['enddate'], spec['tickers'], spec['fields'])
+    tmp = path + '.%s.tmp' % os.getpid()
+    with open(tmp, 'wb') as f:
+        np.save(f, np.ascontiguousarray(block.values))
+    with open(path[:-4] + '.json', 'w') as f:
+        json.dump({'dates': [str(d) for d in block.dates], 'tickers': block.tickers, 'fields': block.fields}, f)
+    os.replace(tmp, path)
+    return path, time.time() - start
+
+
+def fetchSlices(q, jobs, workdir, version=None, threads=None):
+    ## {slice key: path} of the distinct slices of the jobs, fetched concurrently
+    os.makedirs(workdir, exist_ok=True)
+    builder = FeatureMatrix(q)
+    builder.define()
+    specs = dict((sliceKey(job['slice']), job['slice']) for job in jobs)
+    threads = threads or getattr(q, 'size', 1)
+    with ThreadPoolExecutor(threads) as pool:
+        fetched = dict(zip(specs, pool.map(lambda spec: fetchSlice(builder, spec, workdir, version), specs.values())))
+    for key, (path, seconds) in fetched.items():
+        logger.info('slice %s: %s' % (os.path.basename(path)[:8], 'fetched in %.2fs' % seconds if seconds else 'stored by an earlier run'))
+    return dict((key, path) for key, (path, seconds) in fetched.items())
+
+
+##############################################################################################
+# fits, run in the worker processes
+##############################################################################################
+def loadDataset(path, target, horizon, trainFraction):
+    '''
+    train and test arrays of a slice and the seconds to build them, 0 when this process already
+    has them: each (date, ticker) row has the fields of the date as features and the target
+    field horizon dates later as label; the split is by date
+    '''
+    key = (path, target, horizon, trainFraction)
+    if key in _SLICES:
+        return _SLICES[key] + (0.0,)
+    start = time.time()
+    values = np.load(path, mmap_mode='r')
+    axes = json.load(open(path[:-4] + '.json'))
+    dates, tickers, fields = len(axes['dates']), len(axes['tickers']), len(axes['fields'])
+    X = np.asarray(values[:dates - horizon], dtype=np.float64).reshape(-1, fields)
+    y = np.asarray(values[horizon:, :, axes['fields'].index(target)], dtype=np.float64).reshape(-1)
+    rowDates = np.repeat(np.arange(dates - horizon), tickers)
+    keep = np.isfinite(X).all(axis=1) & np.isfinite(y)
+    split = int((dates - horizon) * trainFraction)
+    train, test = keep & (rowDates < split), keep & (rowDates >= split)
+    _SLICES[key] = (X[train], y[train], X[test], y[test])
+    return _SLICES[key] + (time.time() - start,)
+
+
+def score(y, predicted):
+    mse = float(np.mean((y - predicted) ** 2)) if len(y) else np.nan
+    variance = float(np.var(y)) if len(y) else np.nan
+    return mse, 1.0 - mse / variance if variance else np.nan
+
+
+def runChunk(task):
+    path, jobs, trainFraction = task
+    rows = []
+    for job in jobs:
+        spec = job['slice']
+        Xtrain, ytrain, Xtest, ytest, loadSeconds = loadDataset(path, spec['target'], spec['horizon'], trainFraction)
+        row = {'job': job['job'], 'slice': os.path.basename(path)[:8], 'startdate': spec['startdate'], 'enddate': spec['enddate'],
+               'target': spec['target'], 'horizon': spec['horizon'], 'model': job['model'], 'params': json.dumps(job['params'], sort_keys=True),
+               'trainRows': len(ytrain), 'testRows': len(ytest), 'loadSeconds': loadSeconds, 'pid': os.getpid()}
+        try:
+            start = time.time()
+            model = modelClass(job['model'])(**job['params']).fit(Xtrain, ytrain)
+            row['fitSeconds'] = time.time() - start
+            start = time.time()
+            row['testMse'], row['testR2'] = score(ytest, model.predict(Xtest))
+            row['predictSeconds'] = time.time() - start
+        except Exception as ex:
+            logger.exception('job %s failed: %r' % (job['job'], ex))
+            row['error'] = repr(ex)
+        rows.append(row)
+    return rows
+
+
+def chunkJobs(jobs, paths, processes, trainFraction):
+    ## tasks of consecutive jobs of one slice, enough of them to keep every process busy
+    size = max(1, int(math.ceil(len(jobs) / float(processes * CHUNKS_PER_PROCESS))))
+    tasks = []
+    for key, group in itertools.groupby(jobs, key=lambda job: sliceKey(job['slice'])):
+        group = list(group)
+        tasks += [(paths[key], group[n:n + size], trainFraction) for n in range(0, len(group), size)]
+    return tasks
+
+
+def runJobs(q, jobs, workdir, processes=None, version=None, trainFraction=TRAIN_FRACTION):
+    '''
+    run the expanded job list and return one row per fit; q is a connection or a
+    QConnectionPool, version the database version the stored slices are valid for
+    '''
+    jobs = expandJobs(jobs)
+    paths = fetchSlices(q, jobs, workdir, version)
+    processes = min(processes or multiprocessing.cpu_count(), len(jobs))
+    tasks = chunkJobs(jobs, paths, processes, trainFraction)
+
+    start = time.time()
+    rows = []
+    with multiprocessing.Pool(processes) as pool:
+        for chunk in pool.imap_unordered(runChunk, tasks):
+            rows += chunk
+    elapsed = time.time() - start
+    df = pd.DataFrame(rows).set_index('job').sort_index()
+    logger.info('completed %s fits of %s slices on %s processes in %.2fs, %.1f fits per second'
+                % (len(df), len(paths), processes, elapsed, len(df) / elapsed if elapsed else 0.0))
+    return df
@@ -9,29 +9,53 @@ if 'win32' in sys.platform:
     from ctypes import windll, byref, wintypes, WinError
     from ctypes.wintypes import HANDLE, DWORD, POINTER, BOOL
 import time
+import queue
+import shlex
 import socket
+import asyncio
+import threading
 import subprocess
 import logging
+import numpy as np
+import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import Popen, PIPE
 from qpython import qconnection
 
+## journal is shared with the sibling backtests package
+BACKTESTS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtests'))
+if BACKTESTS not in sys.path:
+    sys.path.append(BACKTESTS)
+import journal
+
 logger = logging.getLogger(__name__)
 
+POOL_SIZE = 4
+IDLE_CHECK = 30.0
+HEALTH_CHECK = '1b'
+METRICS_WINDOW = 10000
+# characters of a query kept in its journal event
+JOURNAL_QUERY_CHARS = 200
+
 class QConnection(object):
     _iInstance = None
+    _lock = threading.Lock()
 
     def __init__(self):
-        if QConnection._iInstance is None:
-            QConnection._iInstance = QConnection.Singleton()
+        with QConnection._lock:
+            if QConnection._iInstance is None:
+                QConnection._iInstance = QConnection.Singleton()
 
     def connect(self, args):
-        return QConnection._iInstance.connect(args)
+        with QConnection._lock:
+            return QConnection._iInstance.connect(args)
 
     class Singleton():
         def __init__(self):
             self.proc = None
             self.qconn = None
-            self.localhost = None
+            self.localhost = 'localhost'
 
         def __del__(self):
             self.subprocessTerminate(self.proc)
@@ -40,18 +64,10 @@ class QConnection(object):
             for idx in range(10):
                 port = 0
                 try:
-                    if sys.profile == 'linux':
-                        try:
-                            ##try random port from os...
-                            port = (int)(subprocess.check_output(
-                                'CHECK="do while"; while [[ !  -z $CHECK ]]; do PORT=$(( 32768 + RANDOM % 65000 )); CHECK=$(netstat -an | grep $PORT); dibne; echo $PORT',
-                                shell=True))
-                        except Exception as ex:
-                            logger.warning('unable to run check script on linux')
-                    if not port:
-                        s = socket.socket()
-                        s.bind(('', 0))  # Bind to a free port provided by the host.
-                        port = s.getsockname()[1]
+                    s = socket.socket()
+                    s.bind(('', 0))  # Bind to a free port provided by the host.
+                    port = s.getsockname()[1]
+                    s.close()
                     self.proc = self.subprocessSpawn('%s -p %s' % (args.qpath, port))
                     if self.proc:
                         return port
@@ -85,16 +101,26 @@ class QConnection(object):
                 logger.error('Unable to establish a q connection after %s attempts' % idx)
             return self.qconn
 
+        def stop(self):
+            ## close the connection and terminate the q process started for it
+            if self.qconn:
+                self.qconn.close()
+                self.qconn = None
+            self.subprocessTerminate(self.proc)
+            self.proc = None
+
         def subprocessSpawn(self, cmd, log=True):
+            proc = None
             try:
-                proc = Popen(cmd, stdout=PIPE, stderr=PIPE, bufsize=-1)
+                proc = Popen(cmd if 'win32' in sys.platform else shlex.split(cmd), stdout=PIPE, stderr=PIPE, bufsize=-1)
                 stderr = self.nonBlockedRead(proc.stderr)
                 if stderr:
                     logger.error('Error spawning process %s' % stderr)
-                    self.subprocessTerminate(self, proc)
+                    self.subprocessTerminate(proc)
                     proc = None
                 else:
                     time.sleep(1)
+                return proc
 
             except Exception as ex:
                 self.subprocessTerminate(proc)
@@ -112,9 +138,9 @@ class QConnection(object):
                 pass
 
         def nonBlockedRead(self, output):
-            if 'linux' in sys.paltform:
+            if 'linux' in sys.platform:
                 fd = output.fileno()
-                fl = fcntl.fcnt(fd, fcntl.F_GETFL)
+                fl = fcntl.fcntl(fd, fcntl.F_GETFL)
                 fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
                 try:
                     return output.read()
@@ -134,3 +160,187 @@ class QConnection(object):
                     logger.error('Error reading pipe %s' % WinError())
                     return ''
                 return h
+
+
+class QConnectionPool(object):
+    '''
+    thread-safe pool of up to size qpython connections spread round robin over one or more q
+    instances.  A connection idle for more than idleCheck seconds is checked with a trivial query
+    before it is handed out and replaced when the check fails, as is a connection whose socket
+    fails during a query, which is then tried once more on a new connection.  After any other
+    error the connection is replaced too and the error raised.  Statements passed to broadcast(),
+    e.g. q function definitions, are run on every connection before its next query.
+
+    query() blocks, submit() returns a concurrent.futures Future and aquery() an awaitable, so
+    many slice queries can run at once; the time spent waiting for a connection and the query
+    latencies are kept for stats()
+    '''
+    def __init__(self, instances, size=POOL_SIZE, idleCheck=IDLE_CHECK, timeout=None):
+        self.instances = [instance.split(':') for instance in instances]
+        self.size = max(size, 1)
+        self.idleCheck = idleCheck
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.next = 0
+        self.executor = ThreadPoolExecutor(self.size, thread_name_prefix='qpool')
+        self.waits = deque(maxlen=METRICS_WINDOW)
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+        self.counts = {'queries': 0, 'errors': 0, 'reconnects': 0, 'healthChecks': 0}
+        self.setup = []
+
+    def open(self):
+        with self.lock:
+            host, port = self.instances[self.next % len(self.instances)]
+            self.next += 1
+        q = qconnection.QConnection(host=host or 'localhost', port=int(port), pandas=True)
+        q.open()
+        ## the broadcast statements run on this connection so far
+        q.applied = 0
+        return q
+
+    def acquire(self):
+        ## a connection from the idle ones, a new one or the first returned
+        while True:
+            try:
+                q, returned = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    grow = self.created < self.size
+                    if grow:
+                        self.created += 1
+                if grow:
+                    try:
+                        return self.open()
+                    except Exception:
+                        with self.lock:
+                            self.created -= 1
+                        raise
+                try:
+                    q, returned = self.idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise Exception('no q connection free after %ss' % self.timeout)
+            if time.time() - returned < self.idleCheck or self.healthy(q):
+                return q
+            self.discard(q)
+
+    def release(self, q):
+        self.idle.put((q, time.time()))
+
+    def discard(self, q):
+        try:
+            q.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.created -= 1
+            self.counts['reconnects'] += 1
+
+    def healthy(self, q):
+        with self.lock:
+            self.counts['healthChecks'] += 1
+        try:
+            return q.is_connected() and q.sendSync(HEALTH_CHECK) is not None
+        except Exception as ex:
+            logger.warning('dropping idle q connection: %r' % ex)
+            return False
+
+    def broadcast(self, query):
+        ## a statement for every connection, definitions are held by each q process
+        with self.lock:
+            self.setup.append(query)
+
+    def prepare(self, q):
+        ## run the broadcast statements this connection has not seen yet
+        with self.lock:
+            pending = self.setup[q.applied:]
+        for statement in pending:
+            q.sendSync(statement)
+            q.applied += 1
+
+    def query(self, query, *parameters, **options):
+        return self.run(time.time(), query, parameters, options)
+
+    def run(self, submitted, query, parameters, options):
+        ## run a query on a pooled connection, once more on a new connection if the socket fails;
+        ## the wait is counted from submitted, so it includes the time queued for a thread
+        for attempt in range(2):
+            q = self.acquire()
+            started = time.time()
+            waited = started - submitted
+            try:
+                self.prepare(q)
+                result = q.sendSync(query, *parameters, **options)
+            except (OSError, EOFError) as ex:
+                self.discard(q)
+                with self.lock:
+                    self.counts['errors'] += 1
+                self.journalQuery(query, waited, started, attempt, ex)
+                if attempt:
+                    raise
+                logger.warning('q connection failed, retrying on a new connection: %r' % ex)
+                continue
+            except Exception as ex:
+                ## the connection may be left mid-message, so it is replaced rather than reused
+                self.discard(q)
+                with self.lock:
+                    self.counts['errors'] += 1
+                self.journalQuery(query, waited, started, attempt, ex)
+                raise
+            self.release(q)
+            with self.lock:
+                self.counts['queries'] += 1
+                self.waits.append(waited)
+                self.latencies.append(time.time() - started)
+            self.journalQuery(query, waited, started, attempt)
+            return result
+
+    def journalQuery(self, query, waited, started, attempt, error=None):
+        if journal.enabled():
+            journal.event('query', query=str(query)[:JOURNAL_QUERY_CHARS], wait=waited, latency=time.time() - started, attempt=attempt,
+                          error=None if error is None else repr(error))
+
+    ## the pool can stand in for a single connection
+    sendSync = query
+
+    def submit(self, query, *parameters, **options):
+        return self.executor.submit(self.run, time.time(), query, parameters, options)
+
+    def aquery(self, query, *parameters, **options):
+        return asyncio.wrap_future(self.submit(query, *parameters, **options))
+
+    def stats(self):
+        with self.lock:
+            waits = np.array(self.waits)
+            latencies = np.array(self.latencies)
+            stats = dict(self.counts, size=self.size, open=self.created)
+        for name, values in (('wait', waits), ('latency', latencies)):
+            stats.update({name + 'Mean': values.mean() if len(values) else 0.0,
+                          name + 'P95': np.percentile(values, 95) if len(values) else 0.0,
+                          name + 'Max': values.max() if len(values) else 0.0})
+        return pd.Series(stats)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while True:
+            try:
+                q, returned = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            q.close()
+            with self.lock:
+                self.created -= 1
+
+
+def connectPool(args, size=POOL_SIZE):
+    '''
+    a pool over the instances in args.qinstance (host:port, comma separated), or over the q
+    process the QConnection singleton spawns when there are none
+    '''
+    if args.qinstance:
+        return QConnectionPool(args.qinstance.split(','), size)
+    q = QConnection().connect(args)
+    if q is None:
+        raise Exception('unable to start a q process for the pool')
+    return QConnectionPool(['%s:%s' % (q.host, q.port)], size)
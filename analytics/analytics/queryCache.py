@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+'''
+Memoizing cache for the results of kdb+ queries
+
+A result is keyed by the normalized query text, its parameters and the version of the database
+it was read from (the partitions and their row counts), so a reload or an ingest into the
+database makes the old entries unreachable instead of stale.  Results are kept in memory up to
+memoryBytes and on disk in cachedir up to maxBytes, frames as feather files and arrays as .npy
+files, both read back memory mapped, and a frame always comes back with the 0..n-1 index its file
+holds.  The least recently used entries are evicted first.  The files and their sizes are read
+from the directory when the cache is opened and kept as a running total from then on; a hit on
+disk touches the file, so the order survives across runs, and a file another process wrote later
+is counted when it is hit:
+
+    cache = QueryCache('/var/tmp/analysis/cache', maxBytes=8 << 30)
+    df = cache.get('.loader.select', params, lambda: loader.query(*params), version=loader.version())
+'''
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = 4 << 30
+MEMORY_BYTES = 512 << 20
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(query):
+    ## the same query text whatever its layout
+    return WHITESPACE.sub(' ', query.decode('latin-1') if isinstance(query, bytes) else query).strip()
+
+
+def digest(value, h):
+    ## feed a query parameter into the hash by type and content
+    if isinstance(value, (list, tuple)):
+        h.update(b'L%d' % len(value))
+        for item in value:
+            digest(item, h)
+    elif isinstance(value, np.ndarray):
+        h.update(b'A' + value.dtype.str.encode() + str(value.shape).encode())
+        if value.dtype == object:
+            digest(list(value), h)
+        else:
+            h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, pd.DataFrame):
+        digest(list(value.columns), h)
+        digest([value[column].values for column in value.columns], h)
+    elif isinstance(value, (bytes, np.bytes_)):
+        h.update(b'S%d:' % len(value) + bytes(value))
+    else:
+        text = repr(value).encode()
+        h.update(type(value).__name__.encode() + b'%d:' % len(text) + text)
+
+
+def cacheKey(query, parameters=(), version=None):
+    h = hashlib.sha1(normalize(query).encode())
+    digest(list(parameters), h)
+    digest(version, h)
+    return h.hexdigest()
+
+
+def plainIndex(df):
+    ## the frame with the 0..n-1 index a feather file gives back
+    if isinstance(df.index, pd.RangeIndex) and df.index.start == 0 and df.index.step == 1:
+        return df
+    return df.reset_index(drop=True)
+
+
+def sizeOf(result):
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True, deep=False).sum())
+    return int(result.nbytes)
+
+
+class QueryCache(object):
+    def __init__(self, cachedir, maxBytes=MAX_BYTES, memoryBytes=MEMORY_BYTES):
+        self.cachedir = os.path.abspath(cachedir)
+        self.maxBytes = maxBytes
+        self.memoryBytes = memoryBytes
+        self.memory = OrderedDict()
+        self.memoryUsed = 0
+        self.lock = threading.RLock()
+        self.counts = {'memoryHits': 0, 'diskHits': 0, 'misses': 0, 'evictions': 0, 'fetchSeconds': 0.0}
+        os.makedirs(self.cachedir, exist_ok=True)
+        ## path: size of the files in the cache, least recently used first
+        self.files = OrderedDict()
+        self.diskUsed = 0
+        for mtime, size, path in self.entries():
+            self.track(path, size)
+
+    def get(self, query, parameters, fetch, version=None):
+        '''
+        the result of query with parameters: from memory, from disk or from fetch(), a callable
+        returning a DataFrame or a numpy array, whose result is then kept.  Cached results are
+        shared, they must not be modified in place
+        '''
+        key = cacheKey(query, parameters, version)
+        result = self.lookup(key)
+        if result is not None:
+            return result
+        started = time.time()
+        result = fetch()
+        with self.lock:
+            self.counts['misses'] += 1
+            self.counts['fetchSeconds'] += time.time() - started
+        return self.put(key, result)
+
+    def lookup(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.counts['memoryHits'] += 1
+                return self.memory[key]
+        for ext, read in (('.feather', self.readFrame), ('.npy', self.readArray)):
+            path = os.path.join(self.cachedir, key + ext)
+            try:
+                result = read(path)
+                os.utime(path)
+                self.track(path, self.files.get(path) or os.path.getsize(path))
+            except (FileNotFoundError, OSError):
+                continue
+            with self.lock:
+                self.counts['diskHits'] += 1
+            self.remember(key, result)
+            return result
+        return None
+
+    def readFrame(self, path):
+        ## numeric columns stay memory mapped, one block each, text columns are converted
+        return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+
+    def readArray(self, path):
+        return np.load(path, mmap_mode='r')
+
+    def put(self, key, result):
+        ## the result as a hit on it will return it
+        if isinstance(result, pd.DataFrame):
+            result = plainIndex(result)
+            path = os.path.join(self.cachedir, key + '.feather')
+            write = lambda f: feather.write_feather(result, f, compression='uncompressed')
+        elif isinstance(result, np.ndarray) and result.dtype != object:
+            path = os.path.join(self.cachedir, key + '.npy')
+            write = lambda f: np.save(f, result)
+        else:
+            raise TypeError('only DataFrames and numeric arrays are cached, not %s' % type(result).__name__)
+        ## written under a temporary name and renamed, readers in other processes see whole files
+        tmp = '%s.%s.%s.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+            self.track(path, os.path.getsize(path))
+        except Exception as ex:
+            logger.warning('unable to cache query result %s: %r' % (key, ex))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.remember(key, result)
+        self.evict()
+        return result
+
+    def remember(self, key, result):
+        size = sizeOf(result)
+        if size > self.memoryBytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memoryUsed -= sizeOf(self.memory.pop(key))
+            self.memory[key] = result
+            self.memoryUsed += size
+            while self.memoryUsed > self.memoryBytes:
+                self.memoryUsed -= sizeOf(self.memory.popitem(last=False)[1])
+
+    def track(self, path, size):
+        ## path as the most recently used file
+        with self.lock:
+            if path in self.files:
+                self.diskUsed -= self.files.pop(path)
+            self.files[path] = size
+            self.diskUsed += size
+
+    def entries(self):
+        ## (last used, size, path) of the files in the cache, oldest first
+        entries = []
+        for entry in os.scandir(self.cachedir):
+            if entry.name.endswith(('.feather', '.npy')):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        ## the least recently used files until the running total is within maxBytes
+        while True:
+            with self.lock:
+                if self.diskUsed <= self.maxBytes or not self.files:
+                    return
+                path, size = self.files.popitem(last=False)
+                self.diskUsed -= size
+                self.counts['evictions'] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memoryUsed = 0
+            self.files.clear()
+            self.diskUsed = 0
+        for mtime, size, path in self.entries():
+            os.remove(path)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts, memoryEntries=len(self.memory), memoryBytes=self.memoryUsed,
+                         diskEntries=len(self.files), diskBytes=self.diskUsed)
+        return pd.Series(stats)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+'''
+Walk-forward model training with the out-of-sample allocations backtested in memory
+
+The features are a (date x ticker x field) tensor, pivoted from kdb+ by FeatureMatrix or given as
+an array, whose price field is also the price matrix of the backtest.  A model from modelRunner
+is fitted on every rolling window of train dates to predict the return horizon dates ahead, and
+predicts the test dates that follow the window; on each of those dates the top fraction of the
+tickers with a positive predicted return are held in equal weights.  The allocations of all the
+windows are passed as arrays to the vectorized engine of the backtests package, the signal of a
+date trading on the next bar as the shifted allocation file does, so nothing goes through a csv.
+
+The windows are fitted in parallel by a process pool that memory maps the tensor from workdir.
+The allocations of a window are stored under a hash of the rows it reads and of the model, its
+parameters and the pipeline settings, so a rerun fits only the windows whose inputs changed,
+e.g. the new windows when dates were appended:
+
+    result = runWalkForward(q, '20150101', '20191231', fields=['PX_LAST', 'PX_VOLUME', 'PE_RATIO'],
+                            model='ridge', params={'alpha': 10.0}, workdir='/var/tmp/analysis/walkforward')
+    result.backtest.getvalue(), result.windows
+'''
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+import modelRunner
+
+logger = logging.getLogger(__name__)
+
+PRICE_FIELD = 'PX_LAST'
+TRAIN_DATES = 250
+TEST_DATES = 21
+HORIZON = 5
+TOP = 0.2
+START_BALANCE = 1000000.0
+COMMISSION = 0.001
+
+BACKTESTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtests')
+
+# feature tensors already mapped by this worker process keyed by path
+_TENSORS = {}
+
+
+class WalkForwardResult(object):
+    def __init__(self, dates, tickers, allocations, windows, backtest):
+        self.dates = dates
+        self.tickers = tickers
+        self.allocations = allocations
+        self.windows = windows
+        self.backtest = backtest
+
+    def allocationFrame(self):
+        return pd.DataFrame(self.allocations, index=pd.DatetimeIndex(self.dates, name='date'), columns=self.tickers)
+
+
+def vectorEngine():
+    ## the backtest engine is in the sibling backtests package
+    if BACKTESTS not in sys.path:
+        sys.path.append(os.path.normpath(BACKTESTS))
+    import vectorEngine
+    return vectorEngine
+
+
+def forwardFill(prices):
+    ## the last price of each ticker carried over the missing dates, as backtest.cleanPrices does
+    valid = ~np.isnan(prices)
+    last = np.where(valid, np.arange(len(prices))[:, None], 0)
+    np.maximum.accumulate(last, axis=0, out=last)
+    return prices[last, np.arange(prices.shape[1])]
+
+
+def forwardReturns(prices, horizon):
+    ## return from each date to horizon dates later, nan where either price is missing
+    out = np.full(prices.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[:-horizon] = prices[horizon:] / prices[:-horizon] - 1.0
+    return out
+
+
+def makeWindows(dates, train, test, horizon):
+    ## (train start, test start, test end) of each window; a train row needs its label inside the window
+    windows = []
+    for start in range(train, dates, test):
+        windows.append((start - train, start, min(start + test, dates)))
+    return [w for w in windows if w[1] - w[0] > horizon]
+
+
+def windowKey(values, window, settings):
+    ## hash of the rows the window reads and of everything that changes its allocations
+    h = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode())
+    h.update(np.ascontiguousarray(values[window[0]:window[2]]).tobytes())
+    return h.hexdigest()
+
+
+def allocate(predicted, top):
+    ## equal weights on the top fraction of the tickers by predicted return, if it is positive
+    weights = np.zeros(predicted.shape)
+    for t, row in enumerate(predicted):
+        valid = np.flatnonzero(np.isfinite(row))
+        if not len(valid):
+            continue
+        count = max(1, int(round(len(valid) * top)))
+        best = valid[np.argsort(row[valid])[::-1][:count]]
+        best = best[row[best] > 0]
+        if len(best):
+            weights[t, best] = 1.0 / len(best)
+    return weights
+
+
+def fitWindow(task):
+    '''
+    fit the model on the train dates of a window and store the allocations of its test dates;
+    runs in a pool process on the tensor memory mapped from path
+    '''
+    path, window, settings, out = task
+    start = time.time()
+    if path not in _TENSORS:
+        _TENSORS[path] = np.load(path, mmap_mode='r')
+    values = _TENSORS[path]
+    trainStart, testStart, testEnd = window
+    block = np.asarray(values[trainStart:testEnd], dtype=np.float64)
+    prices = forwardFill(block[:, :, settings['price']])
+    labels = forwardReturns(prices, settings['horizon'])
+    ## train rows whose label lies before the test dates
+    trainRows = testStart - trainStart - settings['horizon']
+    X = block[:trainRows].reshape(-1, block.shape[2])
+    y = labels[:trainRows].reshape(-1)
+    keep = np.isfinite(X).all(axis=1) & np.isfinite(y)
+    row = {'trainStart': trainStart, 'testStart': testStart, 'testEnd': testEnd, 'trainRows': int(keep.sum()), 'pid': os.getpid()}
+    model = modelRunner.modelClass(settings['model'])(**settings['params']).fit(X[keep], y[keep])
+    row['fitSeconds'] = time.time() - start
+
+    test = block[testStart - trainStart:]
+    flat = test.reshape(-1, block.shape[2])
+    rows = np.isfinite(flat).all(axis=1)
+    predicted = np.full(len(flat), np.nan)
+    if rows.any():
+        predicted[rows] = model.predict(flat[rows])
+    predicted = predicted.reshape(test.shape[:2])
+    actual = labels[testStart - trainStart:]
+    both = np.isfinite(predicted) & np.isfinite(actual)
+    row['testIC'] = float(np.corrcoef(predicted[both], actual[both])[0, 1]) if both.sum() > 2 else np.nan
+    allocations = allocate(predicted, settings['top'])
+    tmp = out + '.%s.tmp' % os.getpid()
+    with open(tmp, 'wb') as f:
+        np.save(f, allocations)
+    os.replace(tmp, out)
+    with open(out[:-4] + '.json', 'w') as f:
+        json.dump(row, f)
+    return row
+
+
+def storeTensor(values, workdir):
+    ## the tensor in workdir under the hash of its contents, for the pool processes to map
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    path = os.path.join(workdir, 'features-%s.npy' % hashlib.sha1(values.tobytes() + str(values.shape).encode()).hexdigest())
+    if not os.path.exists(path):
+        tmp = path + '.%s.tmp' % os.getpid()
+        with open(tmp, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp, path)
+    return path
+
+
+def walkForward(values, dates, tickers, fields, workdir, model='ridge', params=None, priceField=PRICE_FIELD, train=TRAIN_DATES,
+                test=TEST_DATES, horizon=HORIZON, top=TOP, processes=None, cash=START_BALANCE, commission=COMMISSION):
+    '''
+    the walk-forward allocations of a (dates x tickers x fields) tensor and their backtest; the
+    windows stored by an earlier run with the same inputs are reused instead of fitted
+    '''
+    os.makedirs(workdir, exist_ok=True)
+    values = np.asarray(values)
+    dates = pd.DatetimeIndex(dates)
+    settings = {'model': model, 'params': params or {}, 'price': list(fields).index(priceField), 'fields': list(fields),
+                'horizon': horizon, 'top': top}
+    windows = makeWindows(len(dates), train, test, horizon)
+    if not windows:
+        raise Exception('%s dates are too few for %s train dates' % (len(dates), train))
+
+    tasks, reused = [], []
+    for window in windows:
+        out = os.path.join(workdir, 'window-%s.npy' % windowKey(values, window, settings))
+        if os.path.exists(out) and os.path.exists(out[:-4] + '.json'):
+            reused.append((window, out))
+        else:
+            tasks.append((window, out))
+    start = time.time()
+    if tasks:
+        path = storeTensor(values, workdir)
+        processes = min(processes or multiprocessing.cpu_count(), len(tasks))
+        with multiprocessing.Pool(processes) as pool:
+            list(pool.imap_unordered(fitWindow, [(path, window, settings, out) for window, out in tasks]))
+    logger.info('walk forward: %s windows, %s fitted in %.2fs, %s reused' % (len(windows), len(tasks), time.time() - start, len(reused)))
+
+    allocations = np.zeros(values.shape[:2])
+    rows = []
+    fitted = set(out for window, out in tasks)
+    for window, out in sorted(tasks + reused):
+        allocations[window[1]:window[2]] = np.load(out)
+        row = json.load(open(out[:-4] + '.json'))
+        row.update(testDate=dates[window[1]], fitted=out in fitted)
+        rows.append(row)
+    windowTable = pd.DataFrame(rows)
+
+    ## the engine takes forward filled prices with -1 where a ticker has no price yet
+    engine = vectorEngine()
+    prices = forwardFill(values[:, :, settings['price']].astype(np.float64))
+    prices = np.where(np.isnan(prices), -1.0, prices)
+    backtest = engine.runArrays(dates, pd.Index(tickers, name='assetid'), prices, allocations, cash, commission)
+    return WalkForwardResult(dates.values, list(tickers), allocations, windowTable, backtest)
+
+
+def runWalkForward(q, startdate, enddate, fields, workdir, tickers=None, **options):
+    ## walkForward on the tensor of a date range pivoted from the kdb+ database on q
+    from featureMatrix import FeatureMatrix
+    block = FeatureMatrix(q).build(startdate, enddate, tickers, fields)
+    return walkForward(block.values, block.dates, block.tickers, block.fields, workdir, **options)
+
+
+def main():
+    import qconnection
+    parser = argparse.ArgumentParser(prog='WalkForward')
+    parser.add_argument('-qp', '--qpath', help='path to q executable')
+    parser.add_argument('-qi', '--qinstance', help='running q instance host:port with the database loaded', default=None)
+    parser.add_argument('-d', '--dbdir', help='kdb database directory to load into a spawned q process', default='../../data/kdb/marketdata')
+    parser.add_argument('-s', '--startdate', help='start date', default='20150101')
+    parser.add_argument('-e', '--enddate', help='end date', default='20191231')
+    parser.add_argument('-f', '--fields', help='comma separated feature fields, the price field among them', default=PRICE_FIELD)
+    parser.add_argument('-m', '--model', help='model name or dotted class path', default='ridge')
+    parser.add_argument('-a', '--params', help='model parameters as json', default='{}')
+    parser.add_argument('-r', '--train', help='train dates per window', type=int, default=TRAIN_DATES)
+    parser.add_argument('-t', '--test', help='test dates per window', type=int, default=TEST_DATES)
+    parser.add_argument('-n', '--processes', help='number of processes to fit the windows with', type=int, default=None)
+    parser.add_argument('-o', '--outdir', help='output directory', default='../../data/output1')
+    args = parser.parse_args()
+
+    q = qconnection.QConnection().connect(args)
+    if not args.qinstance:
+        import kdbLoader
+        kdbLoader.KdbLoader(q, args.dbdir).open()
+    result = runWalkForward(q, args.startdate, args.enddate, args.fields.split(','), os.path.join(args.outdir, 'walkforward'),
+                            model=args.model, params=json.loads(args.params), train=args.train, test=args.test, processes=args.processes)
+    result.windows.to_csv(os.path.join(args.outdir, 'walkforward-windows.csv'))
+    return result.backtest.getvalue()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('Final Portfolio Value: %.2f' % main())
@@ -0,0 +1,8 @@
+import os
+import sys
+
+## the analytics modules import each other by name, as when run from their directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analytics'))
+
+import fakeQ
+fakeQ.install()
@@ -0,0 +1,46 @@
+import itertools
+import numpy as np
+import pytest
+
+import fakeQ
+import kdbLoader
+import featureMatrix
+from qpython import qconnection
+
+PORTS = itertools.count(1)
+
+
+def connect():
+    ## a connection to a fake process of its own, with nothing defined yet
+    q = qconnection.QConnection(host='localhost', port=-next(PORTS))
+    q.open()
+    return q
+
+
+def test_every_q_function_is_checked():
+    ## each function the modules define has a signature of its arity, and each signature a definition
+    q = connect()
+    definitions = kdbLoader.Q_FUNCTIONS + featureMatrix.Q_FUNCTIONS
+    for name, body in definitions:
+        q.sendSync('%s:%s' % (name, ' '.join(line.strip() for line in body.splitlines())))
+    assert sorted(name for name, body in definitions) == sorted(fakeQ.SIGNATURES)
+
+
+def test_definitions_are_checked():
+    q = connect()
+    with pytest.raises(fakeQ.QException, match='rank'):
+        q.sendSync('.matrix.dates:{[d0] d0}')
+    with pytest.raises(fakeQ.QException, match='stand in'):
+        q.sendSync('.matrix.other:{[d0;d1] d0}')
+
+
+def test_undefined_function_is_an_error():
+    q = connect()
+    with pytest.raises(fakeQ.QException, match=r'\.matrix\.dates'):
+        q.sendSync('.matrix.dates', 0, 1)
+    ## .loader.write runs .loader.part in q, which has to be defined too
+    q.sendSync('.loader.write:' + dict(kdbLoader.Q_FUNCTIONS)['.loader.write'])
+    with pytest.raises(fakeQ.QException, match=r'\.loader\.part'):
+        q.sendSync('.loader.write', np.bytes_(b'/tmp'), np.bytes_(b'/tmp'), kdbLoader.toSymbols(['a', 'b']),
+                   [np.array([], dtype=np.int32), kdbLoader.toSymbols([]), kdbLoader.toSymbols([]), np.array([])],
+                   [np.array([], dtype=np.int32), kdbLoader.toSymbols([]), kdbLoader.toSymbols([]), []])
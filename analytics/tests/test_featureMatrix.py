@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import fakeQ
+from qpython import qconnection
+from kdbLoader import KdbLoader
+from featureMatrix import FeatureMatrix
+
+
+@pytest.fixture
+def database(tmp_path):
+    q = qconnection.QConnection(host='localhost', port=0)
+    q.open()
+    dates = pd.bdate_range('2019-01-02', periods=6)
+    index = pd.MultiIndex.from_product([dates, ['IBM US EQUITY', 'MSFT US EQUITY'], ['PX_LAST', 'PX_VOLUME']],
+                                       names=['Date', 'Ticker', 'Field']).to_frame(index=False)
+    index['Value'] = np.arange(len(index), dtype=float)
+    ## one missing value to come back as nan
+    index = index.drop(index=3).reset_index(drop=True)
+    loader = KdbLoader(q, str(tmp_path / 'db'))
+    loader.load(index)
+    loader.finish()
+    return q, index
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_pivot_matches_rows(database, dtype):
+    q, df = database
+    block = FeatureMatrix(q, dtype=dtype).build('20190101', '20191231')
+    assert block.values.dtype == np.dtype(dtype)
+    assert block.tickers == ['IBM US EQUITY', 'MSFT US EQUITY']
+    assert block.fields == ['PX_LAST', 'PX_VOLUME']
+    expected = df.set_index(['Date', 'Ticker', 'Field']).Value.unstack(['Ticker', 'Field']).reindex(
+        columns=pd.MultiIndex.from_product([block.tickers, block.fields]))
+    np.testing.assert_array_equal(block.dates, expected.index.values.astype('datetime64[D]'))
+    np.testing.assert_array_equal(block.values.reshape(len(block.dates), -1), expected.values.astype(dtype))
+
+
+def test_blocks_match_single_pivot(database):
+    q, df = database
+    builder = FeatureMatrix(q)
+    whole = builder.build('20190101', '20191231')
+    blocked = builder.build('20190101', '20191231', blockDays=4)
+    np.testing.assert_array_equal(whole.values, blocked.values)
+
+
+@pytest.mark.parametrize('dtype, code', [('float64', 'f'), ('float32', 'e')])
+def test_pivot_type_is_a_char_atom(database, dtype, code):
+    ## FeatureMatrix sends the value type as the char atom q casts with, and gets back the block of that type
+    q, df = database
+    sent = []
+    sendSync = q.sendSync
+    def record(query, *params, **options):
+        sent.append((query, params, options))
+        return sendSync(query, *params, **options)
+    q.sendSync = record
+    block = FeatureMatrix(q, dtype=dtype).build('20190101', '20191231')
+    pivots = [(params, options) for query, params, options in sent if query == '.matrix.pivot']
+    assert len(pivots) == 1
+    params, options = pivots[0]
+    assert params[-1] == code
+    assert fakeQ.qtype(params[-1], options.get('single_char_strings', False)) == -10
+    assert block.values.dtype == np.dtype(dtype)
+    assert block.values.shape == (df.Date.nunique(), 2, 2)
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import fakeQ
+from qpython import qconnection
+from kdbLoader import KdbLoader
+
+
+def frame(values, text=None):
+    dates = pd.bdate_range('2019-01-02', periods=2)
+    df = pd.MultiIndex.from_product([dates, ['IBM US EQUITY', 'MSFT US EQUITY']], names=['Date', 'Ticker']).to_frame(index=False)
+    df['Field'] = 'PX_LAST' if text is None else 'NAME'
+    df['Value'] = values
+    df['Text'] = text
+    return df
+
+
+@pytest.mark.parametrize('text', [None, 'IBM'], ids=['floats only', 'strings only'])
+def test_empty_batch_columns_are_typed(tmp_path, text):
+    ## a batch with no rows of one kind still sends that kind's q types, not an untyped ()
+    q = qconnection.QConnection(host='localhost', port=0)
+    q.open()
+    sent = []
+    sendSync = q.sendSync
+    def record(query, *params, **options):
+        sent.append((query, params))
+        return sendSync(query, *params, **options)
+    q.sendSync = record
+    df = frame(np.nan if text else np.arange(4, dtype=float), text)
+    loader = KdbLoader(q, str(tmp_path / 'db'))
+    loader.load(df)
+    loader.finish()
+    floats, strings = [params[3:] for query, params in sent if query == '.loader.write'][0]
+    assert [fakeQ.qtype(column) for column in floats] == [6, 11, 11, 9]
+    assert [fakeQ.qtype(column) for column in strings] == [6, 11, 11, 0]
+    assert len(floats[3]) == (0 if text else 4) and len(strings[3]) == (4 if text else 0)
+    assert loader.rows == ([0, 4] if text else [4, 0])
+
+    table = loader.tables[1] if text else loader.tables[0]
+    rows = loader.select('20190101', '20191231', table=table).sort_values(['DATE', 'TICKER']).reset_index(drop=True)
+    assert list(rows.TICKER) == list(df.Ticker)
+    if text:
+        assert list(rows.VALUE) == [text] * 4
+    else:
+        np.testing.assert_array_equal(rows.VALUE.values, df.Value.values)
+    assert len(loader.select('20190101', '20191231', table=loader.tables[0] if text else loader.tables[1])) == 0
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from qpython import qconnection
+from kdbLoader import KdbLoader
+import modelRunner
+
+TICKERS = ['T%02d US EQUITY' % n for n in range(6)]
+FIELDS = ['PX_LAST', 'PX_VOLUME']
+SLICES = [{'startdate': '20190101', 'enddate': '20190630', 'fields': FIELDS, 'target': 'PX_LAST'},
+          {'startdate': '20190101', 'enddate': '20191231', 'fields': ['PX_LAST'], 'target': 'PX_LAST'},
+          ## the first slice again, its fields given another way
+          {'startdate': '20190101', 'enddate': '20190630', 'fields': ['PX_VOLUME'], 'target': 'PX_LAST'}]
+JOBS = [{'slices': SLICES[:2], 'models': {'ridge': {'alpha': [0.1, 1.0, 10.0]}, 'knn': {'k': [3, 5]}}},
+        {'slices': SLICES[2:], 'models': {'ridge': {'alpha': 1.0}}}]
+
+
+def test_jobs_are_grouped_by_slice_in_job_order():
+    jobs = modelRunner.expandJobs(JOBS)
+    assert len(jobs) == 2 * 5 + 1
+    keys = [modelRunner.sliceKey(job['slice']) for job in jobs]
+    ## each slice once, as a run of consecutive jobs
+    runs = [key for n, key in enumerate(keys) if n == 0 or key != keys[n - 1]]
+    assert len(runs) == len(set(keys)) == 2
+    ## the numbers are the positions in the job list, in order within a slice
+    assert sorted(job['job'] for job in jobs) == list(range(len(jobs)))
+    for key in runs:
+        numbers = [job['job'] for job in jobs if modelRunner.sliceKey(job['slice']) == key]
+        assert numbers == sorted(numbers)
+    assert [job['params'] for job in jobs if job['model'] == 'knn'][:2] == [{'k': 3}, {'k': 5}]
+    assert jobs[[job['job'] for job in jobs].index(10)]['slice']['fields'] == FIELDS
+
+
+def test_chunks_never_mix_slices():
+    jobs = modelRunner.expandJobs(JOBS)
+    paths = dict((modelRunner.sliceKey(job['slice']), 'slice%d.npy' % n) for n, job in enumerate(jobs))
+    for processes in (1, 2, 3, 8):
+        tasks = modelRunner.chunkJobs(jobs, paths, processes, 0.5)
+        assert [job['job'] for path, chunk, fraction in tasks for job in chunk] == [job['job'] for job in jobs]
+        for path, chunk, fraction in tasks:
+            assert set(paths[modelRunner.sliceKey(job['slice'])] for job in chunk) == {path}
+        assert len(tasks) >= min(processes, 2)
+
+
+def test_run_jobs_fits_each_job_once(tmp_path):
+    q = qconnection.QConnection(host='localhost', port=0)
+    q.open()
+    dates = pd.bdate_range('2019-01-02', '2019-12-31')
+    df = pd.MultiIndex.from_product([dates, TICKERS, FIELDS], names=['Date', 'Ticker', 'Field']).to_frame(index=False)
+    df['Value'] = np.random.RandomState(0).rand(len(df))
+    loader = KdbLoader(q, str(tmp_path / 'db'))
+    loader.load(df)
+    loader.finish()
+    results = modelRunner.runJobs(q, JOBS, str(tmp_path / 'slices'), processes=2)
+    assert list(results.index) == list(range(11))
+    assert 'error' not in results
+    ## the jobs of a slice train on the same rows
+    assert results.groupby('slice').trainRows.nunique().eq(1).all()
+    assert results.slice.nunique() == 2
@@ -0,0 +1,97 @@
+import itertools
+import numpy as np
+import pytest
+
+import fakeQ
+from qconnection import QConnectionPool
+
+PORTS = itertools.count(7000)
+OPEN = '.loader.open'
+DEFINITION = '.loader.open:{[db] db}'
+AXES = '.matrix.axes:{[t;d0;d1;tk;fd] t}'
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    ## (connection, query) of everything sent on a fake connection
+    sent = []
+    sendSync = fakeQ.QConnection.sendSync
+    def record(self, query, *params, **options):
+        sent.append((self, query))
+        return sendSync(self, query, *params, **options)
+    monkeypatch.setattr(fakeQ.QConnection, 'sendSync', record)
+    return sent
+
+
+@pytest.fixture
+def db(tmp_path):
+    return np.bytes_(str(tmp_path).encode())
+
+
+def makePool(size=2, **kwargs):
+    ## a pool over a fake q process of its own, with the dates function broadcast
+    pool = QConnectionPool(['localhost:%s' % next(PORTS)], size, **kwargs)
+    pool.broadcast(DEFINITION)
+    return pool
+
+
+def test_definitions_reach_every_connection(sent, db, monkeypatch):
+    ## two queries in flight at once take two connections
+    monkeypatch.setattr(fakeQ, 'LATENCY', 0.05)
+    pool = makePool()
+    results = [pool.submit(OPEN, db) for n in range(2)]
+    assert [result.result() for result in results] == [0, 0]
+    ## a later statement runs once on each connection, before its next query
+    pool.broadcast(AXES)
+    for n in range(4):
+        pool.query(OPEN, db)
+    connections = set(q for q, query in sent)
+    assert len(connections) == 2
+    for q in connections:
+        queries = [query for c, query in sent if c is q]
+        assert queries[:2] == [DEFINITION, OPEN]
+        assert queries.count(DEFINITION) == 1
+        assert queries.count(AXES) == (1 if queries.count(OPEN) > 1 else 0)
+    assert sum(query == AXES for q, query in sent) == 1
+    assert pool.stats().open == 2
+    pool.close()
+
+
+def test_socket_failure_is_retried_on_a_new_connection(sent, db):
+    pool = makePool(size=1)
+    pool.query(OPEN, db)
+    broken = sent[-1][0]
+    broken.broken = True
+    assert pool.query(OPEN, db) == 0
+    replacement = sent[-1][0]
+    assert replacement is not broken and not broken.is_connected()
+    ## the new connection is set up before its first query
+    assert [query for q, query in sent if q is replacement] == [DEFINITION, OPEN]
+    stats = pool.stats()
+    assert (stats.reconnects, stats.errors, stats.queries, stats.open) == (1, 1, 2, 1)
+    pool.close()
+
+
+def test_other_errors_replace_the_connection(sent, db):
+    pool = makePool(size=1)
+    with pytest.raises(fakeQ.QException, match='type'):
+        pool.query(OPEN, 'x')
+    failed = sent[-1][0]
+    assert not failed.is_connected()
+    assert pool.stats().open == 0
+    assert pool.query(OPEN, db) == 0
+    replacement = sent[-1][0]
+    assert replacement is not failed
+    assert [query for q, query in sent if q is replacement] == [DEFINITION, OPEN]
+    stats = pool.stats()
+    assert (stats.reconnects, stats.errors, stats.queries, stats.open) == (1, 1, 1, 1)
+    pool.close()
+
+
+def test_idle_connection_is_checked(sent, db):
+    pool = makePool(size=1, idleCheck=0.0)
+    pool.query(OPEN, db)
+    pool.query(OPEN, db)
+    assert [query for q, query in sent] == [DEFINITION, OPEN, '1b', OPEN]
+    assert pool.stats().healthChecks == 1
+    pool.close()
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pandas as pd
+
+from qpython import qconnection
+from kdbLoader import KdbLoader
+from queryCache import QueryCache
+
+
+def frame(dates):
+    df = pd.MultiIndex.from_product([dates, ['IBM US EQUITY', 'MSFT US EQUITY'], ['PX_LAST']],
+                                    names=['Date', 'Ticker', 'Field']).to_frame(index=False)
+    df['Value'] = np.arange(len(df), dtype=float)
+    return df
+
+
+def test_select_from_memory_then_disk_until_the_version_changes(tmp_path):
+    q = qconnection.QConnection(host='localhost', port=0)
+    q.open()
+    cache = QueryCache(str(tmp_path / 'cache'))
+    loader = KdbLoader(q, str(tmp_path / 'db'), cache=cache)
+    loader.load(frame(pd.bdate_range('2019-01-02', periods=4)))
+    loader.finish()
+    first = loader.select('20190101', '20191231')
+    assert len(first) == 8
+    assert (cache.counts['memoryHits'], cache.counts['diskHits'], cache.counts['misses']) == (0, 0, 1)
+
+    pd.testing.assert_frame_equal(loader.select('20190101', '20191231'), first)
+    assert (cache.counts['memoryHits'], cache.counts['diskHits']) == (1, 0)
+
+    ## a new cache on the same directory has only the files
+    loader.cache = QueryCache(cache.cachedir)
+    pd.testing.assert_frame_equal(loader.select('20190101', '20191231'), first)
+    assert (loader.cache.counts['diskHits'], loader.cache.counts['misses']) == (1, 0)
+
+    ## new rows change the version, the select is read again
+    loader.load(frame(pd.bdate_range('2019-02-01', periods=2)))
+    loader.finish()
+    loader.refresh()
+    assert len(loader.select('20190101', '20191231')) == 12
+    assert loader.cache.counts['misses'] == 1
+
+
+def unreachable():
+    raise AssertionError('fetched a cached result')
+
+
+def test_memory_and_disk_hits_return_the_same_frame(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    df = pd.DataFrame({'VALUE': [1.0, 2.0, 3.0]}, index=[7, 3, 5])
+    fetched = cache.get('select', [1], lambda: df)
+    memory = cache.get('select', [1], unreachable)
+    disk = QueryCache(str(tmp_path)).get('select', [1], unreachable)
+    for result in (fetched, memory, disk):
+        pd.testing.assert_frame_equal(result, df.reset_index(drop=True))
+
+
+def test_eviction_keeps_a_running_total(tmp_path, monkeypatch):
+    ## 928 byte files, three fit
+    cache = QueryCache(str(tmp_path), maxBytes=3000, memoryBytes=0)
+    ## the directory is read once, when the cache is opened
+    monkeypatch.setattr(cache, 'entries', unreachable)
+    for n in range(6):
+        cache.get('select', [n], lambda: np.arange(100, dtype=float) + n)
+        ## a hit makes the first entry the most recently used, so the others go before it
+        cache.get('select', [0], unreachable)
+    kept = sorted(os.listdir(str(tmp_path)))
+    stats = cache.stats()
+    assert stats.diskEntries == len(kept) == 3 and stats.evictions == 3
+    assert stats.diskBytes == sum(os.path.getsize(os.path.join(str(tmp_path), name)) for name in kept)
+    for n in (0, 4, 5):
+        np.testing.assert_array_equal(cache.get('select', [n], unreachable), np.arange(100, dtype=float) + n)
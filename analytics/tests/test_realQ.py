@@ -0,0 +1,154 @@
+'''
+The loader and the feature matrix against a real q process with the real qpython, skipped where
+there is no q binary on the PATH or qpython is not installed; the other tests run the same calls
+against fakeQ, which only knows the q functions as far as it was written to
+'''
+import sys
+import time
+import shutil
+import socket
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+
+Q = shutil.which('q')
+MODULES = ('qpython', 'kdbLoader', 'featureMatrix')
+
+pytestmark = pytest.mark.skipif(Q is None, reason='no q binary on the PATH')
+
+
+def unload():
+    return dict((name, sys.modules.pop(name)) for name in list(sys.modules) if name.split('.')[0] in MODULES)
+
+
+@pytest.fixture(scope='module')
+def modules():
+    ## the real qpython in place of the fake installed by conftest, with the loader modules imported again against it
+    saved = unload()
+    try:
+        qconnection = pytest.importorskip('qpython.qconnection')
+        import kdbLoader
+        import featureMatrix
+        yield qconnection, kdbLoader, featureMatrix
+    finally:
+        unload()
+        sys.modules.update(saved)
+
+
+@pytest.fixture(scope='module')
+def q(modules):
+    qconnection = modules[0]
+    s = socket.socket()
+    s.bind(('', 0))
+    port = s.getsockname()[1]
+    s.close()
+    ## stdin stays open, q exits at the end of its console input
+    proc = subprocess.Popen([Q, '-p', str(port)], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    conn = None
+    try:
+        for attempt in range(100):
+            try:
+                conn = qconnection.QConnection(host='localhost', port=port, pandas=True)
+                conn.open()
+                break
+            except OSError:
+                conn = None
+                time.sleep(0.1)
+        if conn is None:
+            pytest.fail('q did not listen on port %s' % port)
+        yield conn
+    finally:
+        if conn is not None:
+            conn.close()
+        proc.terminate()
+        proc.wait()
+
+
+@pytest.fixture(scope='module')
+def database(modules, q, tmp_path_factory):
+    kdbLoader = modules[1]
+    dates = pd.bdate_range('2019-01-02', periods=6)
+    df = pd.MultiIndex.from_product([dates, ['IBM US EQUITY', 'MSFT US EQUITY'], ['PX_LAST', 'PX_VOLUME', 'NAME']],
+                                    names=['Date', 'Ticker', 'Field']).to_frame(index=False)
+    df['Value'] = np.arange(len(df), dtype=float)
+    df['Text'] = None
+    names = df.Field == 'NAME'
+    df.loc[names, 'Value'] = np.nan
+    df.loc[names, 'Text'] = df.Ticker[names].str.split().str[0]
+    ## one missing value to come back as nan from the pivot
+    df = df.drop(index=3).reset_index(drop=True)
+    loader = kdbLoader.KdbLoader(q, str(tmp_path_factory.mktemp('realq') / 'db'))
+    loader.load(df)
+    loader.finish()
+    return loader, df[df.Text.isnull()], df[df.Text.notnull()]
+
+
+def sortRows(df, columns):
+    return df.sort_values(columns).reset_index(drop=True)
+
+
+def test_select_round_trip(database):
+    loader, floats, strings = database
+    df = sortRows(loader.select('20190101', '20191231'), ['DATE', 'TICKER', 'FIELD'])
+    expected = sortRows(floats, ['Date', 'Ticker', 'Field'])
+    np.testing.assert_array_equal(pd.to_datetime(df.DATE).values, expected.Date.values)
+    assert list(df.TICKER) == list(expected.Ticker)
+    assert list(df.FIELD) == list(expected.Field)
+    np.testing.assert_array_equal(df.VALUE.values, expected.Value.values)
+
+    df = loader.select('20190103', '20190104', tickers=['MSFT US EQUITY'], fields=['PX_LAST'])
+    assert len(df) == 2 and set(df.TICKER) == {'MSFT US EQUITY'} and set(df.FIELD) == {'PX_LAST'}
+
+    df = loader.select('20190101', '20191231', table=loader.tables[1])
+    assert len(df) == len(strings)
+    assert sorted(v.decode() if isinstance(v, bytes) else str(v) for v in df.VALUE) == sorted(strings.Text)
+
+
+def test_open_and_version(modules, database):
+    kdbLoader = modules[1]
+    loader, floats, strings = database
+    assert loader.open() == floats.Date.nunique()
+    dbdir, table, dates, rows = loader.version()
+    assert dates == sorted(set(kdbLoader.toQDates(floats.Date).tolist()))
+    assert sum(rows) == len(floats)
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+def test_pivot_matches_rows(modules, q, database, dtype):
+    featureMatrix = modules[2]
+    loader, floats, strings = database
+    block = featureMatrix.FeatureMatrix(q, dtype=dtype).build('20190101', '20191231')
+    assert block.values.dtype == np.dtype(dtype)
+    assert block.tickers == ['IBM US EQUITY', 'MSFT US EQUITY']
+    assert block.fields == ['PX_LAST', 'PX_VOLUME']
+    expected = floats.set_index(['Date', 'Ticker', 'Field']).Value.unstack(['Ticker', 'Field']).reindex(
+        columns=pd.MultiIndex.from_product([block.tickers, block.fields]))
+    np.testing.assert_array_equal(block.dates, expected.index.values.astype('datetime64[D]'))
+    np.testing.assert_array_equal(block.values.reshape(len(block.dates), -1), expected.values.astype(dtype))
+
+    blocked = featureMatrix.FeatureMatrix(q, dtype=dtype).build('20190101', '20191231', blockDays=4)
+    np.testing.assert_array_equal(block.values, blocked.values)
+
+
+def test_pivot_type_is_a_char_atom(modules, q, database):
+    ## the one char type code sent as a char list is what q rejects with 'type
+    kdbLoader, featureMatrix = modules[1:]
+    featureMatrix.FeatureMatrix(q).define()
+    with pytest.raises(Exception, match='type'):
+        q.sendSync('.matrix.pivot', np.bytes_(b'mktdata'), 0, 10000, kdbLoader.toSymbols(['IBM US EQUITY']),
+                   kdbLoader.toSymbols(['PX_LAST']), 'f', single_char_strings=True)
+
+
+def test_batch_of_one_kind(modules, q, tmp_path):
+    ## a batch with no strings or no floats still writes both tables of its dates with their column types
+    kdbLoader = modules[1]
+    dates = pd.bdate_range('2019-01-02', periods=2)
+    df = pd.MultiIndex.from_product([dates, ['IBM US EQUITY']], names=['Date', 'Ticker']).to_frame(index=False)
+    loader = kdbLoader.KdbLoader(q, str(tmp_path / 'db'))
+    loader.load(df.assign(Field='PX_LAST', Value=[1.0, 2.0], Text=None))
+    loader.load(df.assign(Date=df.Date + pd.Timedelta(days=7), Field='NAME', Value=np.nan, Text='IBM'))
+    loader.finish()
+    assert list(loader.select('20190101', '20191231').VALUE) == [1.0, 2.0]
+    strings = loader.select('20190101', '20191231', table=loader.tables[1])
+    assert [v.decode() if isinstance(v, bytes) else str(v) for v in strings.VALUE] == ['IBM', 'IBM']
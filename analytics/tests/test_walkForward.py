@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from qpython import qconnection
+from kdbLoader import KdbLoader
+import walkForward
+
+TICKERS = ['T%02d US EQUITY' % n for n in range(5)]
+FIELDS = ['PX_LAST', 'PX_VOLUME']
+OPTIONS = {'model': 'ridge', 'params': {'alpha': 1.0}, 'train': 40, 'test': 10, 'horizon': 3, 'processes': 1}
+
+
+class RecordingModel(object):
+    ## keeps the train rows it is fitted on
+    fits = []
+
+    def __init__(self, **params):
+        pass
+
+    def fit(self, X, y):
+        RecordingModel.fits.append((X.copy(), y.copy()))
+        return self
+
+    def predict(self, X):
+        return np.zeros(len(X))
+
+
+def tensor(dates=120, seed=0):
+    random = np.random.RandomState(seed)
+    values = np.empty((dates, len(TICKERS), len(FIELDS)))
+    values[:, :, 0] = 100.0 * np.exp(np.cumsum(random.normal(0, 0.01, (dates, len(TICKERS))), axis=0))
+    values[:, :, 1] = random.rand(dates, len(TICKERS))
+    return values
+
+
+@pytest.fixture
+def database(tmp_path):
+    q = qconnection.QConnection(host='localhost', port=0)
+    q.open()
+    values = tensor()
+    dates = pd.bdate_range('2019-01-02', periods=len(values))
+    index = pd.MultiIndex.from_product([dates, TICKERS, FIELDS], names=['Date', 'Ticker', 'Field']).to_frame(index=False)
+    index['Value'] = values.reshape(-1)
+    loader = KdbLoader(q, str(tmp_path / 'db'))
+    loader.load(index)
+    loader.finish()
+    return q, values
+
+
+def test_reused_windows_give_the_same_allocations(database, tmp_path):
+    q, values = database
+    workdir = str(tmp_path / 'walkforward')
+    first = walkForward.runWalkForward(q, '20190101', '20191231', FIELDS, workdir, **OPTIONS)
+    np.testing.assert_array_equal(first.allocations, walkForward.walkForward(values, first.dates, TICKERS, FIELDS, str(tmp_path / 'arrays'), **OPTIONS).allocations)
+    assert first.windows.fitted.all() and len(first.windows) == 8
+    again = walkForward.runWalkForward(q, '20190101', '20191231', FIELDS, workdir, **OPTIONS)
+    assert not again.windows.fitted.any()
+    np.testing.assert_array_equal(again.allocations, first.allocations)
+    assert again.backtest.getvalue() == first.backtest.getvalue()
+    assert first.allocations[:40].sum() == 0 and first.allocations[40:].sum() > 0
+
+    ## appended dates fit only the windows that read them
+    more = np.concatenate([values, tensor(140, seed=1)[120:]])
+    dates = pd.bdate_range('2019-01-02', periods=len(more))
+    appended = walkForward.walkForward(more, dates, TICKERS, FIELDS, workdir, **OPTIONS)
+    assert list(appended.windows.fitted) == [False] * 8 + [True] * 2
+    np.testing.assert_array_equal(appended.allocations[:120], first.allocations)
+
+
+def test_train_labels_stop_before_the_test_dates(tmp_path, monkeypatch):
+    ## the rows a window trains on, labels included, are the same whatever the test dates hold
+    monkeypatch.setattr(RecordingModel, 'fits', [])
+    values = tensor()
+    settings = {'model': __name__ + '.RecordingModel', 'params': {}, 'price': 0, 'fields': FIELDS, 'horizon': 3, 'top': 0.2}
+    window = (20, 60, 70)
+    changed = values.copy()
+    changed[60:] *= 1.5
+    for n, tensorValues in enumerate([values, changed]):
+        path = walkForward.storeTensor(tensorValues, str(tmp_path))
+        walkForward.fitWindow((path, window, settings, str(tmp_path / ('window%d.npy' % n))))
+    (X, y), (changedX, changedY) = RecordingModel.fits
+    np.testing.assert_array_equal(X, changedX)
+    np.testing.assert_array_equal(y, changedY)
+    ## the last train row is 3 dates before the test dates, its label the return up to the last train date
+    assert len(y) == (60 - 20 - 3) * len(TICKERS)
+    np.testing.assert_allclose(y[-len(TICKERS):], values[59, :, 0] / values[56, :, 0] - 1.0)
@@ -2,30 +2,48 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 import pandas as pd
 import numpy as np
 import logging
+import argparse
 import datetime
 import os.path
 import sys
-from pytz import timezone
-from scipy.stats import mstats
 
-import backtrader as bt
-import backtrader.analyzers as btanalyzers
-import matplotlib.pyplot as plt
+# backtrader, matplotlib and scipy are imported where they are used so the vector engine and
+# headless batch runs start without loading them
+import journal
+import vectorEngine
+import matrixCache
+import returnsReader
+import performance
+from recorder import DailyRecorder
+from fillLog import FillLog
 
+logger = logging.getLogger()
 
 #global variables
 SHOW_BACKTRADER_CHARTS = False
 
-# Structure to store daily values
-PNL_DICT = {}
-MKT_DICT = {}
-
 # enable winsorization
 WINSORIZATION_LEVEL = 1000
 
+# columns with bad prices
+DROP_LIST = ['x209', 'x291', 'x657', 'x1079', 'x2781', 'x2953', 'x3549', 'x3850', 'x4034', 'x5388',\
+             'x11286','x11882', 'x12486', 'x14258', 'x18092', 'x19354', 'x19503', 'x19540','x67592',\
+             'x751','x1493','x2028','x5431','x6103','x8532','x8547','x8667','x10746','x15703','x16990',\
+             'x17237','x19467','x21145','x21757','x62268', 'x6240','x6217']
+
+# read the return file in chunks of this many rows to bound memory; None reads it at once
+STREAM_CHUNKSIZE = None
+
+# cache the pivoted price and signal matrices; set to None to always parse the csv files
+CACHE_DIR = '../arabesque/cache'
+
 # control the output
 DEBUG = True
 SAVE_OUTPUT_FILES = False
+OUTPUT_DIR = '../arabesque'
+
+# run without charts, e.g. on batch nodes with no display
+HEADLESS = False
 
 # control the tickers to include
 NUM_TICKERS = 1
@@ -34,111 +52,27 @@ TICKERS = None #['x189']
 # initial cash balance
 START_BALANCE = 1000000.0
 
-class MySignal(bt.Strategy):
-    params = (('tradesizeadj', 1),)
-    lines = ('signal',)
-    global PNL_DICT, MKT_DICT
-
-    def __init__(self):
-        self.lines.signal = self.data.openinterest
-        self.order = None
-
-    def updateDict(self, dict, date, ticker, value):
-        if ticker in dict.keys():
-            dict[ticker].append((date, value))
-        else:
-            dict[ticker] = [(date, value)]
-
-    def next(self):
-        idx = self.datetime.idx
-        dt = self.datetime.date()
-        cash = self.broker.get_cash()
-        self.updateDict(MKT_DICT, idx, 'cash', cash)
-        # logger.info('processing data for %s row: %s  cash balance: %.2f' % (dt, idx, cash))
-        for i, d in enumerate(self.datas):
-            dn = d._name
-            pos = self.getposition(d).size
-            signal = d.openinterest.array[idx]
-            size = 0
-            if pos:
-                self.updateDict(MKT_DICT, idx, dn, pos * d.close.array[idx])
-                if signal > 0:
-                    prev_signal = d.openinterest.array[idx-1]
-                    if signal < prev_signal:
-                        # reduce the size...
-                        size = int(round(pos * (1 - signal/prev_signal)))
-                        if size > 10:
-                            # logger.info('Position: %s' % pos)
-                            self.order = self.sell(data=d, size=size, price=d.close[0])
-                    elif signal > prev_signal:
-                        # increase size
-                        size = int(self.sizer.getsizing(d, True) * signal)
-                        if size > 10:
-                            # logger.info('Position: %s' % pos)
-                            self.order = self.buy(data=d, size=size, price=d.close[0])
-                else:
-                    self.order = self.close(data=d)
-            elif signal > 0:
-                try:
-                    size = int(self.sizer.getsizing(d, True) * signal)
-                    self.order = self.buy(data=d, size=size) #, price=d.close[0])
-                    #self.updateDict(MKT_DICT, idx, dn, size * d.close.array[idx])
-                except Exception as ex:
-                    logger.info('Exception trading: %s  row: %s' % (dn, idx))
-                    pass
-
-    def notify_order(self, order):
-        if order.status in [order.Submitted, order.Accepted]:
-            return
-
-        if order.status in [order.Completed]:
-            if order.isbuy():
-                if DEBUG:
-                    logger.info('BUY EXECUTED, row: %s, Ticker: %s, Price: %.2f, Shares: %s, Cost: %.2f, Comm %.2f, Cash %.2f' %
-                          (order.plen, order.data._name, order.executed.price, order.size, order.executed.value, order.executed.comm, self.broker.getcash()))
-                self.buyprice = order.executed.price
-                self.buycomm = order.executed.comm
-            else:
-                if DEBUG:
-                    logger.info('SELL EXECUTED, row %s, Ticker: %s, Price: %.2f, shares: %s, Cost: %.2f, Comm %.2f, Cash %.2f' % (
-                        order.plen, order.data._name, order.executed.price, order.size, order.executed.value, order.executed.comm, self.broker.getcash()))
-                    pass
-            self.bar_executed = len(self)
-
-        elif order.status in [order.Canceled, order.Margin, order.Rejected]:
-            message = 'name %s idx: %s size: %s  price %s  cash: %s' % (order.data._name, order.plen, order.size, order.data.close[0], self.broker.getcash())
-            if order.status == order.Canceled:
-                logger.info('Order Margin exceeded: %s' % message)
-            elif order.status == order.Rejected:
-                logger.info('Order Margin exceeded: %s' % message)
-            elif order.status == order.Margin:
-                logger.info('Order Margin exceeded: %s' % message)
-
-        # Write down: no pending order
-        self.order = None
-
-    def notify_trade(self, trade):
-        if trade.isclosed:
-            ticker = trade.getdataname()
-            self.updateDict(PNL_DICT, trade.barclose, ticker, trade.pnlcomm)
-        return
-
-class MySizer(bt.sizers.PercentSizer):
-    def _getsizing(self, comminfo, cash, data, isbuy):
-        self.params.percents = 95
-        self.params.retint = True
-        price0 = data.close[0]
-        try:
-            price1 = data.close[1]
-        except:
-            price1 = price0
-        price = max(price0, price1)
-        size = cash / price * (self.params.percents / 100)
-        if self.p.retint:
-            size = int(size)
-        return size
-
-def convertReturnsToPrice(filename):
+# broker commission
+COMMISSION = 0.001
+
+# backtest engine: 'cerebro' runs backtrader, 'vector' runs vectorEngine over the whole universe,
+# 'broker' runs vectorEngine and keeps its fills and refused orders in a columnar FillLog
+ENGINE = 'cerebro'
+
+def winsorizationLevel(level):
+    # one type per level so 1000, 1000.0 and '1000' share a cache entry; none or 0 is off
+    level = float(level or 0)
+    return int(level) if level.is_integer() else level
+
+def matrixParams(winsorization=None):
+    # the settings that change the cached price and signal matrices
+    level = WINSORIZATION_LEVEL if winsorization is None else winsorization
+    return {'winsorization': winsorizationLevel(level), 'droplist': DROP_LIST}
+
+def convertReturnsToPrice(filename, winsorization=None):
+    level = winsorizationLevel(WINSORIZATION_LEVEL if winsorization is None else winsorization)
+    if STREAM_CHUNKSIZE:
+        return returnsReader.streamReturnsToPrice(filename, level, STREAM_CHUNKSIZE)
     df = pd.read_csv(filename)
     df['assetid'] = 'x' + df.assetid.astype(str)
     # to maintain same order as pivot sorts cols alphabetically
@@ -146,21 +80,30 @@ def convertReturnsToPrice(filename):
     df = df.pivot(index='date', columns='assetid', values='value')
     df.index = pd.to_datetime(df.index)
     df = df.reindex(order, axis=1)
-    if WINSORIZATION_LEVEL:
-        df = winsorize(df)
+    if level:
+        df = winsorize(df, level=level)
     dfp = 100 + ((df + 1).cumprod() - 1) * 100
     return dfp
 
+def selectTickers(df):
+    if TICKERS:
+        df = df[TICKERS]
+    elif NUM_TICKERS and NUM_TICKERS < len(df.columns):
+        df = df[df.columns[0:NUM_TICKERS]]
+    return df
+
 def getPrices(filename):
-    df = convertReturnsToPrice(filename)
+    return selectTickers(readPrices(filename))
+
+def readPrices(filename, winsorization=None):
+    return cleanPrices(convertReturnsToPrice(filename, winsorization))
+
+def cleanPrices(df):
     # read the prices
     df = df.sort_index()
     df = df.ffill()
-    # drop columns with bad prices
-    droplist = ['x209', 'x291', 'x657', 'x1079', 'x2781', 'x2953', 'x3549', 'x3850', 'x4034', 'x5388',\
-                'x11286','x11882', 'x12486', 'x14258', 'x18092', 'x19354', 'x19503', 'x19540','x67592',\
-                'x751','x1493','x2028','x5431','x6103','x8532','x8547','x8667','x10746','x15703','x16990',\
-                'x17237','x19467','x21145','x21757','x62268', 'x6240','x6217']
+    # drop columns with bad prices, the listed ones only where the file has them
+    droplist = [col for col in DROP_LIST if col in df.columns]
 
     for col in df.columns:
         distinct = df[col].unique()
@@ -169,15 +112,12 @@ def getPrices(filename):
     if len(droplist):
         logger.info('dropping nan columns %s' % droplist)
         df = df.drop(droplist, axis=1)
-    if TICKERS:
-        df = df[TICKERS]
-    elif NUM_TICKERS and NUM_TICKERS < len(df.columns):
-        df = df[df.columns[0:NUM_TICKERS]]
     return df
 
 
-def winsorize(df, limits=(0.01,0.01), inclusive=(False,False)):
+def winsorize(df, limits=(0.01,0.01), inclusive=(False,False), level=None):
     def winsorizeSeries(s):
+        from scipy.stats import mstats
         try:
             a = s[~pd.isnull(s)].astype(float)
             s[~pd.isnull(s)] = mstats.winsorize(a, limits)
@@ -185,14 +125,23 @@ def winsorize(df, limits=(0.01,0.01), inclusive=(False,False)):
             pass
         return s
         # df = df.apply(winsorizeSeries, axis=0)
-    df = df.clip(upper=WINSORIZATION_LEVEL)
+    df = df.clip(upper=WINSORIZATION_LEVEL if level is None else level)
     return df
 
 def getSignals(dfp, filename):
+    return selectTickers(readSignals(dfp, filename))
+
+def readSignals(dfp, filename):
+    return alignSignals(dfp, readAllocations(filename))
+
+def readAllocations(filename):
     #read the signals
     df = pd.read_csv(filename)
     df = df.set_index('date')
     df.index = pd.to_datetime(df.index)
+    return df
+
+def alignSignals(dfp, df):
     # reorder signal columns to match prices...
     df = df[dfp.columns]
     # shift columns up two periods...
@@ -205,12 +154,18 @@ def getSignals(dfp, filename):
         df = dfm.append(df)
     df = df.sort_index()
     df = df.fillna(0)
-    if TICKERS:
-        df = df[TICKERS]
-    elif NUM_TICKERS and NUM_TICKERS < len(df.columns):
-        df = df[df.columns[0:NUM_TICKERS]]
     return df
 
+def loadMatrices(priceFile, signalFile):
+    def build():
+        dfp = readPrices(priceFile)
+        return dfp, readSignals(dfp, signalFile)
+    if CACHE_DIR:
+        dfp, dfs = matrixCache.loadMatrices(CACHE_DIR, [priceFile, signalFile], matrixParams(), build)
+    else:
+        dfp, dfs = build()
+    return selectTickers(dfp), selectTickers(dfs)
+
 def computePriceWeightedSignals(dfp, dfs):
     # compute price weighted signals
     df = dfp.mask(dfs == 0, 0.0)
@@ -223,58 +178,21 @@ def computeEqualWeightedSignals(dfs):
         dfs = dfs.div(sum, axis=0).fillna(0.0)
     return dfs
 
-def addData(cerebro, dfp, dfs):
-    for idx in range(len(dfp.columns)):
-        col = dfp.columns[idx]
-        # if col == 'x205':
-        df = dfp[[col]].join(dfs[[col]],rsuffix='x').fillna(-1.0)
-        # use close for the price and open for the signal
-        df.columns = ['close', 'openinterest']
-        df['open'] = df.close
-        df['high'] = df.close
-        df['low'] = df.close
-        df['volume'] = df.close
-        data = bt.feeds.PandasData(dataname=df, name=col)
-        cerebro.adddata(data)
-    logger.info('added %s columns' % (idx+1))
-
-def genPnlTable(dfp, dict):
-    df = pd.DataFrame()
-    for key in dict.keys():
-        dfi = pd.DataFrame(dict[key], columns=['index', key]).set_index('index')
-        df = dfi if df.empty else df.join(dfi)
-    df = dfp.reset_index()[['date']].join(df).set_index('date')
-    ## to preserve column order
-    cols = set(dfp.columns) & set(df.columns)
-    order = ['cash']
-    order.extend(dfp.columns[[x in cols for x in dfp.columns]])
-    df = df.reindex(columns=order)
-    return df
-
-def initLogger():
+def initLogger(engine=ENGINE):
     root = '/tmp/marketdata/' if 'linux' in sys.platform else '../log'
     os.makedirs(root, exist_ok=True)
-    fh = logging.FileHandler(os.path.join(root,'backtest-{:%Y-%m-%d-%H-%M-%S}.log'.format(datetime.datetime.now())))
-    formatter = logging.Formatter('%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
-    if not DEBUG:
-        logger.addHandler(logging.StreamHandler())
-    logger.setLevel(logging.INFO)
+    name = os.path.join(root, 'backtest-{:%Y-%m-%d-%H-%M-%S}'.format(datetime.datetime.now()))
+    # the Cerebro fills and rejects go to the journal when debugging, written with the log by a
+    # background thread; the vector engine journals nothing and the broker keeps its orders in a FillLog
+    journalfile = name + '.jsonl' if DEBUG and engine == 'cerebro' else None
+    journal.startLogging(name + '.log', stream=not DEBUG, journalfile=journalfile)
 
-def plotOutputResults(dfp, dfc, balance, strats):
-    dfc['strat'] = dfc.fillna(0.0).sum(axis=1)
+def plotOutputResults(dfp, dfr, stats, balance, sharpe):
+    import matplotlib.pyplot as plt
 
     ## df = dfp.mul(START_BALANCE / 100.0)[dfc.drop(['cash', 'strat'], axis=1).columns].join(dfc[['strat']]).ffill()
 
-    # compute benchmark return by aggregating all returns
-    # securities in the price file to get singular returns
-    dfx = dfp.pct_change()
-    # compute row weights to filter NAN values per row
-    w = dfx.apply(lambda x: x.count(), axis=1)
-    dfr = pd.DataFrame(dfx.div(w, axis=0).sum(axis=1), columns=['benchmark'])
-    dfr = START_BALANCE + ((dfr + 1).cumprod() - 1) * START_BALANCE
-    df = dfr.join(dfc[['strat']]).ffill()
+    df = dfr[['benchmark', 'strat']]
     ax = df.plot(kind='line')
 
     # add stats...
@@ -287,53 +205,110 @@ def plotOutputResults(dfp, dfc, balance, strats):
         'End Date:   %s' % dfp.index[-1].strftime('%m/%d/%Y'),
         'AUM Start:  $%.0fMM' % (START_BALANCE/1E6),
         'AUM End:    $%.0fMM' % (balance/1E6),
-        'Sharpe:     %.2f' % strats[0].analyzers.mysharpe.get_analysis()['sharperatio']))
+        'Sharpe:     %.2f' % (sharpe or 0.0),
+        'Sortino:    %.2f' % stats['sortino'],
+        'Max DD:     %.1f%%' % (stats['maxDrawdown'] * 100)))
 
     props = dict(boxstyle='round', facecolor='dodgerblue', alpha=0.5)
     ax.text(0.1, 0.65, textstr, transform=ax.transAxes, family='monospace', fontsize=8, verticalalignment='top', bbox=props)
     plt.legend(loc='upper left')
     plt.show()
 
-def main():
-    logger.info('Starting Backtest program')
-    showChart = True
-    cerebro = bt.Cerebro()
-    cerebro.addstrategy(MySignal)
-    #cerebro.addsizer(bt.sizers.PercentSizer)
-    #cerebro.addsizer(bt.sizers.AllInSizer)
-    cerebro.addsizer(MySizer)
-    cerebro.addanalyzer(btanalyzers.SharpeRatio, _name='mysharpe')
-    cerebro.broker.setcommission(commission=0.001)
-    cerebro._disable_runonce()
-
-    dfp = getPrices('../arabesque/DailyAssetReturns.csv')
-    dfs = getSignals(dfp, '../arabesque/IEOR4576_ALLOC.csv')
+def computeResults(dfp, dfc):
+    # compute benchmark return by aggregating all returns
+    # securities in the price file to get singular returns
+    strat = dfc.fillna(0.0).sum(axis=1)
+    mkt = dfc.drop(['cash'], axis=1).reindex(columns=dfp.columns)
+    stats, dfr = performance.computeStatistics(dfp, strat.values, START_BALANCE, mkt.values)
+    logger.info('Performance statistics\n%s' % stats)
+    return stats, dfr
+
+def writeResults(outdir, dfc, dft, dfr, stats, dff=None):
+    os.makedirs(outdir, exist_ok=True)
+    dfc.to_csv(os.path.join(outdir, 'backtest-daily-pnl.csv'))
+    dft.to_csv(os.path.join(outdir, 'backtest-trade-pnl.csv'))
+    dfr.to_csv(os.path.join(outdir, 'backtest-equity.csv'))
+    stats.to_csv(os.path.join(outdir, 'backtest-stats.csv'), header=['value'])
+    if dff is not None:
+        dff.to_csv(os.path.join(outdir, 'backtest-fills.csv'), index=False)
+    logger.info('wrote results to %s' % outdir)
+
+def runVector(dfp, dfs, log=None):
+    result = vectorEngine.runVectorizedBacktest(dfp, dfs, START_BALANCE, COMMISSION, log=log)
+    return result.recorder, result.getvalue(), result.sharpe, None
+
+def runCerebro(dfp, dfs):
+    import cerebroEngine
+    recorder = DailyRecorder(dfp.index, dfp.columns)
+    cerebro, sharpe = cerebroEngine.runCerebro(dfp, dfs, recorder, START_BALANCE, COMMISSION, DEBUG)
+    return recorder, cerebro.broker.getvalue(), sharpe, cerebro
+
+def runBacktest(priceFile, signalFile, engine=None, outdir=None, headless=None):
+    '''
+    library entry point: run the backtest on the given files and return the performance
+    statistics; results are written to outdir when given and nothing is plotted when headless
+    '''
+    engine = engine or ENGINE
+    headless = HEADLESS if headless is None else headless
+
+    dfp, dfs = loadMatrices(priceFile, signalFile)
     #dfx = computePriceWeightedSignals(dfp, dfs)
     dfs = computeEqualWeightedSignals(dfs)
 
-    addData(cerebro, dfp, dfs)
-
-    cerebro.broker.setcash(1000000.0)
-    logger.info('Starting Portfolio Value: %.2f' % cerebro.broker.getvalue())
-    strats = cerebro.run()
-    logger.info('Sharpe Ratio: %s' % strats[0].analyzers.mysharpe.get_analysis()['sharperatio'])
-    logger.info('Final Portfolio Value: %.2f' % cerebro.broker.getvalue())
-
-    dfc = genPnlTable(dfp, MKT_DICT)
-
-    if SAVE_OUTPUT_FILES:
-        dft = genPnlTable(dfp, PNL_DICT)
-        dft.to_csv('../arabesque/backtest-trade-pnl.csv')
-        dfc.to_csv('../arabesque/backtest-daily-pnl.csv')
-
-    if not SHOW_BACKTRADER_CHARTS:
-        plotOutputResults(dfp, dfc, cerebro.broker.getvalue(), strats)
+    logger.info('Starting Portfolio Value: %.2f' % START_BALANCE)
+    fills = FillLog() if engine == 'broker' else None
+    if engine in ('vector', 'broker'):
+        recorder, balance, sharpe, cerebro = runVector(dfp, dfs, fills)
     else:
+        recorder, balance, sharpe, cerebro = runCerebro(dfp, dfs)
+    if fills is not None:
+        # one summary line instead of a log line per order
+        logger.info('Orders by status: %s' % fills.counts())
+    logger.info('Sharpe Ratio: %s' % sharpe)
+    logger.info('Final Portfolio Value: %.2f' % balance)
+
+    dfc = recorder.dailyPnl()
+    stats, dfr = computeResults(dfp, dfc)
+    stats['sharpeRatio'] = sharpe if sharpe is not None else np.nan
+    stats['finalValue'] = balance
+
+    if outdir:
+        dff = fills.toFrame(dfp.index, dfp.columns) if fills is not None else None
+        writeResults(outdir, dfc, recorder.tradePnl(), dfr, stats, dff)
+
+    if headless:
+        pass
+    elif SHOW_BACKTRADER_CHARTS and cerebro is not None:
         pkwargs = dict(style='bar')
         cerebro.plot(**pkwargs)
+    else:
+        plotOutputResults(dfp, dfr, stats, balance, sharpe)
+    return stats
+
+def main():
+    global NUM_TICKERS, CACHE_DIR, STREAM_CHUNKSIZE
+    parser = argparse.ArgumentParser(prog='Backtest')
+    parser.add_argument('-p', '--prices', help='daily asset returns file', default='../arabesque/DailyAssetReturns.csv')
+    parser.add_argument('-s', '--signals', help='allocation file', default='../arabesque/IEOR4576_ALLOC.csv')
+    parser.add_argument('-e', '--engine', help='backtest engine: cerebro, vector, broker', default=ENGINE)
+    parser.add_argument('-o', '--outdir', help='output directory to write results', default=OUTPUT_DIR if SAVE_OUTPUT_FILES else None)
+    parser.add_argument('-t', '--tickers', help='number of tickers, 0 for the full universe', type=int, default=NUM_TICKERS)
+    parser.add_argument('-c', '--cachedir', help='matrix cache directory, none to disable', default=CACHE_DIR)
+    parser.add_argument('-k', '--chunksize', help='read the return file in chunks of this many rows', type=int, default=STREAM_CHUNKSIZE)
+    parser.add_argument('--headless', action='store_true', default=HEADLESS, help='do not plot, only log and write results')
+
+    args = parser.parse_args()
+    NUM_TICKERS = args.tickers
+    CACHE_DIR = None if args.cachedir in (None, '', 'none') else args.cachedir
+    STREAM_CHUNKSIZE = args.chunksize
+
+    initLogger(args.engine)
+    logger.info('location = %s %s' % (__location__, sys.version))
+    logger.info('Starting Backtest program')
+    stats = runBacktest(args.prices, args.signals, args.engine, args.outdir, args.headless)
+    return stats['finalValue']
+
 if __name__ == '__main__':
     __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
     logger = logging.getLogger()
-    initLogger()
-    logger.info('location = %s %s' % (__location__, sys.version))
     main()
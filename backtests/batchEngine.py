@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+'''
+Batched vectorized backtest of many allocation matrices against one price matrix
+
+The signals are a (portfolios x dates x assets) stack over the dates and assets of dfp.  The
+bars are walked once and every rule of vectorEngine (the MySignal rebalance, the MySizer
+lookahead sizing and the broker's submit and execution cash checks with percentage commission)
+is applied to a (portfolios x assets) state per bar, so one pass costs about as much as a few
+single runs however many portfolios are stacked.  A portfolio whose buys overrun its cash on a
+bar is replayed order by order like the broker, the others stay vectorized.  Per portfolio the
+equity curve, the rejected orders and the performance statistics are returned:
+
+    dfp = backtest.getPrices('../arabesque/DailyAssetReturns.csv')
+    result = runFiles(dfp, ['../arabesque/model%d.csv' % n for n in range(50)])
+    result.stats.sort_values('sharpe')
+'''
+import os
+import time
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+import vectorEngine
+import performance
+
+logger = logging.getLogger(__name__)
+
+
+class BatchResult(object):
+    def __init__(self, equity, stats, rejected):
+        # dates x portfolios
+        self.equity = equity
+        # portfolios x statistics
+        self.stats = stats
+        self.rejected = rejected
+
+    def getvalue(self):
+        return self.equity.iloc[-1]
+
+
+class BatchState(object):
+    ## vectorEngine.EngineState with a row per portfolio; orders are kept as flat indices and sizes
+    def __init__(self, portfolios, assets, cash):
+        self.cash = np.full(portfolios, float(cash))
+        self.pos = np.zeros((portfolios, assets))
+        self.price = np.zeros((portfolios, assets))
+        self.orderIdx = np.array([], dtype=np.int64)
+        self.orderQty = np.array([])
+        self.rejected = np.zeros(portfolios, dtype=np.int64)
+
+
+def runningCash(cash, rows, delta):
+    '''
+    cash plus the running sum of delta within each portfolio, rows sorted; the deltas of each
+    portfolio are laid out left aligned in a row of their own so the sums are the same cumsum
+    vectorEngine takes over the orders of one portfolio
+    '''
+    counts = np.bincount(rows, minlength=len(cash))
+    slot = np.arange(len(rows)) - (np.cumsum(counts) - counts)[rows]
+    table = np.zeros((len(cash), counts.max() if len(rows) else 0))
+    table[rows, slot] = delta
+    return (cash[:, None] + np.cumsum(table, axis=1))[rows, slot]
+
+
+def executeBatch(state, created, fill, commission):
+    '''
+    fill the orders of every portfolio as vectorEngine.executeOrders does for one: in asset
+    order, rejected orders still consume cash at the submit check; the traded value per
+    portfolio is returned
+    '''
+    P, N = state.pos.shape
+    idx, qty = state.orderIdx, state.orderQty
+    rows, cols = np.divmod(idx, N)
+    buy = qty > 0
+    size = np.abs(qty)
+
+    ## check_submitted at the creation price
+    notional = size * created[cols]
+    accepted = runningCash(state.cash, rows, np.where(buy, -notional, notional) - notional * commission) >= 0.0
+    state.rejected += np.bincount(rows[~accepted], minlength=P)
+    idx, qty, rows, cols, buy, size = idx[accepted], qty[accepted], rows[accepted], cols[accepted], buy[accepted], size[accepted]
+
+    ## execution at the next bar
+    px = fill[cols]
+    avg = state.price.flat[idx]
+    comm = size * px * commission
+    pnl = np.where(buy, 0.0, size * (px - avg))
+    delta = np.where(buy, -(size * px), size * avg + pnl) - comm
+    running = runningCash(state.cash, rows, delta)
+    executed = np.ones(len(idx), dtype=bool)
+    overrun = np.unique(rows[buy & (running < 0.0)])
+    last = np.flatnonzero(np.append(rows[1:] != rows[:-1], True)) if len(rows) else np.array([], dtype=np.int64)
+    settled = ~np.isin(rows[last], overrun)
+    state.cash[rows[last][settled]] = running[last][settled]
+    for p in overrun:
+        ## some buy exceeded the cash of this portfolio; replay its orders like the broker
+        cash = state.cash[p]
+        for k in np.flatnonzero(rows == p):
+            c = cash + delta[k]
+            if buy[k] and c < 0.0:
+                executed[k] = False
+                continue
+            cash = c
+        state.cash[p] = cash
+    state.rejected += np.bincount(rows[~executed], minlength=P)
+
+    idx, qty, px, rows = idx[executed], qty[executed], px[executed], rows[executed]
+    pos = state.pos.flat[idx]
+    avg = state.price.flat[idx]
+    newpos = pos + qty
+    avg = np.where(qty > 0, (avg * pos + qty * px) / np.where(newpos, newpos, 1.0), avg)
+    state.price.flat[idx] = np.where(newpos == 0, 0.0, avg)
+    state.pos.flat[idx] = newpos
+    return np.bincount(rows, weights=np.abs(qty * px), minlength=P)
+
+
+def simulateBatch(state, prices, signals, commission=0.001, percents=vectorEngine.SIZER_PERCENTS):
+    '''
+    run every portfolio of the (portfolios x dates x assets) signals over the (dates x assets)
+    prices in the engine convention; returns the (portfolios x dates) values and traded values.
+    Only the open positions and the assets with a positive signal are visited on a bar
+    '''
+    T, N = prices.shape
+    P = len(signals)
+    pos = state.pos
+    values = np.empty((P, T))
+    traded = np.zeros((P, T))
+    lookahead = np.maximum(prices, np.vstack([prices[1:], prices[-1:]]))
+
+    for t in range(T):
+        p = prices[t]
+        if t and len(state.orderIdx):
+            traded[:, t] = executeBatch(state, prices[t - 1], p, commission)
+        values[:, t] = state.cash + pos @ p
+        state.orderIdx, state.orderQty = state.orderIdx[:0], state.orderQty[:0]
+        if t == T - 1:
+            break
+        s = signals[:, t]
+        candidates = np.flatnonzero((pos != 0) | (s > 0))
+        rows, cols = np.divmod(candidates, N)
+        sv = np.asarray(s[rows, cols], dtype=float)
+        prev = np.asarray(signals[rows, t - 1 if t else -1, cols], dtype=float)
+        held = pos.flat[candidates]
+        sizing = np.trunc(state.cash[rows] / lookahead[t, cols] * (percents / 100))
+
+        orders = np.where((held != 0) & (sv <= 0), -held, 0.0)
+        reduce = (held != 0) & (sv > 0) & (sv < prev)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            size = np.round(held * (1 - sv / prev))
+        orders = np.where(reduce & (size > vectorEngine.MIN_TRADE_SIZE), -size, orders)
+        size = np.trunc(sizing * sv)
+        increase = (held != 0) & (sv > 0) & (sv > prev)
+        orders = np.where(increase & (size > vectorEngine.MIN_TRADE_SIZE), size, orders)
+        orders = np.where((held == 0) & (sv > 0) & (size > 0), size, orders)
+        placed = orders != 0
+        state.orderIdx, state.orderQty = candidates[placed], orders[placed]
+    return values, traded
+
+
+def stackSignals(dfp, frames):
+    ## (portfolios x dates x assets) in the engine convention from signal frames aligned on dfp
+    stack = np.empty((len(frames), len(dfp.index), len(dfp.columns)))
+    for n, dfs in enumerate(frames):
+        stack[n] = vectorEngine.prepareArrays(dfp, dfs)[1]
+        stack[n][np.isnan(stack[n])] = -1.0
+    return stack
+
+
+def runBatch(dfp, signals, cash=1000000.0, commission=0.001, percents=vectorEngine.SIZER_PERCENTS, names=None):
+    '''
+    backtest a list of signal frames or a (portfolios x dates x assets) array already aligned on
+    dfp with missing values -1 against the prices of dfp
+    '''
+    if not isinstance(signals, np.ndarray):
+        signals = stackSignals(dfp, signals)
+    names = list(names) if names is not None else list(range(len(signals)))
+    prices = dfp.values.astype(float)
+    prices = np.where(np.isnan(prices), -1.0, prices)
+    state = BatchState(len(signals), len(dfp.columns), cash)
+    start = time.time()
+    values, traded = simulateBatch(state, prices, signals, commission, percents)
+    logger.info('batch backtest: %s portfolios %s bars %s assets in %.2fs' % ((len(signals),) + prices.shape + (time.time() - start,)))
+
+    rows = []
+    bench = performance.benchmarkReturns(dfp.values)
+    for n, name in enumerate(names):
+        stats, series = performance.computeStatistics(dfp, values[n], cash, bench=bench)
+        stats['turnover'] = (traded[n] / values[n]).mean() * performance.TRADING_DAYS
+        stats['sharpeRatio'] = vectorEngine.sharpeRatio(dfp.index, values[n], cash)
+        stats['finalValue'] = values[n, -1]
+        stats['rejected'] = state.rejected[n]
+        rows.append(stats.rename(name))
+    equity = pd.DataFrame(values.T, index=dfp.index, columns=names)
+    return BatchResult(equity, pd.DataFrame(rows), state.rejected)
+
+
+def runFiles(dfp, signalFiles, weighting='equal', **options):
+    ## the batch over allocation files, each read and aligned on the shared price matrix
+    import backtest
+    frames = []
+    for filename in signalFiles:
+        dfs = backtest.selectTickers(backtest.readSignals(dfp, filename))
+        frames.append(backtest.computePriceWeightedSignals(dfp, dfs) if weighting == 'price' else backtest.computeEqualWeightedSignals(dfs))
+    return runBatch(dfp, frames, names=[os.path.basename(f) for f in signalFiles], **options)
+
+
+def main():
+    import backtest
+    parser = argparse.ArgumentParser(prog='BatchBacktest')
+    parser.add_argument('-p', '--prices', help='daily asset returns file', default='../arabesque/DailyAssetReturns.csv')
+    parser.add_argument('-s', '--signals', help='comma separated allocation files', default='../arabesque/IEOR4576_ALLOC.csv')
+    parser.add_argument('-g', '--weighting', help='signal weighting: equal, price', default='equal')
+    parser.add_argument('-t', '--tickers', help='number of tickers, 0 for the full universe', type=int, default=0)
+    parser.add_argument('-o', '--outdir', help='output directory to write results', default=None)
+    args = parser.parse_args()
+
+    backtest.NUM_TICKERS = args.tickers
+    dfp = backtest.getPrices(args.prices)
+    result = runFiles(dfp, args.signals.split(','), args.weighting, cash=backtest.START_BALANCE, commission=backtest.COMMISSION)
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+        result.equity.to_csv(os.path.join(args.outdir, 'batch-equity.csv'))
+        result.stats.to_csv(os.path.join(args.outdir, 'batch-stats.csv'))
+    return result.stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('batch stats\n%s' % main().to_string())
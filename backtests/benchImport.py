@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+'''
+Cold import time of the backtest modules
+
+Each module is imported in a fresh interpreter so nothing is already cached in sys.modules; the
+median wall time over the repeats is reported together with the heavy optional packages the
+import pulled in, which should stay empty for the headless entry points.
+
+    python benchImport.py -m backtest,sweep,incremental -r 5
+'''
+import os
+import sys
+import json
+import logging
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = ['backtrader', 'matplotlib', 'scipy']
+
+PROBE = '''
+import sys, time, json
+t = time.perf_counter()
+import %s
+t = time.perf_counter() - t
+print(json.dumps({'seconds': t, 'loaded': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def importTime(module, cwd):
+    out = subprocess.check_output([sys.executable, '-c', PROBE % (module, HEAVY_MODULES)], cwd=cwd)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def runBenchmark(modules, repeats=5, cwd=None):
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    for module in modules:
+        runs = [importTime(module, cwd) for _ in range(repeats)]
+        times = np.array([r['seconds'] for r in runs])
+        rows.append({'module': module,
+                     'median': np.median(times),
+                     'min': times.min(),
+                     'max': times.max(),
+                     'heavy': ','.join(runs[-1]['loaded'])})
+    return pd.DataFrame(rows).set_index('module')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BenchImport')
+    parser.add_argument('-m', '--modules', help='comma separated modules to import', default='backtest,vectorEngine,sweep,incremental,cerebroEngine')
+    parser.add_argument('-r', '--repeats', help='number of fresh interpreters per module', type=int, default=5)
+    args = parser.parse_args()
+    return runBenchmark(args.modules.split(','), args.repeats)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('import times\n%s' % main().to_string())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+'''
+backtrader strategy, sizer and data feeds for the Cerebro engine in backtest.py
+
+Kept apart from backtest.py so that importing it (or running the vector engine) does not
+pull in backtrader; backtest.runCerebro imports this module only when the Cerebro engine runs.
+'''
+import logging
+import numpy as np
+
+import backtrader as bt
+import backtrader.analyzers as btanalyzers
+
+import journal
+from sparseSignals import SparseSignals
+
+logger = logging.getLogger()
+
+class MySignal(bt.Strategy):
+    params = (('tradesizeadj', 1), ('recorder', None), ('debug', True), ('signals', None),)
+    lines = ('signal',)
+
+    def __init__(self):
+        self.lines.signal = self.data.openinterest
+        self.order = None
+        self.recorder = self.p.recorder
+        self.signals = self.p.signals
+        self.dataIndex = dict((d, i) for i, d in enumerate(self.datas))
+        # indices of the feeds with an open position, kept up to date in notify_order
+        self.held = set()
+
+    def next(self):
+        idx = self.datetime.idx
+        dt = self.datetime.date()
+        cash = self.broker.get_cash()
+        self.recorder.recordCash(idx, cash)
+        # logger.info('processing data for %s row: %s  cash balance: %.2f' % (dt, idx, cash))
+        # only the assets with a positive or changed signal and the open positions can trade,
+        # visited in feed order so orders are queued the same way as a loop over every feed
+        cols = self.signals.active(idx)
+        if self.held:
+            cols = np.union1d(cols, np.fromiter(self.held, dtype=np.int64, count=len(self.held)))
+        signals = self.signals.lookup(idx, cols)
+        prev_signals = self.signals.lookup(idx - 1, cols)
+        for i, signal, prev_signal in zip(cols.tolist(), signals.tolist(), prev_signals.tolist()):
+            d = self.datas[i]
+            dn = d._name
+            pos = self.getposition(d).size
+            size = 0
+            if pos:
+                self.recorder.recordMarket(idx, i, pos * d.close.array[idx])
+                if signal > 0:
+                    if signal < prev_signal:
+                        # reduce the size...
+                        size = int(round(pos * (1 - signal/prev_signal)))
+                        if size > 10:
+                            # logger.info('Position: %s' % pos)
+                            self.order = self.sell(data=d, size=size, price=d.close[0])
+                    elif signal > prev_signal:
+                        # increase size
+                        size = int(self.sizer.getsizing(d, True) * signal)
+                        if size > 10:
+                            # logger.info('Position: %s' % pos)
+                            self.order = self.buy(data=d, size=size, price=d.close[0])
+                else:
+                    self.order = self.close(data=d)
+            elif signal > 0:
+                try:
+                    size = int(self.sizer.getsizing(d, True) * signal)
+                    self.order = self.buy(data=d, size=size) #, price=d.close[0])
+                except Exception as ex:
+                    logger.info('Exception trading: %s  row: %s' % (dn, idx))
+                    pass
+
+    def notify_order(self, order):
+        if order.status in [order.Submitted, order.Accepted]:
+            return
+
+        if order.status in [order.Completed]:
+            if self.getposition(order.data).size:
+                self.held.add(self.dataIndex[order.data])
+            else:
+                self.held.discard(self.dataIndex[order.data])
+            if self.p.debug and journal.enabled():
+                journal.event('fill', row=order.plen, ticker=order.data._name, size=order.executed.size, price=order.executed.price,
+                              value=order.executed.value, commission=order.executed.comm, cash=self.broker.getcash())
+            if order.isbuy():
+                self.buyprice = order.executed.price
+                self.buycomm = order.executed.comm
+            self.bar_executed = len(self)
+
+        elif order.status in [order.Canceled, order.Margin, order.Rejected]:
+            if journal.enabled():
+                journal.event('reject', row=order.plen, ticker=order.data._name, size=order.size, price=order.data.close[0],
+                              cash=self.broker.getcash(), status=order.getstatusname())
+            else:
+                logger.info('Order %s: name %s idx: %s size: %s  price %s  cash: %s' % (order.getstatusname(), order.data._name, order.plen,
+                                                                                       order.size, order.data.close[0], self.broker.getcash()))
+
+        # Write down: no pending order
+        self.order = None
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self.recorder.recordTrade(trade.barclose, self.dataIndex[trade.data], trade.pnlcomm)
+        return
+
+class MySizer(bt.sizers.PercentSizer):
+    def _getsizing(self, comminfo, cash, data, isbuy):
+        self.params.percents = 95
+        self.params.retint = True
+        price0 = data.close[0]
+        try:
+            price1 = data.close[1]
+        except:
+            price1 = price0
+        price = max(price0, price1)
+        size = cash / price * (self.params.percents / 100)
+        if self.p.retint:
+            size = int(size)
+        return size
+
+def addData(cerebro, dfp, dfs):
+    for idx in range(len(dfp.columns)):
+        col = dfp.columns[idx]
+        # if col == 'x205':
+        df = dfp[[col]].join(dfs[[col]],rsuffix='x').fillna(-1.0)
+        # use close for the price and open for the signal
+        df.columns = ['close', 'openinterest']
+        df['open'] = df.close
+        df['high'] = df.close
+        df['low'] = df.close
+        df['volume'] = df.close
+        data = bt.feeds.PandasData(dataname=df, name=col)
+        cerebro.adddata(data)
+    logger.info('added %s columns' % (idx+1))
+
+def runCerebro(dfp, dfs, recorder, cash, commission, debug=True):
+    signals = SparseSignals.fromFrame(dfs, dfp.index, dfp.columns)
+    logger.info('sparse signals: %s nonzero of %s x %s' % ((signals.nnz,) + signals.shape))
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(MySignal, recorder=recorder, debug=debug, signals=signals)
+    #cerebro.addsizer(bt.sizers.PercentSizer)
+    #cerebro.addsizer(bt.sizers.AllInSizer)
+    cerebro.addsizer(MySizer)
+    cerebro.addanalyzer(btanalyzers.SharpeRatio, _name='mysharpe')
+    cerebro.broker.setcommission(commission=commission)
+    cerebro._disable_runonce()
+
+    addData(cerebro, dfp, dfs)
+
+    cerebro.broker.setcash(cash)
+    logger.info('Starting Portfolio Value: %.2f' % cerebro.broker.getvalue())
+    strats = cerebro.run()
+    sharpe = strats[0].analyzers.mysharpe.get_analysis()['sharperatio']
+    return cerebro, sharpe
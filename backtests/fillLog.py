@@ -0,0 +1,76 @@
+'''
+Columnar log of the orders filled and refused by the array broker of vectorEngine
+
+Each bar appends the orders it handled as whole arrays: the bar, the asset column, the signed
+size, the execution price, the traded value, the commission, the pnl realized by sells, the cash
+after the bar and the backtrader Order.Status of the order, Completed or Margin for the orders
+refused by the submit or execution cash checks.  Nothing is formatted while the backtest runs;
+toFrame() gives the log as a DataFrame afterwards:
+
+    log = FillLog()
+    result = vectorEngine.runVectorizedBacktest(dfp, dfs, log=log)
+    fills = log.toFrame(dfp.index, dfp.columns)
+    fills[fills.status == 'Margin']
+'''
+import numpy as np
+import pandas as pd
+
+# backtrader Order.Status, in the order of its codes
+STATUS = ['Created', 'Submitted', 'Accepted', 'Partial', 'Completed', 'Canceled', 'Expired', 'Margin', 'Rejected']
+COMPLETED = STATUS.index('Completed')
+MARGIN = STATUS.index('Margin')
+REJECTED = STATUS.index('Rejected')
+
+COLUMNS = [('bar', np.int32), ('asset', np.int32), ('size', np.float64), ('price', np.float64), ('value', np.float64),
+           ('commission', np.float64), ('pnl', np.float64), ('cash', np.float64), ('status', np.int8)]
+
+
+class FillLog(object):
+    def __init__(self, capacity=4096):
+        self.size = 0
+        self.arrays = dict((name, np.empty(capacity, dtype)) for name, dtype in COLUMNS)
+
+    def __len__(self):
+        return self.size
+
+    def record(self, bar, asset, size, price, commission, pnl, cash, status):
+        ## append the orders of one bar; scalars are repeated over them
+        n = len(asset)
+        if not n:
+            return
+        end = self.size + n
+        if end > len(self.arrays['bar']):
+            capacity = max(end, 2 * len(self.arrays['bar']))
+            for name, dtype in COLUMNS:
+                grown = np.empty(capacity, dtype)
+                grown[:self.size] = self.arrays[name][:self.size]
+                self.arrays[name] = grown
+        a = self.arrays
+        a['bar'][self.size:end] = bar
+        a['asset'][self.size:end] = asset
+        a['size'][self.size:end] = size
+        a['price'][self.size:end] = price
+        a['value'][self.size:end] = np.abs(size) * price
+        a['commission'][self.size:end] = commission
+        a['pnl'][self.size:end] = pnl
+        a['cash'][self.size:end] = cash
+        a['status'][self.size:end] = status
+        self.size = end
+
+    def column(self, name):
+        return self.arrays[name][:self.size]
+
+    def counts(self):
+        ## number of orders per status name
+        codes = np.bincount(self.column('status'), minlength=len(STATUS))
+        return dict((STATUS[n], int(c)) for n, c in enumerate(codes) if c)
+
+    def toFrame(self, dates=None, columns=None):
+        ## the log with the bars and assets as dates and column names when they are given
+        df = pd.DataFrame(dict((name, self.column(name)) for name, dtype in COLUMNS))
+        if dates is not None:
+            df.insert(0, 'date', np.asarray(dates)[df.bar.values])
+        if columns is not None:
+            df['asset'] = np.asarray(columns)[df.asset.values]
+        df['status'] = pd.Categorical.from_codes(df.status.values, STATUS)
+        return df
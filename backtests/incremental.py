@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+'''
+Incremental vectorized backtest
+
+The end-of-run state (positions, average cost, open trade pnl, cash, the compounded growth and
+last price per asset, the last signals and the accumulated daily tables) is saved next to the
+results.  A later run reads only the bytes appended to the return and allocation files since
+then, compounds and signals the new dates and resumes the simulation from the last bar, so a
+daily update costs the new days instead of a full replay.
+
+The last bar of the previous run is simulated again because its signal (allocations are
+shifted one row) and the sizer lookahead both depend on the day that follows it.  Anything
+that would change earlier history falls back to a full replay: different parameters, source
+files that were rewritten rather than appended to, back-dated rows, a change in the selected
+tickers or in the equal weight normalization.
+
+    python incremental.py -p ../arabesque/DailyAssetReturns.csv -s ../arabesque/IEOR4576_ALLOC.csv -d ../arabesque/state
+'''
+import io
+import os
+import json
+import hashlib
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+import backtest
+import returnsReader
+import vectorEngine
+from recorder import DailyRecorder
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'state.npz'
+META_FILE = 'state.json'
+TAIL_BYTES = 1 << 16
+
+
+class ReplayRequired(Exception):
+    pass
+
+
+def fileMark(filename, size=None):
+    ## size of the file plus a hash of its tail, to detect later appends vs rewrites
+    size = os.path.getsize(filename) if size is None else size
+    start = max(0, size - TAIL_BYTES)
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        tail = f.read(size - start)
+    return {'size': size, 'tail': hashlib.sha1(tail).hexdigest()}
+
+
+def readHeader(filename):
+    with open(filename) as f:
+        return f.readline().strip().split(',')
+
+
+def readAppended(filename, mark, header):
+    if os.path.getsize(filename) < mark['size'] or fileMark(filename, mark['size'])['tail'] != mark['tail']:
+        raise ReplayRequired('%s was rewritten' % filename)
+    with open(filename, 'rb') as f:
+        f.seek(mark['size'])
+        data = f.read()
+    if not data.strip():
+        return pd.DataFrame(columns=header)
+    return pd.read_csv(io.BytesIO(data), header=None, names=header, dtype={'date': str})
+
+
+def weightSignals(dfp, dfs, weighting, normalize):
+    if weighting == 'price':
+        return backtest.computePriceWeightedSignals(dfp, dfs)
+    if normalize:
+        return dfs.div(dfs.sum(axis=1), axis=0).fillna(0.0)
+    return dfs
+
+
+def getParams(cash, commission, percents, weighting):
+    return {'cash': cash, 'commission': commission, 'percents': percents, 'weighting': weighting,
+            'winsorization': backtest.WINSORIZATION_LEVEL, 'droplist': backtest.DROP_LIST,
+            'tickers': backtest.TICKERS, 'numTickers': backtest.NUM_TICKERS}
+
+
+def saveState(stateDir, meta, arrays):
+    os.makedirs(stateDir, exist_ok=True)
+    tmp = os.path.join(stateDir, 'tmp-' + STATE_FILE)
+    np.savez(tmp, **arrays)
+    os.replace(tmp, os.path.join(stateDir, STATE_FILE))
+    tmp = os.path.join(stateDir, 'tmp-' + META_FILE)
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=1, default=str)
+    os.replace(tmp, os.path.join(stateDir, META_FILE))
+
+
+def loadState(stateDir):
+    try:
+        with open(os.path.join(stateDir, META_FILE)) as f:
+            meta = json.load(f)
+        with np.load(os.path.join(stateDir, STATE_FILE), allow_pickle=False) as npz:
+            arrays = dict(npz)
+        return meta, arrays
+    except Exception as ex:
+        return None, None
+
+
+def buildResult(meta, arrays):
+    dates = pd.DatetimeIndex(arrays['dates'], name='date')
+    recorder = DailyRecorder(dates, meta['columns'])
+    recorder.cash, recorder.mkt, recorder.pnl = arrays['cash'], arrays['mkt'], arrays['pnl']
+    sharpe = vectorEngine.sharpeRatio(dates, arrays['value'], meta['params']['cash'])
+    return vectorEngine.VectorResult(recorder, arrays['value'], sharpe, meta['rejected'])
+
+
+def engineArrays(state):
+    return {'pos': state.pos, 'price': state.price, 'tradePnl': state.tradePnl,
+            'tradeComm': state.tradeComm, 'pending': state.pending}
+
+
+def fullRun(priceFile, signalFile, params):
+    logger.info('running full replay of %s' % priceFile)
+    values, index, assets = returnsReader.scatterReturns(priceFile, returnsReader.CHUNK_SIZE, None)
+    growth = pd.Series(returnsReader.compound(values, params['winsorization']), index=assets)
+    dfp = backtest.cleanPrices(pd.DataFrame(values, index=index, columns=assets))
+    universe = dfp.columns
+    alloc = backtest.readAllocations(signalFile)
+    dfs = backtest.alignSignals(dfp, alloc)
+    dfp, dfs = backtest.selectTickers(dfp), backtest.selectTickers(dfs)
+    columns = dfp.columns
+
+    sums = dfs.reindex(dfp.index).sum(axis=1).values
+    normalized = bool((dfs.sum(axis=1) > 1).any())
+    dfw = weightSignals(dfp, dfs, params['weighting'], normalized)
+    prices, signals = vectorEngine.prepareArrays(dfp, dfw)
+    state = vectorEngine.EngineState(columns, params['cash'])
+    recorder = DailyRecorder(dfp.index, columns)
+    value = vectorEngine.simulate(state, prices, signals, signals[-1], recorder, params['commission'], params['percents'])
+
+    shifted = alloc[columns].shift(periods=-1).ffill()
+    meta = {'params': params,
+            'columns': list(columns),
+            'assetOrder': list(assets),
+            'nanDropped': [x for x in assets if x not in universe and x not in params['droplist']],
+            'normalized': normalized,
+            'normalizedHistory': bool((sums[:-1] > 1).any()),
+            'lastAllocDate': alloc.index[-1],
+            'cashBalance': state.cash,
+            'rejected': int(state.rejected),
+            'returns': {'mark': fileMark(priceFile), 'header': readHeader(priceFile)},
+            'allocations': {'mark': fileMark(signalFile), 'header': readHeader(signalFile)}}
+    arrays = dict(engineArrays(state),
+                  dates=dfp.index.values, cash=recorder.cash, mkt=recorder.mkt, pnl=recorder.pnl, value=value,
+                  growth=growth[columns].values, lastPrice=dfp.values[-1],
+                  prevSignal=signals[-2] if len(signals) > 1 else signals[-1],
+                  seedSignal=shifted.values[-2] if len(shifted) > 1 else np.full(len(columns), np.nan))
+    return meta, arrays
+
+
+def newPrices(meta, arrays, dfr, lastDate):
+    ## compound the appended returns onto the saved growth and forward fill from the last price
+    columns = pd.Index(meta['columns'])
+    dfr = dfr.assign(assetid='x' + dfr.assetid.astype(str))
+    if (pd.to_datetime(dfr.date) <= lastDate).any():
+        raise ReplayRequired('back-dated returns')
+
+    known = set(meta['assetOrder'])
+    order = meta['assetOrder'] + [x for x in dfr.assetid.unique() if x not in known]
+    valued = set(dfr.assetid[dfr.value.notna()])
+    nanDropped = set(x for x in order if x not in valued and (x in meta['nanDropped'] or x not in known))
+    droplist = set(meta['params']['droplist'])
+    universe = [x for x in order if x not in droplist and x not in nanDropped]
+    if list(backtest.selectTickers(pd.DataFrame(columns=universe)).columns) != list(columns):
+        raise ReplayRequired('ticker selection changed')
+
+    df = dfr.pivot(index='date', columns='assetid', values='value')
+    df.index = pd.to_datetime(df.index)
+    values = df.reindex(columns=columns).values.astype(float)
+    growth = returnsReader.compound(values, meta['params']['winsorization'], arrays['growth'])
+    dfp = pd.DataFrame(np.vstack([arrays['lastPrice'], values]), columns=columns).ffill().iloc[1:]
+    dfp.index = df.index
+    meta.update(assetOrder=order, nanDropped=[x for x in order if x in nanDropped])
+    return dfp, growth
+
+
+def newSignals(meta, arrays, dfa, dates):
+    ## allocations are shifted up one row, so the last saved allocation date takes the first new row
+    columns = meta['columns']
+    lastAllocDate = pd.Timestamp(meta['lastAllocDate'])
+    dfa = dfa.set_index('date')
+    dfa.index = pd.to_datetime(dfa.index)
+    if (dfa.index <= lastAllocDate).any():
+        raise ReplayRequired('back-dated allocations')
+    raw = dfa[columns].values.astype(float)
+    rows = np.vstack([arrays['seedSignal'], raw, np.full(len(columns), np.nan)])
+    shifted = pd.DataFrame(rows, columns=columns).ffill().iloc[1:]
+    shifted.index = pd.DatetimeIndex([lastAllocDate]).append(dfa.index)
+    if len(shifted) > 1:
+        arrays['seedSignal'] = shifted.values[-2]
+        meta['lastAllocDate'] = shifted.index[-1]
+    return shifted.reindex(dates).fillna(0)
+
+
+def resume(priceFile, signalFile, params, meta, arrays):
+    if meta['params'] != json.loads(json.dumps(params, default=str)):
+        raise ReplayRequired('parameters changed')
+    dates = pd.DatetimeIndex(arrays['dates'])
+    lastDate = dates[-1]
+    if pd.Timestamp(meta['lastAllocDate']) != lastDate:
+        raise ReplayRequired('allocations and returns end on different dates')
+
+    dfr = readAppended(priceFile, meta['returns']['mark'], meta['returns']['header'])
+    dfa = readAppended(signalFile, meta['allocations']['mark'], meta['allocations']['header'])
+    if not len(dfr):
+        logger.info('no new returns since %s' % lastDate)
+        return meta, arrays
+    dfpNew, growth = newPrices(meta, arrays, dfr, lastDate)
+
+    ## segment = last bar of the previous run followed by the new dates; the previous run already
+    ## recorded the last bar, so only the rows after it are appended
+    columns = pd.Index(meta['columns'])
+    segDates = pd.DatetimeIndex([lastDate]).append(dfpNew.index)
+    dfp = pd.DataFrame(np.vstack([arrays['lastPrice'], dfpNew.values]), index=segDates, columns=columns)
+    dfs = newSignals(meta, arrays, dfa, segDates)
+
+    sums = dfs.sum(axis=1).values
+    normalized = meta['normalizedHistory'] or bool((sums > 1).any())
+    if normalized != meta['normalized']:
+        raise ReplayRequired('equal weight normalization changed')
+    dfw = weightSignals(dfp, dfs, meta['params']['weighting'], normalized)
+    prices, signals = vectorEngine.prepareArrays(dfp, dfw)
+
+    state = vectorEngine.EngineState(columns, meta['cashBalance'])
+    for key, value in engineArrays(state).items():
+        value[:] = arrays[key]
+    state.rejected = meta['rejected']
+    recorder = DailyRecorder(segDates, columns)
+    # trades closed on the last bar are stamped on the first new row
+    recorder.pnl[1] = state.pending
+    state.pending[:] = np.nan
+    value = vectorEngine.simulate(state, prices, signals, arrays['prevSignal'], recorder,
+                                  meta['params']['commission'], meta['params']['percents'])
+
+    meta.update(normalizedHistory=meta['normalizedHistory'] or bool((sums[:-1] > 1).any()),
+                cashBalance=state.cash, rejected=int(state.rejected))
+    meta['returns']['mark'] = fileMark(priceFile)
+    meta['allocations']['mark'] = fileMark(signalFile)
+    arrays.update(engineArrays(state),
+                  dates=np.concatenate([arrays['dates'], segDates.values[1:]]),
+                  cash=np.concatenate([arrays['cash'], recorder.cash[1:]]),
+                  mkt=np.vstack([arrays['mkt'], recorder.mkt[1:]]),
+                  pnl=np.vstack([arrays['pnl'], recorder.pnl[1:]]),
+                  value=np.concatenate([arrays['value'], value[1:]]),
+                  growth=growth, lastPrice=dfp.values[-1], prevSignal=signals[-2])
+    logger.info('appended %s dates after %s' % (len(dfpNew), lastDate))
+    return meta, arrays
+
+
+def runIncremental(priceFile, signalFile, stateDir, cash=None, commission=None, percents=None, weighting='equal', full=False):
+    '''
+    bring the saved backtest in stateDir up to date with the source files and return its result
+    '''
+    params = getParams(backtest.START_BALANCE if cash is None else cash,
+                       backtest.COMMISSION if commission is None else commission,
+                       vectorEngine.SIZER_PERCENTS if percents is None else percents, weighting)
+    meta, arrays = (None, None) if full else loadState(stateDir)
+    try:
+        if meta is None:
+            raise ReplayRequired('no saved state in %s' % stateDir)
+        meta, arrays = resume(priceFile, signalFile, params, meta, arrays)
+    except ReplayRequired as ex:
+        logger.info('full replay required: %s' % ex)
+        meta, arrays = fullRun(priceFile, signalFile, params)
+    saveState(stateDir, meta, arrays)
+    return buildResult(meta, arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='IncrementalBacktest')
+    parser.add_argument('-p', '--prices', help='daily asset returns file', default='../arabesque/DailyAssetReturns.csv')
+    parser.add_argument('-s', '--signals', help='allocation file', default='../arabesque/IEOR4576_ALLOC.csv')
+    parser.add_argument('-d', '--statedir', help='directory holding the saved backtest state', default='../arabesque/state')
+    parser.add_argument('-g', '--weighting', help='signal weighting: equal, price', default='equal')
+    parser.add_argument('-f', '--full', action='store_true', help='ignore the saved state and replay the full history')
+
+    args = parser.parse_args()
+    result = runIncremental(args.prices, args.signals, args.statedir, weighting=args.weighting, full=args.full)
+    result.dailyPnl().to_csv(os.path.join(args.statedir, 'backtest-daily-pnl.csv'))
+    result.tradePnl().to_csv(os.path.join(args.statedir, 'backtest-trade-pnl.csv'))
+    logger.info('Sharpe Ratio: %s' % result.sharpe)
+    logger.info('Final Portfolio Value: %.2f' % result.getvalue())
+    return result.getvalue()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    main()
@@ -0,0 +1,148 @@
+'''
+Structured event journal and log files written by background threads
+
+Events are a name and keyword fields:
+
+    journal.event('fill', ticker='x205', size=100, price=101.5)
+
+On the calling thread that is a check when the journal is off, and a tuple put on a queue when
+it is on; no LogRecord is made and nothing is formatted there.  A writer thread takes the events
+off the queue in batches and appends them as JSON lines to the journal file.  readJournal()
+loads a journal back into a DataFrame, one column per field:
+
+    journal.startLogging('/tmp/marketdata/backtest.log', journalfile='/tmp/marketdata/backtest.jsonl')
+    df = journal.readJournal('/tmp/marketdata/backtest.jsonl', 'fill')
+
+startLogging() also moves the log file and stderr handlers of the root logger behind a
+QueueHandler, so log lines are written by a QueueListener thread.  The bloomberg and analytics
+packages import this module from here, adding the backtests directory to sys.path.
+'''
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+import pandas as pd
+
+FORMAT = '%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s'
+BATCH_EVENTS = 1000
+
+_listener = None
+_writer = None
+
+
+def enabled():
+    return _writer is not None
+
+
+def event(name, **fields):
+    writer = _writer
+    if writer is not None:
+        writer.queue.put((time.time(), name, threading.current_thread().name, fields))
+
+
+def jsonValue(value):
+    ## numpy scalars as python numbers, anything else as its string
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+class JournalWriter(object):
+    '''
+    appends the queued events to path as JSON lines, up to batchEvents of them per write, on a
+    thread of its own; close() writes what is still queued
+    '''
+    def __init__(self, path, batchEvents=BATCH_EVENTS):
+        self.path = path
+        self.batchEvents = batchEvents
+        self.queue = queue.SimpleQueue()
+        self.stream = open(path, 'a')
+        self.count = 0
+        self.thread = threading.Thread(target=self.run, name='journal', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batchEvents:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch[-1] is None:
+                batch.pop()
+                stopped = True
+            rows = []
+            for created, name, thread, fields in batch:
+                row = {'time': created, 'event': name, 'thread': thread}
+                row.update(fields)
+                rows.append(row)
+            try:
+                if rows:
+                    self.stream.write('\n'.join(json.dumps(row, default=jsonValue) for row in rows) + '\n')
+                    self.stream.flush()
+                    self.count += len(rows)
+            except Exception as ex:
+                logging.getLogger(__name__).error('journal write to %s failed: %r' % (self.path, ex))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.stream.close()
+
+
+def startLogging(logfile=None, stream=False, journalfile=None, level=logging.INFO):
+    '''
+    log the root logger to logfile and, with stream, to stderr from a listener thread, and
+    journal the events to journalfile if given; both are stopped and flushed at exit or by
+    stopLogging()
+    '''
+    global _listener, _writer
+    stopLogging()
+    handlers = []
+    if logfile:
+        handlers.append(logging.FileHandler(logfile))
+    if stream:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    if handlers:
+        handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        _listener = logging.handlers.QueueListener(handler.queue, *handlers)
+        _listener.start()
+        root.addHandler(handler)
+    if journalfile:
+        _writer = JournalWriter(journalfile)
+
+
+@atexit.register
+def stopLogging():
+    ## drain the queues and close the files
+    global _listener, _writer
+    if _writer is not None:
+        writer, _writer = _writer, None
+        writer.close()
+    if _listener is not None:
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler) and handler.queue is _listener.queue:
+                root.removeHandler(handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def readJournal(path, name=None):
+    ## the events of a journal file, or those called name, one column per field
+    df = pd.read_json(path, lines=True, convert_dates=False)
+    if df.empty:
+        return df
+    if name is not None:
+        df = df[df.event == name].dropna(axis=1, how='all').reset_index(drop=True)
+    df['time'] = pd.to_datetime(df['time'], unit='s')
+    return df
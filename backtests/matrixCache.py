@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+On-disk cache for the pivoted price and signal matrices used by backtest.py
+
+Each cached frame is stored as three .npy files (values, index, columns) so a warm start
+skips CSV parsing entirely and the values can be memory mapped read-only by any number of
+processes without a private copy.  The cache key is built from the content hash of the
+source files plus the parameters that change the matrices (winsorization level, drop list).
+'''
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+SOURCES_FILE = 'sources.json'
+HASH_BLOCK_SIZE = 1 << 22
+
+
+def fileHash(filename):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def sourceHash(cacheDir, filename):
+    ## only rehash a source file when its size or mtime changed since the last run
+    path = os.path.realpath(filename)
+    stat = os.stat(path)
+    manifest = os.path.join(cacheDir, SOURCES_FILE)
+    try:
+        with open(manifest) as f:
+            sources = json.load(f)
+    except Exception as ex:
+        sources = {}
+    entry = sources.get(path)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry['sha1']
+    sha1 = fileHash(path)
+    sources[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1}
+    tmp = manifest + '.%s' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(sources, f, indent=1)
+    os.replace(tmp, manifest)
+    return sha1
+
+
+def cacheKey(cacheDir, filenames, params):
+    key = {'version': CACHE_VERSION,
+           'sources': [sourceHash(cacheDir, filename) for filename in filenames],
+           'params': params}
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def saveFrame(path, name, df):
+    np.save(os.path.join(path, name + '.npy'), np.ascontiguousarray(df.values, dtype=float))
+    np.save(os.path.join(path, name + '.index.npy'), df.index.values)
+    np.save(os.path.join(path, name + '.columns.npy'), np.array(df.columns, dtype=str))
+
+
+def loadFrame(path, name, mmap=True):
+    values = np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+    index = pd.DatetimeIndex(np.load(os.path.join(path, name + '.index.npy')), name='date')
+    columns = pd.Index(np.load(os.path.join(path, name + '.columns.npy')), name='assetid')
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+def keyPath(cacheDir, filenames, params):
+    return os.path.join(cacheDir, cacheKey(cacheDir, filenames, params))
+
+
+def loadMatrices(cacheDir, filenames, params, build, mmap=True):
+    '''
+    return the (dfp, dfs) frames for the source files, calling build() and storing its
+    result on a cache miss; cached values are read-only memory maps when mmap is set
+    '''
+    os.makedirs(cacheDir, exist_ok=True)
+    path = keyPath(cacheDir, filenames, params)
+    if os.path.exists(path):
+        logger.info('loading cached matrices %s' % path)
+        return loadFrame(path, 'prices', mmap), loadFrame(path, 'signals', mmap)
+
+    dfp, dfs = build()
+    ## write to a temporary directory first so concurrent readers never see a partial entry
+    tmp = tempfile.mkdtemp(dir=cacheDir)
+    try:
+        saveFrame(tmp, 'prices', dfp)
+        saveFrame(tmp, 'signals', dfs)
+        os.rename(tmp, path)
+        logger.info('cached matrices %s' % path)
+    except Exception as ex:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(path):
+            logger.error('unable to cache matrices %s\n%r' % (path, ex))
+            return dfp, dfs
+    return loadFrame(path, 'prices', mmap), loadFrame(path, 'signals', mmap)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+Vectorized performance statistics for a backtest
+
+Works on the price matrix and the strategy equity curve with whole-array numpy operations, no
+per-row callbacks and no plotting imports, so it can run headless in batch jobs over the full
+universe.  Rolling windows are computed from cumulative sums in a single pass.
+'''
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+ROLLING_WINDOW = 63
+RISK_FREE_RATE = 0.01
+
+
+def assetReturns(prices):
+    ## same as DataFrame.pct_change on the forward filled price matrix, first row nan
+    prices = np.asarray(prices, dtype=float)
+    returns = np.full(prices.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = prices[1:] / prices[:-1] - 1
+    return returns
+
+
+def benchmarkReturns(prices):
+    ## equal weight average of the assets that have a return on each date
+    returns = assetReturns(prices)
+    count = (~np.isnan(returns)).sum(axis=1)
+    total = np.nansum(returns, axis=1)
+    return np.where(count, total / np.where(count, count, 1), 0.0)
+
+
+def benchmarkEquity(dfp, balance):
+    returns = benchmarkReturns(dfp.values)
+    return pd.Series(balance + (np.cumprod(returns + 1) - 1) * balance, index=dfp.index, name='benchmark')
+
+
+def rollingSum(x, window):
+    c = np.cumsum(np.insert(x, 0, 0.0))
+    out = np.full(len(x), np.nan)
+    out[window - 1:] = c[window:] - c[:-window]
+    return out
+
+
+def rollingStats(returns, benchmark, window=ROLLING_WINDOW):
+    ## rolling annualized volatility and beta to the benchmark from running sums
+    r = np.nan_to_num(returns)
+    b = np.nan_to_num(benchmark)
+    n = float(window)
+    sr, sb = rollingSum(r, window), rollingSum(b, window)
+    srr, sbb, srb = rollingSum(r * r, window), rollingSum(b * b, window), rollingSum(r * b, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = np.maximum(srr / n - (sr / n) ** 2, 0.0) * n / (n - 1)
+        varb = np.maximum(sbb / n - (sb / n) ** 2, 0.0)
+        cov = srb / n - (sr / n) * (sb / n)
+        beta = np.where(varb > 0, cov / varb, np.nan)
+    return np.sqrt(var * TRADING_DAYS), beta
+
+
+def turnover(mkt, prices, equity):
+    ## traded value per day as a fraction of equity, from the daily market value of each holding
+    prices = np.asarray(prices, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = np.nan_to_num(np.asarray(mkt, dtype=float) / prices)
+    traded = np.abs(np.diff(shares, axis=0, prepend=0.0)) * np.nan_to_num(prices)
+    return traded.sum(axis=1) / equity
+
+
+def computeStatistics(dfp, equity, balance, mkt=None, window=ROLLING_WINDOW, rate=RISK_FREE_RATE, bench=None):
+    '''
+    return (stats, series): stats is a Series of sharpe, sortino, max drawdown, annual turnover,
+    volatility and beta; series is a DataFrame of the strategy and benchmark equity, drawdown,
+    rolling volatility and rolling beta indexed by date.  mkt is the (dates x assets) market value
+    table aligned with dfp and is only needed for turnover; bench, the benchmarkReturns of dfp, can
+    be passed in when the statistics of several curves over the same prices are computed.
+    '''
+    equity = np.asarray(equity, dtype=float)
+    bench = benchmarkReturns(dfp.values) if bench is None else bench
+    returns = np.diff(equity, prepend=balance) / np.insert(equity[:-1], 0, balance)
+    excess = returns - ((1.0 + rate) ** (1.0 / TRADING_DAYS) - 1.0)
+
+    std = excess.std(ddof=1)
+    downside = np.sqrt(np.mean(np.minimum(excess, 0.0) ** 2))
+    peak = np.maximum.accumulate(np.maximum(equity, balance))
+    drawdown = equity / peak - 1.0
+    vol, beta = rollingStats(returns, bench, window)
+    cov = np.cov(returns, bench)
+
+    stats = pd.Series({
+        'sharpe': excess.mean() / std * np.sqrt(TRADING_DAYS) if std else np.nan,
+        'sortino': excess.mean() / downside * np.sqrt(TRADING_DAYS) if downside else np.nan,
+        'maxDrawdown': drawdown.min(),
+        'turnover': turnover(mkt, dfp.values, equity).mean() * TRADING_DAYS if mkt is not None else np.nan,
+        'volatility': returns.std(ddof=1) * np.sqrt(TRADING_DAYS),
+        'beta': cov[0, 1] / cov[1, 1] if cov[1, 1] else np.nan,
+        'return': equity[-1] / balance - 1.0})
+    series = pd.DataFrame({'strat': equity,
+                           'benchmark': balance + (np.cumprod(bench + 1) - 1) * balance,
+                           'drawdown': drawdown,
+                           'rollingVol': vol,
+                           'rollingBeta': beta}, index=dfp.index)
+    return stats, series
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+'''
+Per-run recorder for the daily state of a backtest
+
+Cash, per-asset market value and closed-trade pnl are written into (bars x assets) arrays
+allocated once at the start of the run, so recording is O(bars x assets) and every backtest
+owns its own state.
+'''
+import numpy as np
+import pandas as pd
+
+
+class DailyRecorder(object):
+    def __init__(self, dates, columns):
+        self.dates = dates
+        self.columns = pd.Index(columns)
+        self.cash = np.full(len(dates), np.nan)
+        self.mkt = np.full((len(dates), len(columns)), np.nan)
+        self.pnl = np.full((len(dates), len(columns)), np.nan)
+
+    def recordCash(self, idx, value):
+        self.cash[idx] = value
+
+    def recordMarket(self, idx, col, value):
+        self.mkt[idx, col] = value
+
+    def recordTrade(self, idx, col, value):
+        # backtrader stamps closed trades with len(data), which can run one past the last bar
+        if idx < len(self.dates):
+            self.pnl[idx, col] = value
+
+    def genPnlTable(self, values, withCash):
+        ## cash first, then the tickers with any value in price column order
+        traded = ~np.isnan(values).all(axis=0)
+        df = pd.DataFrame(values[:, traded], index=self.dates, columns=self.columns[traded])
+        df.insert(0, 'cash', self.cash if withCash else np.nan)
+        df.index.name = 'date'
+        return df
+
+    def dailyPnl(self):
+        return self.genPnlTable(self.mkt, True)
+
+    def tradePnl(self):
+        return self.genPnlTable(self.pnl, False)
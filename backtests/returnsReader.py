@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+'''
+Streaming reader for the long-format (date, assetid, value) daily return file
+
+streamReturnsToPrice produces the same wide price matrix as backtest.convertReturnsToPrice
+without ever holding the whole file or a pivot in memory.  A first pass collects the date
+and asset axes, a second pass scatters each chunk of returns into a preallocated (or memory
+mapped) matrix and the prices are then compounded in place one block of dates at a time, so
+peak memory is one chunk plus the output matrix.
+'''
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000000
+BLOCK_ROWS = 256
+
+
+def readChunks(filename, chunksize, usecols=None):
+    return pd.read_csv(filename, chunksize=chunksize, usecols=usecols, dtype={'date': str})
+
+
+def readAxes(filename, chunksize):
+    ## dates sorted as the pivot sorts them, assets in order of first appearance
+    dates = set()
+    assets = {}
+    for chunk in readChunks(filename, chunksize, ['date', 'assetid']):
+        dates.update(chunk.date.unique())
+        for asset in ('x' + chunk.assetid.astype(str)).unique():
+            assets.setdefault(asset, len(assets))
+    return np.array(sorted(dates), dtype=object), pd.Index(list(assets), name='assetid')
+
+
+def compound(values, winsorization, acc=None, blockRows=BLOCK_ROWS):
+    '''
+    100 + ((r + 1).cumprod() - 1) * 100 computed in place, carrying the running product; returns
+    the running product after the last row so later rows can be compounded onto it
+    '''
+    acc = np.ones(values.shape[1]) if acc is None else acc.copy()
+    for start in range(0, len(values), blockRows):
+        block = values[start:start + blockRows]
+        if winsorization:
+            np.minimum(block, winsorization, out=block)
+        missing = np.isnan(block)
+        growth = np.nancumprod(np.vstack([acc, block + 1]), axis=0)[1:]
+        acc = growth[-1].copy()
+        growth[missing] = np.nan
+        block[:] = 100 + (growth - 1) * 100
+    return acc
+
+
+def streamReturnsToPrice(filename, winsorization=None, chunksize=CHUNK_SIZE, outfile=None):
+    values, index, assets = scatterReturns(filename, chunksize, outfile)
+    compound(values, winsorization)
+    return pd.DataFrame(values, index=index, columns=assets, copy=False)
+
+
+def streamReturns(filename, chunksize=CHUNK_SIZE, outfile=None):
+    ## wide (date x asset) frame of the raw returns, nan where an asset has no return
+    values, index, assets = scatterReturns(filename, chunksize, outfile)
+    return pd.DataFrame(values, index=index, columns=assets, copy=False)
+
+
+def scatterReturns(filename, chunksize, outfile):
+    dates, assets = readAxes(filename, chunksize)
+    dateIndex = pd.Index(dates)
+    shape = (len(dates), len(assets))
+    if outfile:
+        values = np.lib.format.open_memmap(outfile, mode='w+', dtype=float, shape=shape)
+        values[:] = np.nan
+    else:
+        values = np.full(shape, np.nan)
+    logger.info('streaming %s into a %s x %s matrix' % (filename, shape[0], shape[1]))
+
+    for chunk in readChunks(filename, chunksize):
+        rows = dateIndex.get_indexer(chunk.date.values)
+        cols = assets.get_indexer('x' + chunk.assetid.astype(str))
+        values[rows, cols] = chunk.value.values
+
+    index = pd.DatetimeIndex(pd.to_datetime(dates), name='date')
+    return values, index, assets
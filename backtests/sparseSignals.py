@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''
+Sparse (CSR by date) storage of the signal matrix
+
+On any date only a small fraction of the universe has a nonzero allocation, so the signals are
+kept as the nonzero entries of each row plus, per row, the assets that are active on that bar:
+a positive signal (an entry or a rebalance candidate) or a signal that differs from the previous
+bar (a reduction or an exit).  MySignal.next only visits the active assets and the assets it
+holds, so the cost of a bar scales with the names in play rather than the universe.
+'''
+import numpy as np
+import pandas as pd
+
+
+def toCsr(mask, values=None):
+    ## row pointers, column indices (ascending within a row) and optionally the values
+    rows, cols = np.nonzero(mask)
+    indptr = np.zeros(mask.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=mask.shape[0]), out=indptr[1:])
+    return indptr, cols, None if values is None else values[rows, cols]
+
+
+class SparseSignals(object):
+    def __init__(self, values, dates=None, columns=None):
+        values = np.asarray(values, dtype=float)
+        self.shape = values.shape
+        self.dates = dates
+        self.columns = None if columns is None else pd.Index(columns)
+        self.indptr, self.indices, self.data = toCsr(values != 0, values)
+
+        # the strategy reads the previous signal at idx - 1, which wraps to the last bar on the first
+        prev = np.roll(values, 1, axis=0)
+        self.activeptr, self.activeidx, _ = toCsr((values > 0) | (values != prev))
+
+    @classmethod
+    def fromFrame(cls, dfs, index, columns):
+        ## same values the feeds see in addData: signals joined to the price dates, missing become -1
+        values = dfs.reindex(index=index, columns=columns).values.astype(float)
+        return cls(np.where(np.isnan(values), -1.0, values), index, columns)
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def row(self, t):
+        t %= self.shape[0]
+        lo, hi = self.indptr[t], self.indptr[t + 1]
+        return self.indices[lo:hi], self.data[lo:hi]
+
+    def active(self, t):
+        t %= self.shape[0]
+        return self.activeidx[self.activeptr[t]:self.activeptr[t + 1]]
+
+    def lookup(self, t, cols):
+        ## signal values of the (sorted) columns cols on bar t, zero where there is no entry
+        cols = np.asarray(cols, dtype=np.int64)
+        idx, data = self.row(t)
+        out = np.zeros(len(cols))
+        if len(idx) and len(cols):
+            pos = np.minimum(np.searchsorted(idx, cols), len(idx) - 1)
+            found = idx[pos] == cols
+            out[found] = data[pos[found]]
+        return out
+
+    def toDense(self):
+        values = np.zeros(self.shape)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        values[rows, self.indices] = self.data
+        return pd.DataFrame(values, index=self.dates, columns=self.columns)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+'''
+Parallel parameter sweep for the vectorized backtest
+
+The grid is expanded into every combination of winsorization level, sizer percents,
+commission, starting balance, signal weighting and ticker subset.  The price and signal
+matrices are built once per winsorization level into the matrixCache and every worker
+process memory maps them read-only, so the csv files are never parsed by the workers.
+
+    python sweep.py -w 1000,5 -z 95,50 -c 0.001,0.002 -g equal,price -t all,500 -n 8 -o ../arabesque/sweep
+'''
+import os
+import sys
+import time
+import logging
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+import backtest
+import matrixCache
+import vectorEngine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRID = {'winsorization': [backtest.WINSORIZATION_LEVEL],
+                'percents': [vectorEngine.SIZER_PERCENTS],
+                'commission': [backtest.COMMISSION],
+                'balance': [backtest.START_BALANCE],
+                'weighting': ['equal'],
+                'tickers': [None]}
+
+# matrices already mapped by this worker process keyed by cache path
+_FRAMES = {}
+
+
+def expandGrid(grid):
+    grid = dict(DEFAULT_GRID, **grid)
+    keys = list(DEFAULT_GRID.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[key] for key in keys])]
+
+
+def buildCache(priceFile, signalFile, cacheDir, winsorization):
+    ## parse the csv files at most once per winsorization level in the parent process; none is off
+    level = backtest.winsorizationLevel(winsorization)
+    def build():
+        dfp = backtest.readPrices(priceFile, level)
+        return dfp, backtest.readSignals(dfp, signalFile)
+    params = backtest.matrixParams(level)
+    matrixCache.loadMatrices(cacheDir, [priceFile, signalFile], params, build)
+    return matrixCache.keyPath(cacheDir, [priceFile, signalFile], params)
+
+
+def loadFrames(path):
+    if path not in _FRAMES:
+        _FRAMES[path] = (matrixCache.loadFrame(path, 'prices'), matrixCache.loadFrame(path, 'signals'))
+    return _FRAMES[path]
+
+
+def selectTickers(df, tickers):
+    if tickers is None:
+        return df
+    if isinstance(tickers, int):
+        return df[df.columns[0:tickers]]
+    return df[list(tickers)]
+
+
+def runCombination(task):
+    run, path, combo = task
+    start = time.time()
+    dfp, dfs = loadFrames(path)
+    dfp = selectTickers(dfp, combo['tickers'])
+    dfs = selectTickers(dfs, combo['tickers'])
+    if combo['weighting'] == 'price':
+        dfs = backtest.computePriceWeightedSignals(dfp, dfs)
+    else:
+        dfs = backtest.computeEqualWeightedSignals(dfs)
+    result = vectorEngine.runVectorizedBacktest(dfp, dfs, combo['balance'], combo['commission'], combo['percents'])
+    pnl = np.diff(result.value, prepend=combo['balance'])
+    stats = dict(combo, run=run, sharpe=result.sharpe, value=result.getvalue(), rejected=result.rejected,
+                 assets=len(dfp.columns), seconds=time.time() - start, pid=os.getpid())
+    return stats, pnl
+
+
+def runSweep(priceFile, signalFile, grid, processes=None, cacheDir=None):
+    '''
+    run every combination of the grid and return (summary, dailyPnl); summary has one row per
+    run with its parameters, sharpe and final value, dailyPnl has one column per run
+    '''
+    cacheDir = cacheDir or backtest.CACHE_DIR or os.path.join(os.path.dirname(priceFile), 'cache')
+    combos = expandGrid(grid)
+    paths = {}
+    for level in sorted(set(combo['winsorization'] for combo in combos), key=str):
+        paths[level] = buildCache(priceFile, signalFile, cacheDir, level)
+    tasks = [(run, paths[combo['winsorization']], combo) for run, combo in enumerate(combos)]
+    dates = loadFrames(tasks[0][1])[0].index
+
+    start = time.time()
+    processes = processes or multiprocessing.cpu_count()
+    rows, daily = [], {}
+    with multiprocessing.Pool(min(processes, len(tasks))) as pool:
+        for stats, pnl in pool.imap_unordered(runCombination, tasks):
+            rows.append(stats)
+            daily[stats['run']] = pnl
+            logger.info('run %(run)s sharpe: %(sharpe)s value: %(value).2f seconds: %(seconds).2f' % stats)
+    logger.info('completed %s runs on %s processes in %.2f seconds' % (len(tasks), processes, time.time() - start))
+
+    summary = pd.DataFrame(rows).set_index('run').sort_index()
+    dfd = pd.DataFrame(daily, index=dates).reindex(columns=summary.index)
+    dfd.index.name = 'date'
+    return summary, dfd
+
+
+def parseList(value, cast):
+    return [None if x in ('all', 'none', '') else cast(x) for x in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BacktestSweep')
+    parser.add_argument('-p', '--prices', help='daily asset returns file', default='../arabesque/DailyAssetReturns.csv')
+    parser.add_argument('-s', '--signals', help='allocation file', default='../arabesque/IEOR4576_ALLOC.csv')
+    parser.add_argument('-w', '--winsorization', help='comma separated winsorization levels', default=str(backtest.WINSORIZATION_LEVEL))
+    parser.add_argument('-z', '--percents', help='comma separated sizer percents', default=str(vectorEngine.SIZER_PERCENTS))
+    parser.add_argument('-c', '--commission', help='comma separated commissions', default=str(backtest.COMMISSION))
+    parser.add_argument('-b', '--balance', help='comma separated starting balances', default=str(backtest.START_BALANCE))
+    parser.add_argument('-g', '--weighting', help='comma separated signal weighting: equal, price', default='equal')
+    parser.add_argument('-t', '--tickers', help='comma separated ticker counts, all for the full universe', default='all')
+    parser.add_argument('-n', '--processes', help='number of worker processes', type=int, default=None)
+    parser.add_argument('-o', '--outdir', help='output directory to write results', default='../arabesque/sweep')
+
+    args = parser.parse_args()
+    grid = {'winsorization': parseList(args.winsorization, backtest.winsorizationLevel),
+            'percents': parseList(args.percents, float),
+            'commission': parseList(args.commission, float),
+            'balance': parseList(args.balance, float),
+            'weighting': args.weighting.split(','),
+            'tickers': parseList(args.tickers, int)}
+
+    summary, dfd = runSweep(args.prices, args.signals, grid, args.processes)
+    os.makedirs(args.outdir, exist_ok=True)
+    summary.to_csv(os.path.join(args.outdir, 'sweep-summary.csv'))
+    dfd.to_csv(os.path.join(args.outdir, 'sweep-daily-pnl.csv'))
+    return summary
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('sweep summary\n%s' % main().to_string())
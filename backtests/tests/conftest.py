@@ -0,0 +1,44 @@
+import os
+import sys
+import pytest
+
+## the backtests modules import each other by name, as when run from their directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+@pytest.fixture(scope='session', params=['equal', 'allocations'])
+def matrices(request):
+    '''
+    prices and signals of 10 made up assets over 200 days, every date present in both files.  The
+    allocations as read add up to more than one on some days, so buys overrun the cash and are
+    refused with Margin; equally weighted they never do
+    '''
+    import backtest
+    dfp = backtest.convertReturnsToPrice(os.path.join(DATA, 'returns.csv'))
+    dfs = backtest.readSignals(dfp, os.path.join(DATA, 'allocations.csv'))
+    if request.param == 'equal':
+        dfs = backtest.computeEqualWeightedSignals(dfs)
+    return dfp, dfs
+
+
+@pytest.fixture(scope='session')
+def cerebro(matrices, tmp_path_factory):
+    '''
+    the backtrader run the other engines are checked against: recorder, final value, sharpe and
+    its orders, read from the fill and reject events it journals, with the bar each was made on
+    '''
+    import backtest
+    import journal
+    path = str(tmp_path_factory.mktemp('journal') / 'cerebro.jsonl')
+    journal.startLogging(journalfile=path)
+    try:
+        recorder, value, sharpe, cerebro = backtest.runCerebro(*matrices)
+    finally:
+        journal.stopLogging()
+    orders = journal.readJournal(path)
+    ## a fill is notified on the bar after the order, a refusal on the bar itself
+    orders['bar'] = orders.row - (orders.event == 'fill')
+    orders['status'] = orders.status.where(orders.event == 'reject', 'Completed') if 'status' in orders else 'Completed'
+    return recorder, value, sharpe, orders
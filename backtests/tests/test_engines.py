@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+from fillLog import FillLog
+
+RTOL = 1e-9
+
+
+def assertSameRun(expected, recorder, value):
+    ## final value, daily cash and market values and closed trade pnl of two runs agree
+    cerebroRecorder, cerebroValue, sharpe, orders = expected
+    assert value == pytest.approx(cerebroValue, rel=RTOL)
+    pd.testing.assert_frame_equal(recorder.dailyPnl(), cerebroRecorder.dailyPnl(), check_exact=False, rtol=RTOL)
+    pd.testing.assert_frame_equal(recorder.tradePnl(), cerebroRecorder.tradePnl(), check_exact=False, rtol=RTOL)
+
+
+def test_fixture_trades(matrices, cerebro):
+    recorder = cerebro[0]
+    assert np.isfinite(recorder.tradePnl().drop(columns='cash').values).sum() > 40
+    assert recorder.dailyPnl().shape == (len(matrices[0]), len(matrices[0].columns) + 1)
+
+
+def test_vector_matches_cerebro(matrices, cerebro):
+    recorder, value, sharpe, _ = backtest.runVector(*matrices)
+    assertSameRun(cerebro, recorder, value)
+
+
+def test_broker_matches_cerebro(matrices, cerebro):
+    recorder, value, sharpe, _ = backtest.runVector(*matrices, log=FillLog())
+    assertSameRun(cerebro, recorder, value)
+
+
+def test_broker_orders_match_cerebro(matrices, cerebro):
+    ## every order the array broker fills or refuses is one backtrader notified, with the same status
+    dfp, dfs = matrices
+    orders = cerebro[3].sort_values(['bar', 'ticker', 'status']).reset_index(drop=True)
+    log = FillLog()
+    backtest.runVector(dfp, dfs, log=log)
+    fills = log.toFrame(dfp.index, dfp.columns)
+    fills['status'] = fills.status.astype(str)
+    fills = fills.sort_values(['bar', 'asset', 'status']).reset_index(drop=True)
+    assert log.counts() == orders.status.value_counts().to_dict()
+    np.testing.assert_array_equal(fills.bar.values, orders.bar.values)
+    assert list(fills.asset) == list(orders.ticker)
+    np.testing.assert_array_equal(fills['size'].values, orders['size'].values)
+    assert list(fills.status) == list(orders.status)
+    done = (fills.status == 'Completed').values
+    for column in ('price', 'commission', 'cash'):
+        np.testing.assert_allclose(fills[column].values[done], orders[column].values[done], rtol=RTOL)
+
+
+def test_batch_matches_cerebro(matrices, cerebro):
+    ## each portfolio of a stack follows its single run, the equity is the cash plus the market values
+    import batchEngine
+    dfp, dfs = matrices
+    recorder, value, sharpe, orders = cerebro
+    half, halfValue, halfSharpe, _ = backtest.runVector(dfp, dfs * 0.5)
+    result = batchEngine.runBatch(dfp, [dfs, dfs * 0.5], backtest.START_BALANCE, backtest.COMMISSION, names=['full', 'half'])
+    for name, run, final in [('full', recorder, value), ('half', half, halfValue)]:
+        equity = run.dailyPnl().fillna(0.0).sum(axis=1)
+        np.testing.assert_allclose(result.equity[name].values, equity.values, rtol=RTOL)
+        assert result.getvalue()[name] == pytest.approx(final, rel=RTOL)
+        assert result.stats.loc[name, 'finalValue'] == pytest.approx(final, rel=RTOL)
+    assert halfValue != pytest.approx(value, rel=RTOL)
+
+
+def test_vector_runs_on_the_mapped_prices(matrices, tmp_path):
+    ## the cached prices reach the engine as the read-only memory map, missing values still NaN,
+    ## and trade as the matrices filled with -1 up front did
+    import matrixCache
+    import vectorEngine
+    dfp, dfs = matrices
+    dfp, dfs = dfp.copy(), dfs.copy()
+    dfp.iloc[:20, 3] = np.nan
+    dfs.iloc[30:40, 5] = np.nan
+    dfp, dfs = matrixCache.loadMatrices(str(tmp_path), [], {}, lambda: (dfp, dfs))
+    prices, signals = vectorEngine.prepareArrays(dfp, dfs)
+    assert np.shares_memory(prices, dfp.values) and not prices.flags.writeable
+    assert np.isnan(prices).sum() == 20
+    filled = [np.where(np.isnan(x), -1.0, x) for x in (prices, signals)]
+    expected = vectorEngine.runArrays(dfp.index, dfp.columns, *filled)
+    result = vectorEngine.runArrays(dfp.index, dfp.columns, prices, signals)
+    np.testing.assert_array_equal(result.value, expected.value)
+    pd.testing.assert_frame_equal(result.dailyPnl(), expected.dailyPnl())
+    pd.testing.assert_frame_equal(result.tradePnl(), expected.tradePnl())
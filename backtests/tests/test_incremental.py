@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pandas as pd
+
+import backtest
+import incremental
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def readDays(filename):
+    ## header and the lines of each date, in file order
+    with open(filename) as f:
+        header = f.readline()
+        days = {}
+        for line in f:
+            days.setdefault(line.split(',', 1)[0], []).append(line)
+    return header, list(days.values())
+
+
+def writeDays(filename, header, days, mode):
+    with open(filename, mode) as f:
+        if mode == 'w':
+            f.write(header)
+        for lines in days:
+            f.writelines(lines)
+
+
+def test_appended_days_resume_to_the_full_run(tmp_path, monkeypatch, caplog):
+    ## the saved run brought forward a day, a month and the rest of the file is the full replay
+    monkeypatch.setattr(backtest, 'NUM_TICKERS', None)
+    caplog.set_level('INFO', logger='incremental')
+    sources = [os.path.join(DATA, 'returns.csv'), os.path.join(DATA, 'allocations.csv')]
+    files = [str(tmp_path / os.path.basename(source)) for source in sources]
+    stateDir = str(tmp_path / 'state')
+    read = [readDays(source) for source in sources]
+    resumed = []
+    last = 0
+    for days in (100, 101, 130, 131, 200):
+        for filename, (header, lines) in zip(files, read):
+            writeDays(filename, header, lines[last:days], 'a' if last else 'w')
+        last = days
+        result = incremental.runIncremental(files[0], files[1], stateDir)
+        resumed.append(result)
+        assert len(result.value) == days
+    replays = [record.message for record in caplog.records if record.message.startswith('full replay required')]
+    assert replays == ['full replay required: no saved state in %s' % stateDir]
+
+    full = incremental.runIncremental(sources[0], sources[1], str(tmp_path / 'full'), full=True)
+    result = resumed[-1]
+    np.testing.assert_allclose(result.value, full.value, rtol=1e-12)
+    pd.testing.assert_frame_equal(result.dailyPnl(), full.dailyPnl(), check_exact=False, rtol=1e-12)
+    pd.testing.assert_frame_equal(result.tradePnl(), full.tradePnl(), check_exact=False, rtol=1e-12)
+    assert result.rejected == full.rejected
+    assert result.recorder.pnl.shape == (200, 10)
+    assert np.isfinite(result.tradePnl().drop(columns='cash').values).sum() > 40
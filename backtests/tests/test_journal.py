@@ -0,0 +1,34 @@
+import numpy as np
+
+import backtest
+import journal
+
+
+def test_events_round_trip(tmp_path):
+    path = str(tmp_path / 'events.jsonl')
+    journal.startLogging(journalfile=path)
+    try:
+        assert journal.enabled()
+        for n in range(2500):
+            journal.event('fill', row=n, ticker='x%d' % n, price=np.float64(n) / 2)
+        journal.event('reject', row=7, status='Margin')
+    finally:
+        journal.stopLogging()
+    assert not journal.enabled()
+    fills = journal.readJournal(path, 'fill')
+    assert list(fills.row) == list(range(2500))
+    assert list(fills.price) == [n / 2 for n in range(2500)]
+    assert 'status' not in fills
+    rejects = journal.readJournal(path, 'reject')
+    assert list(rejects.status) == ['Margin']
+
+
+def test_journal_only_for_cerebro(monkeypatch):
+    ## the vector and broker engines send no events, so they open no journal file
+    journals = []
+    monkeypatch.setattr(journal, 'startLogging', lambda logfile, stream=False, journalfile=None, level=None: journals.append(journalfile))
+    monkeypatch.setattr(backtest, 'DEBUG', True)
+    for engine in ('cerebro', 'vector', 'broker'):
+        backtest.initLogger(engine)
+    assert journals[0].endswith('.jsonl')
+    assert journals[1:] == [None, None]
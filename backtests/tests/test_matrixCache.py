@@ -0,0 +1,83 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+
+import backtest
+import matrixCache
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    ## copies of the fixture files that a test can change
+    monkeypatch.setattr(backtest, 'DROP_LIST', [])
+    files = []
+    for name in ('returns.csv', 'allocations.csv'):
+        files.append(str(tmp_path / name))
+        shutil.copy(os.path.join(DATA, name), files[-1])
+    return files
+
+
+def load(cacheDir, files, builds, mmap=True):
+    def build():
+        builds.append(files)
+        dfp = backtest.readPrices(files[0])
+        return dfp, backtest.readSignals(dfp, files[1])
+    return matrixCache.loadMatrices(cacheDir, files, backtest.matrixParams(), build, mmap)
+
+
+def test_reload_is_mapped_and_equal(sources, tmp_path):
+    cacheDir, builds = str(tmp_path / 'cache'), []
+    dfp, dfs = load(cacheDir, sources, builds)
+    again, signals = load(cacheDir, sources, builds)
+    assert len(builds) == 1
+    pd.testing.assert_frame_equal(again, dfp, check_exact=True)
+    pd.testing.assert_frame_equal(signals, dfs, check_exact=True)
+    assert not again.values.flags.writeable and not again.values.flags.owndata
+    inMemory, _ = load(cacheDir, sources, builds, mmap=False)
+    assert inMemory.values.flags.writeable
+    pd.testing.assert_frame_equal(inMemory, dfp, check_exact=True)
+
+
+def test_changed_source_is_a_new_key(sources, tmp_path):
+    cacheDir, builds = str(tmp_path / 'cache'), []
+    dfp, dfs = load(cacheDir, sources, builds)
+    key = matrixCache.keyPath(cacheDir, sources, backtest.matrixParams())
+
+    ## a new mtime with the same bytes is rehashed to the same key
+    os.utime(sources[0], ns=(0, os.stat(sources[0]).st_mtime_ns + 10 ** 9))
+    assert matrixCache.keyPath(cacheDir, sources, backtest.matrixParams()) == key
+
+    with open(sources[1]) as f:
+        lines = f.readlines()
+    lines[-1] = lines[-1].replace('0.', '0.5', 1)
+    with open(sources[1], 'w') as f:
+        f.writelines(lines)
+    changed = matrixCache.keyPath(cacheDir, sources, backtest.matrixParams())
+    assert changed != key
+    dfp, signals = load(cacheDir, sources, builds)
+    assert len(builds) == 2 and os.path.isdir(changed)
+    assert not signals.equals(dfs)
+    assert matrixCache.keyPath(cacheDir, sources, backtest.matrixParams(0.05)) != changed
+
+
+def test_failed_write_leaves_no_entry(sources, tmp_path, monkeypatch):
+    ## a write that fails part way leaves neither an entry nor its temporary directory behind
+    cacheDir, builds = str(tmp_path / 'cache'), []
+    save = matrixCache.saveFrame
+    def failing(path, name, df):
+        if name == 'signals':
+            raise OSError('disk full')
+        save(path, name, df)
+    monkeypatch.setattr(matrixCache, 'saveFrame', failing)
+    dfp, dfs = load(cacheDir, sources, builds)
+    assert sorted(os.listdir(cacheDir)) == [matrixCache.SOURCES_FILE]
+    assert dfp.values.flags.writeable
+
+    monkeypatch.setattr(matrixCache, 'saveFrame', save)
+    again, _ = load(cacheDir, sources, builds)
+    assert len(builds) == 2
+    assert sorted(os.listdir(cacheDir)) == sorted([matrixCache.SOURCES_FILE, os.path.basename(matrixCache.keyPath(cacheDir, sources, backtest.matrixParams()))])
+    pd.testing.assert_frame_equal(again, dfp, check_exact=True)
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import performance
+
+RTOL = 1e-9
+
+
+def applyBenchmark(dfp, balance):
+    ## the benchmark plotOutputResults computed before the performance module, one apply per row
+    dfx = dfp.pct_change()
+    w = dfx.apply(lambda x: x.count(), axis=1)
+    dfr = pd.DataFrame(dfx.div(w, axis=0).sum(axis=1), columns=['benchmark'])
+    return balance + ((dfr + 1).cumprod() - 1) * balance
+
+
+def test_statistics_match_the_row_wise_computation(matrices):
+    dfp, dfs = matrices
+    dfp = dfp.copy()
+    ## an asset listed late, so the count of assets with a return changes along the dates
+    dfp.iloc[:20, 3] = np.nan
+    recorder, value, sharpe, _ = backtest.runVector(dfp, dfs)
+    dfc = recorder.dailyPnl()
+    stats, dfr = backtest.computeResults(dfp, dfc)
+    balance = backtest.START_BALANCE
+
+    benchmark = applyBenchmark(dfp, balance).benchmark
+    pd.testing.assert_series_equal(dfr.benchmark, benchmark, check_exact=False, rtol=RTOL)
+
+    strat = dfc.fillna(0.0).sum(axis=1)
+    returns = strat.pct_change()
+    returns.iloc[0] = strat.iloc[0] / balance - 1
+    bench = benchmark.pct_change().fillna(0.0)
+    bench.iloc[0] = benchmark.iloc[0] / balance - 1
+    window = performance.ROLLING_WINDOW
+    vol = returns.rolling(window).std() * np.sqrt(performance.TRADING_DAYS)
+    beta = returns.rolling(window).cov(bench) / bench.rolling(window).var()
+    np.testing.assert_allclose(dfr.rollingVol.values, vol.values, rtol=1e-7)
+    np.testing.assert_allclose(dfr.rollingBeta.values, beta.values, rtol=1e-7)
+    assert np.isnan(dfr.rollingVol.values[:window - 1]).all() and np.isfinite(dfr.rollingVol.values[window - 1:]).all()
+
+    drawdown = strat / strat.clip(lower=balance).cummax() - 1
+    np.testing.assert_allclose(dfr.drawdown.values, drawdown.values, rtol=RTOL)
+    assert stats['maxDrawdown'] == drawdown.min()
+    assert stats['volatility'] == pytest.approx(returns.std() * np.sqrt(performance.TRADING_DAYS), rel=RTOL)
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import returnsReader
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# a few dozen rows a chunk, so the dates are split across chunk boundaries
+CHUNK_SIZE = 37
+
+
+@pytest.fixture(params=['sorted', 'shuffled'])
+def returnsFile(request, tmp_path):
+    ## the fixture as written and shuffled with some rows left out, so assets have gaps
+    if request.param == 'sorted':
+        return os.path.join(DATA, 'returns.csv')
+    df = pd.read_csv(os.path.join(DATA, 'returns.csv'), dtype={'date': str})
+    df = df.sample(frac=1, random_state=5).iloc[25:]
+    filename = str(tmp_path / 'shuffled.csv')
+    df.to_csv(filename, index=False)
+    return filename
+
+
+@pytest.mark.parametrize('winsorization', [None, 0.02])
+def test_stream_matches_pandas(returnsFile, winsorization, tmp_path, monkeypatch):
+    monkeypatch.setattr(backtest, 'STREAM_CHUNKSIZE', None)
+    expected = backtest.convertReturnsToPrice(returnsFile, winsorization or 0)
+    for outfile in (None, str(tmp_path / 'prices.npy')):
+        dfp = returnsReader.streamReturnsToPrice(returnsFile, winsorization, CHUNK_SIZE, outfile)
+        pd.testing.assert_frame_equal(dfp, expected, check_exact=True, check_freq=False)
+    if winsorization:
+        assert not np.array_equal(expected.values, backtest.convertReturnsToPrice(returnsFile, 0).values, equal_nan=True)
+
+
+def test_shuffled_rows_give_the_same_prices(tmp_path):
+    ## row order only changes the order of the asset columns
+    df = pd.read_csv(os.path.join(DATA, 'returns.csv'), dtype={'date': str})
+    filename = str(tmp_path / 'shuffled.csv')
+    df.sample(frac=1, random_state=6).to_csv(filename, index=False)
+    expected = returnsReader.streamReturnsToPrice(os.path.join(DATA, 'returns.csv'), None, CHUNK_SIZE)
+    dfp = returnsReader.streamReturnsToPrice(filename, None, CHUNK_SIZE)
+    pd.testing.assert_frame_equal(dfp[expected.columns], expected, check_exact=True)
@@ -0,0 +1,24 @@
+import os
+import numpy as np
+
+import backtest
+import matrixCache
+import sweep
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FILES = [os.path.join(DATA, 'returns.csv'), os.path.join(DATA, 'allocations.csv')]
+
+
+def test_winsorization_levels_share_a_cache_entry(tmp_path, monkeypatch):
+    ## the level parsed from the command line finds the entry backtest.py made with the default
+    monkeypatch.setattr(backtest, 'DROP_LIST', [])
+    cacheDir = str(tmp_path)
+    paths = [sweep.buildCache(FILES[0], FILES[1], cacheDir, level) for level in sweep.parseList('1000,1000.0', backtest.winsorizationLevel)]
+    assert paths == [matrixCache.keyPath(cacheDir, FILES, backtest.matrixParams())] * 2
+
+    clipped = sweep.buildCache(FILES[0], FILES[1], cacheDir, 0.05)
+    assert backtest.WINSORIZATION_LEVEL == 1000
+    assert clipped != paths[0]
+    dfp = matrixCache.loadFrame(clipped, 'prices')
+    np.testing.assert_array_equal(dfp.values, backtest.readPrices(FILES[0], 0.05).values)
+    assert not np.array_equal(dfp.values, matrixCache.loadFrame(paths[0], 'prices').values)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+'''
+Vectorized alternative to the backtrader Cerebro loop in backtest.py
+
+The engine works directly on the dfp/dfs matrices produced by getPrices/getSignals and
+reproduces the MySignal/MySizer trading rules and the backtrader broker semantics
+(market orders filled at the next bar, submit-time cash check, execution-time margin check,
+percentage commission) with numpy operations across all assets of a bar.
+'''
+import logging
+import numpy as np
+import pandas as pd
+
+from recorder import DailyRecorder
+from fillLog import COMPLETED, MARGIN
+
+logger = logging.getLogger(__name__)
+
+# trading rule constants mirrored from MySignal / MySizer
+SIZER_PERCENTS = 95
+MIN_TRADE_SIZE = 10
+RISK_FREE_RATE = 0.01
+
+
+class VectorResult(object):
+    def __init__(self, recorder, value, sharpe, rejected):
+        self.recorder = recorder
+        self.value = value
+        self.sharpe = sharpe
+        self.rejected = rejected
+
+    def getvalue(self):
+        return self.value[-1]
+
+    def dailyPnl(self):
+        return self.recorder.dailyPnl()
+
+    def tradePnl(self):
+        return self.recorder.tradePnl()
+
+
+def prepareArrays(dfp, dfs):
+    ## the values are handed over as they are, so a memory mapped price matrix is not copied; the
+    ## missing (NaN) values become -1 bar by bar in simulate, as addData fills them
+    prices = np.asarray(dfp.values, dtype=float)
+    if not (dfs.index.equals(dfp.index) and dfs.columns.equals(dfp.columns)):
+        dfs = dfs.reindex(index=dfp.index, columns=dfp.columns)
+    return prices, np.asarray(dfs.values, dtype=float)
+
+
+def sentinel(row):
+    ## one bar of prices or signals with the missing values as -1
+    return np.where(np.isnan(row), -1.0, row)
+
+
+def sharpeRatio(dates, value, startValue, rate=RISK_FREE_RATE):
+    ## same as the backtrader SharpeRatio analyzer defaults: yearly returns, population stddev
+    years = pd.DatetimeIndex(dates).year.values
+    last = np.flatnonzero(np.append(years[1:] != years[:-1], True))
+    ends = value[last]
+    starts = np.insert(ends[:-1], 0, startValue)
+    excess = ends / starts - 1.0 - rate
+    std = excess.std()
+    if not len(excess) or not std:
+        return None
+    return excess.mean() / std
+
+
+def executeOrders(orders, cash, created, fill, pos, price, tradePnl, tradeComm, commission, log=None, bar=None):
+    ## orders are executed in asset order, the same order backtrader keeps its queues
+    idx = np.flatnonzero(orders)
+    qty = orders[idx]
+    submitted = idx, qty
+    buy = qty > 0
+    size = np.abs(qty)
+
+    ## check_submitted: pseudo-execute at the creation price, rejected orders still consume cash
+    notional = size * created[idx]
+    delta = np.where(buy, -notional, notional) - notional * commission
+    accepted = cash + np.cumsum(delta) >= 0.0
+    rejected = (~accepted).sum()
+    idx, qty, buy, size = idx[accepted], qty[accepted], buy[accepted], size[accepted]
+
+    ## real execution at the next bar open (== close for these feeds)
+    px = fill[idx]
+    comm = size * px * commission
+    pnl = np.where(buy, 0.0, size * (px - price[idx]))
+    delta = np.where(buy, -(size * px), size * price[idx] + pnl) - comm
+    running = cash + np.cumsum(delta)
+    if (running[buy] >= 0.0).all():
+        executed = np.ones(len(idx), dtype=bool)
+        cash = running[-1] if len(running) else cash
+    else:
+        ## some buy exceeded the available cash; replay this bar sequentially like the broker
+        executed = np.zeros(len(idx), dtype=bool)
+        for k in range(len(idx)):
+            c = cash + delta[k]
+            if buy[k] and c < 0.0:
+                continue
+            cash = c
+            executed[k] = True
+        rejected += (~executed).sum()
+
+    if log is not None:
+        ## both cash checks refuse an order with Margin, as the backtrader broker does
+        where = np.flatnonzero(accepted)
+        status = np.full(len(submitted[0]), MARGIN, np.int8)
+        status[where[executed]] = COMPLETED
+        fillPx, fillComm, fillPnl = created[submitted[0]], np.zeros(len(status)), np.zeros(len(status))
+        fillPx[where] = px
+        fillComm[where[executed]] = comm[executed]
+        fillPnl[where[executed]] = pnl[executed]
+        log.record(bar, submitted[0], submitted[1], fillPx, fillComm, fillPnl, cash, status)
+
+    idx, qty, px, comm, pnl = idx[executed], qty[executed], px[executed], comm[executed], pnl[executed]
+    newpos = pos[idx] + qty
+    opened = qty > 0
+    price[idx] = np.where(opened, (price[idx] * pos[idx] + qty * px) / np.where(newpos, newpos, 1.0), price[idx])
+    tradePnl[idx] += pnl
+    tradeComm[idx] += comm
+    pos[idx] = newpos
+    closed = idx[newpos == 0]
+    price[closed] = 0.0
+    return cash, closed, rejected
+
+
+class EngineState(object):
+    '''
+    positions, average cost, open trade accounting, cash and the orders waiting for the next bar
+    '''
+    def __init__(self, columns, cash):
+        N = len(columns)
+        self.columns = pd.Index(columns)
+        self.cash = cash
+        self.pos = np.zeros(N)
+        self.price = np.zeros(N)
+        self.tradePnl = np.zeros(N)
+        self.tradeComm = np.zeros(N)
+        self.orders = np.zeros(N)
+        # pnl of trades closed on the last bar, stamped on the row after it
+        self.pending = np.full(N, np.nan)
+        self.rejected = 0
+
+
+def simulate(state, prices, signals, prevSignal, recorder, commission=0.001, percents=SIZER_PERCENTS, log=None, offset=0):
+    '''
+    run the bars in prices/signals from state and return the daily portfolio values; orders are
+    not generated on the last bar so state is left ready to resume with the bars that follow it.
+    The orders filled or refused are appended to log, a FillLog, with bar numbers from offset
+    '''
+    T, N = prices.shape
+    pos, price, orders = state.pos, state.price, state.orders
+    valueAr = np.empty(T)
+    mkt = recorder.mkt
+    pnl = recorder.pnl
+
+    p, nxt, s = None, sentinel(prices[0]), sentinel(prevSignal)
+
+    for t in range(T):
+        before, p = p, nxt
+        # MySizer looks one bar ahead and falls back to the current close on the last bar
+        nxt = sentinel(prices[t + 1]) if t + 1 < T else p
+        ################################################################################################################
+        # broker: fill the orders created on the previous bar
+        ################################################################################################################
+        if t and orders.any():
+            state.cash, closed, r = executeOrders(orders, state.cash, before, p, pos, price,
+                                                  state.tradePnl, state.tradeComm, commission, log, offset + t)
+            state.rejected += r
+            if len(closed):
+                # backtrader stamps the closed trade with len(data), i.e. the following row
+                if t + 1 < T:
+                    pnl[t + 1, closed] = state.tradePnl[closed] - state.tradeComm[closed]
+                else:
+                    state.pending[closed] = state.tradePnl[closed] - state.tradeComm[closed]
+                state.tradePnl[closed] = 0.0
+                state.tradeComm[closed] = 0.0
+        cash = state.cash
+        valueAr[t] = cash + (pos * p).sum()
+
+        ################################################################################################################
+        # strategy: same rebalance rule as MySignal.next
+        ################################################################################################################
+        recorder.recordCash(t, cash)
+        held = pos != 0
+        mkt[t, held] = pos[held] * p[held]
+        orders[:] = 0.0
+        if t == T - 1:
+            # orders created on the last bar could only fill on a later bar
+            break
+        prev, s = s, sentinel(signals[t])
+        sizing = np.trunc(cash / np.maximum(p, nxt) * (percents / 100))
+
+        close = held & (s <= 0)
+        orders[close] = -pos[close]
+
+        reduce = np.flatnonzero(held & (s > 0) & (s < prev))
+        size = np.round(pos[reduce] * (1 - s[reduce] / prev[reduce]))
+        orders[reduce] = np.where(size > MIN_TRADE_SIZE, -size, 0.0)
+
+        increase = held & (s > 0) & (s > prev)
+        size = np.trunc(sizing * s)
+        orders[increase] = np.where(size[increase] > MIN_TRADE_SIZE, size[increase], 0.0)
+
+        # entries priced off a missing (-1) close would size negative; those are skipped
+        enter = ~held & (s > 0)
+        orders[enter] = np.where(size[enter] > 0, size[enter], 0.0)
+
+    return valueAr
+
+
+def runVectorizedBacktest(dfp, dfs, cash=1000000.0, commission=0.001, percents=SIZER_PERCENTS, log=None):
+    prices, signals = prepareArrays(dfp, dfs)
+    return runArrays(dfp.index, dfp.columns, prices, signals, cash, commission, percents, log)
+
+
+def runArrays(dates, columns, prices, signals, cash=1000000.0, commission=0.001, percents=SIZER_PERCENTS, log=None):
+    '''
+    the backtest of (dates x assets) price and signal arrays already in the engine convention:
+    prices forward filled, missing prices and signals NaN or -1, the signal of a date traded on
+    the next
+    '''
+    state = EngineState(columns, cash)
+    recorder = DailyRecorder(dates, columns)
+    valueAr = simulate(state, prices, signals, signals[-1], recorder, commission, percents, log)
+    sharpe = sharpeRatio(dates, valueAr, cash)
+    logger.info('vectorized backtest: %s bars %s assets %s rejected orders' % (prices.shape + (state.rejected,)))
+    return VectorResult(recorder, valueAr, sharpe, state.rejected)
@@ -16,9 +16,15 @@ import pandas as pd
 import datetime as dt
 import bloombergReader as blp
 from pytz import timezone
+
+## journal is shared with the sibling backtests package
+BACKTESTS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtests'))
+if BACKTESTS not in sys.path:
+    sys.path.append(BACKTESTS)
+import journal
 """
 This application reads market data from the bloomberg terminal installed on the local machine 
-and writes the output to a csv or series of csv files in the designated directory.
+and writes the output to a parquet, feather or csv file or series of files in the designated directory.
 
 The input for the program is an excel file with two worksheets defined, Tickers and Fields
 The tickers worksheet should have a single column if tickers with the heading 'TIckers'
@@ -31,7 +37,7 @@ The program is run as follows:
 enter __main__ without arguments to get a complete list of arguments.
 
 if checkpoint is set and the program is interupted, it will resume from where it left off assuming all the parameters remain the same. 
-If it is suspected that the last file created is corrupted or incomplete, delete the file from the output directory to regenerate.
+Completed requests are listed in manifest.jsonl in the output directory; to regenerate a file, delete it and remove its lines from the manifest.
 
 """
 
@@ -43,18 +49,17 @@ def run(args):
         tickers = dfTickers.Tickers.tolist()
         fields = dfFields.Fields.tolist()
 
-        records = blp.readBloombergData(tickers, fields, args.startdate, args.enddate, args.outdir, args.periodicity, args.tickerRange, args.checkpoint)
+        records = blp.readBloombergData(tickers, fields, args.startdate, args.enddate, args.outdir, args.periodicity, args.tickerRange, args.checkpoint,
+                                        args.inflight, args.sessions, args.format, args.incremental, args.adaptive, args.targetPoints)
         logger.info('read %s records' % records)
     except Exception as ex:
         logger.error('error reading input file: %s\n%r' % (args.input, ex))
 
 def initLogger():
     root = '/var/tmp/marketdata/' if 'linux' in sys.platform else '../data/output'
-    fh = logging.FileHandler(root + 'marketdata-{:%Y-%m-%d-%H-%M-%S}.log'.format(dt.datetime.now()))
-    formatter = logging.Formatter('%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
-    fh.setFormatter(formatter)
-    logger.addHandler(fh)
-    logger.addHandler(logging.StreamHandler())
+    name = root + 'marketdata-{:%Y-%m-%d-%H-%M-%S}'.format(dt.datetime.now())
+    # the log and the journal of bloomberg request events are written by a background thread
+    journal.startLogging(name + '.log', stream=True, journalfile=name + '.jsonl')
 
 def main(appname):
     ####################################################################################################################
@@ -75,20 +80,26 @@ def main(appname):
     # process command line args
     ####################################################################################################################
     parser = argparse.ArgumentParser(prog='BloombergReader')
+    parser.add_argument('-A', '--adaptive', action='store_true', help='size each request to about targetPoints data points instead of tickerRange tickers')
     parser.add_argument('-c', '--checkpoint', action='store_true', help='when set will checkpoint intermediate files')
     parser.add_argument('-e', '--enddate', help='end date defaults to today', default=None)
+    parser.add_argument('-F', '--format', help='output file format: parquet, feather, csv', default='parquet')
+    parser.add_argument('-I', '--incremental', action='store_true', help='only request the dates after those already in the output directory')
     parser.add_argument('-i', '--inputs', help='tickers and fields to extract', default='../../data/bloomberg-metadata.xlsx')
     parser.add_argument('-o', '--outdir', help='output director to write files', default='../../data/output1')
+    parser.add_argument('-r', '--inflight', help='number of requests in flight per session', type=int, default=1)
+    parser.add_argument('-S', '--sessions', help='number of bloomberg sessions', type=int, default=1)
+    parser.add_argument('-P', '--targetPoints', help='initial data points per request with adaptive batching', type=int, default=blp.TARGET_POINTS)
     parser.add_argument('-p', '--periodicity', help='periodicity for historical data, e.g., DAILY, MONTHLY', default='DAILY')
-    parser.add_argument('-s', '--startdate', help='start date', default='19700101')
+    parser.add_argument('-s', '--startdate', help='start date of historical data, reference data when not given', default='')
     parser.add_argument('-t', '--tickerRange', help='number of tickers to process per pass', type=int, default=2)
 
     args = parser.parse_args()
 
-    args.startdate = ''
+    if args.incremental and not args.startdate:
+        parser.error('-I/--incremental refreshes historical data and needs a start date, -s')
     ##args.enddate = '20191001'
     args.checkpoint = True
-    args.tickerRange = 1
     if not args.enddate:
         args.enddate = dt.datetime.now().strftime('%Y%m%d')
     if not args.outdir:
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+'''
+Per value decode cost of Bloomberg responses, the string lookups and per value date conversion
+of the original parsers against the Name based element iteration of bloombergReader, on a
+message set made by the fakeBlpapi stand-in
+
+    python benchDecode.py -n 50 -f 24 -d 20 -s 20190101 -e 20191231
+'''
+import time
+import calendar
+import logging
+import argparse
+import datetime as dt
+import pandas as pd
+
+import fakeBlpapi
+fakeBlpapi.install()
+import bloombergReader as blp
+from marketData import MarketDataBuffer
+
+logger = logging.getLogger(__name__)
+
+
+def legacyHistorical(msg, fields, mktDataAr):
+    ## the decode loop bloombergReader used before, kept here as the baseline
+    securityData = msg.getElement(blp.SECURITY_DATA)
+    ticker = securityData.getElementAsString(blp.SECURITY)
+    for fieldData in securityData.getElement(blp.FIELD_DATA).values():
+        dateField = fieldData.getElementValue('date')
+        for field in fields:
+            if fieldData.hasElement(field, True):
+                fieldValue = fieldData.getElementValue(field)
+                if isinstance(fieldValue, dt.date):
+                    fieldValue = calendar.timegm(fieldValue.timetuple())
+                mktDataAr.add(dateField, ticker, field, fieldValue)
+
+
+def recordMessages(numTickers, fields, startdate, enddate):
+    request = fakeBlpapi.Request('HistoricalDataRequest')
+    for ticker in ['T%04d US EQUITY' % n for n in range(numTickers)]:
+        request.append('securities', ticker)
+    for field in fields:
+        request.append('fields', field)
+    request.set('startDate', startdate)
+    request.set('endDate', enddate)
+    events, rows = fakeBlpapi.historicalResponse(request, fakeBlpapi.CorrelationId(0))
+    return [msg for eventType, messages in events for msg in messages]
+
+
+def timeDecode(messages, parse, fields, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = MarketDataBuffer()
+        for msg in messages:
+            parse(msg, fields, rows)
+        ## the new path converts its date values here, so the flush is part of its cost
+        df = rows.toFrame()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return df, best
+
+
+def runBenchmark(numTickers=50, numFields=24, dateFields=4, startdate='20190101', enddate='20191231', repeat=5):
+    fields = ['FIELD_%02d' % n for n in range(numFields - dateFields)] + ['FIELD_%02d_DT' % n for n in range(dateFields)]
+    messages = recordMessages(numTickers, fields, startdate, enddate)
+    legacy, legacySeconds = timeDecode(messages, legacyHistorical, fields, repeat)
+    current, currentSeconds = timeDecode(messages, blp.parseHistoricalMessage, blp.fieldNames(fields), repeat)
+    values = len(current)
+    df = pd.DataFrame([{'decoder': 'strings', 'seconds': legacySeconds, 'values': len(legacy), 'nsPerValue': 1e9 * legacySeconds / len(legacy)},
+                       {'decoder': 'names', 'seconds': currentSeconds, 'values': values, 'nsPerValue': 1e9 * currentSeconds / values}]).set_index('decoder')
+    df['speedup'] = df.seconds.iloc[0] / df.seconds
+    df['identical'] = current.astype({'Value': float}).equals(legacy.astype({'Value': float}))
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BenchDecode')
+    parser.add_argument('-n', '--tickers', help='number of tickers', type=int, default=50)
+    parser.add_argument('-f', '--fields', help='number of fields', type=int, default=24)
+    parser.add_argument('-d', '--dateFields', help='number of the fields with date values', type=int, default=4)
+    parser.add_argument('-s', '--startdate', help='start date', default='20190101')
+    parser.add_argument('-e', '--enddate', help='end date', default='20191231')
+    parser.add_argument('-k', '--repeat', help='best of k runs', type=int, default=5)
+    args = parser.parse_args()
+    return runBenchmark(args.tickers, args.fields, args.dateFields, args.startdate, args.enddate, args.repeat)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('decode times\n%s' % main().to_string())
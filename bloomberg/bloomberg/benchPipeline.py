@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+'''
+Throughput of the sequential and pipelined readers against the fakeBlpapi stand-in
+
+    python benchPipeline.py -n 40 -f 30 -l 0.05 -r 8 -S 2
+'''
+import time
+import argparse
+import logging
+import pandas as pd
+
+import fakeBlpapi
+fakeBlpapi.install()
+import bloombergReader as blp
+
+logger = logging.getLogger(__name__)
+
+
+def timeRead(tickers, fields, startdate, enddate, tickerRange, inFlight, sessions):
+    fakeBlpapi.resetStats()
+    start = time.time()
+    df = blp.readBloombergData(tickers, fields, startdate, enddate, tickerRange=tickerRange, inFlight=inFlight, sessions=sessions)
+    elapsed = time.time() - start
+    return df, {'inFlight': inFlight, 'sessions': sessions, 'seconds': elapsed, 'rows': len(df),
+                'requests': fakeBlpapi.STATS['requests'], 'rowsPerSecond': len(df) / elapsed,
+                'maxInFlight': fakeBlpapi.STATS['maxInFlight']}
+
+
+def runBenchmark(numTickers=40, numFields=30, latency=0.05, inFlight=8, sessions=2, startdate='20190101', enddate='20190331', tickerRange=1):
+    fakeBlpapi.configure(latency=latency)
+    tickers = ['T%04d US EQUITY' % n for n in range(numTickers)]
+    fields = ['FIELD_%02d' % n for n in range(numFields)]
+    rows = []
+    base, stats = timeRead(tickers, fields, startdate, enddate, tickerRange, 1, 1)
+    rows.append(stats)
+    for n, s in [(inFlight, 1), (inFlight, sessions)]:
+        df, stats = timeRead(tickers, fields, startdate, enddate, tickerRange, n, s)
+        stats['identical'] = df.equals(base)
+        rows.append(stats)
+    df = pd.DataFrame(rows)
+    df['speedup'] = df.seconds.iloc[0] / df.seconds
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BenchPipeline')
+    parser.add_argument('-n', '--tickers', help='number of tickers', type=int, default=40)
+    parser.add_argument('-f', '--fields', help='number of fields', type=int, default=30)
+    parser.add_argument('-l', '--latency', help='simulated round trip in seconds', type=float, default=0.05)
+    parser.add_argument('-r', '--inflight', help='requests in flight per session', type=int, default=8)
+    parser.add_argument('-S', '--sessions', help='number of sessions', type=int, default=2)
+    parser.add_argument('-t', '--tickerRange', help='number of tickers per request', type=int, default=1)
+    args = parser.parse_args()
+    return runBenchmark(args.tickers, args.fields, args.latency, args.inflight, args.sessions, tickerRange=args.tickerRange)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('pipeline runs\n%s' % main().to_string())
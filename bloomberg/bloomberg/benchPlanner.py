@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+'''
+Request counts and throughput of fixed ticker chunks against adaptive batching, measured with
+the fakeBlpapi stand-in: LATENCY is the fixed overhead of every request, ROW_COST the time per
+row, CONCURRENCY the requests of a session the service works on at once and a request above
+MAX_POINTS times out.  Batching saves the overhead of the requests it does not send, which only
+shows when the service queues them; with no concurrency limit the round trips of small requests
+are hidden behind the parsing of the others
+
+    python benchPlanner.py -n 200 -f 30 -l 0.5 -c 0.000002 -k 1 -m 200000
+'''
+import time
+import argparse
+import logging
+import pandas as pd
+
+import fakeBlpapi
+fakeBlpapi.install()
+import bloombergReader as blp
+
+logger = logging.getLogger(__name__)
+
+
+def timeRead(name, tickers, fields, startdate, enddate, inFlight, sessions, **kwargs):
+    fakeBlpapi.resetStats()
+    start = time.time()
+    df = blp.readBloombergData(tickers, fields, startdate, enddate, inFlight=inFlight, sessions=sessions, **kwargs)
+    elapsed = time.time() - start
+    return df, {'run': name, 'seconds': elapsed, 'rows': len(df), 'requests': fakeBlpapi.STATS['requests'],
+                'failed': fakeBlpapi.STATS['failed'], 'rowsPerSecond': len(df) / elapsed}
+
+
+def sortFrame(df):
+    return df.sort_values(['Ticker', 'Field', 'Date']).reset_index(drop=True)
+
+
+def runBenchmark(numTickers=200, numFields=30, latency=0.5, rowCost=0.000002, maxPoints=200000, inFlight=4, sessions=1, concurrency=1,
+                 startdate='20150101', enddate='20191231', targetPoints=blp.TARGET_POINTS):
+    fakeBlpapi.configure(latency=latency, rowCost=rowCost, maxPoints=maxPoints, concurrency=concurrency)
+    tickers = ['T%04d US EQUITY' % n for n in range(numTickers)]
+    fields = ['FIELD_%02d' % n for n in range(numFields)]
+    runs = [('tickerRange=1', {'tickerRange': 1}),
+            ('tickerRange=10', {'tickerRange': 10}),
+            ('adaptive', {'adaptive': True, 'targetPoints': targetPoints})]
+    rows = []
+    base = None
+    for name, kwargs in runs:
+        df, stats = timeRead(name, tickers, fields, startdate, enddate, inFlight, sessions, **kwargs)
+        df = sortFrame(df)
+        base = df if base is None else base
+        stats['identical'] = df.equals(base)
+        rows.append(stats)
+    df = pd.DataFrame(rows).set_index('run')
+    df['speedup'] = df.seconds.iloc[0] / df.seconds
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BenchPlanner')
+    parser.add_argument('-n', '--tickers', help='number of tickers', type=int, default=200)
+    parser.add_argument('-f', '--fields', help='number of fields', type=int, default=30)
+    parser.add_argument('-l', '--latency', help='simulated overhead per request in seconds', type=float, default=0.5)
+    parser.add_argument('-c', '--rowCost', help='simulated seconds per row', type=float, default=0.000002)
+    parser.add_argument('-m', '--maxPoints', help='largest request answered before timing out', type=int, default=200000)
+    parser.add_argument('-k', '--concurrency', help='requests of a session worked on at once, 0 for no limit', type=int, default=1)
+    parser.add_argument('-P', '--targetPoints', help='initial data points per adaptive request', type=int, default=blp.TARGET_POINTS)
+    parser.add_argument('-r', '--inflight', help='requests in flight per session', type=int, default=4)
+    parser.add_argument('-S', '--sessions', help='number of sessions', type=int, default=1)
+    parser.add_argument('-s', '--startdate', help='start date', default='20150101')
+    parser.add_argument('-e', '--enddate', help='end date', default='20191231')
+    args = parser.parse_args()
+    return runBenchmark(args.tickers, args.fields, args.latency, args.rowCost, args.maxPoints, args.inflight, args.sessions,
+                        args.concurrency or None, args.startdate, args.enddate, args.targetPoints)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(lineno)04d | %(message)s')
+    logger.info('planner runs\n%s' % main().to_string())
@@ -8,12 +8,25 @@ Created on Oct 27, 2019
 
 '''
 import os
+import sys
+import time
+import itertools
 import blpapi
 import logging.config
 import pandas as pd
 import datetime as dt
-import calendar
-import glob
+from collections import OrderedDict
+
+from marketData import MarketDataBuffer, MarketDataStore, splitOutput
+from manifest import Manifest
+from refreshIndex import HighWaterMarks, planRequests
+from planner import BatchPlanner, TARGET_POINTS
+
+## journal is shared with the sibling backtests package
+BACKTESTS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtests'))
+if BACKTESTS not in sys.path:
+    sys.path.append(BACKTESTS)
+import journal
 
 logger = logging.getLogger(__name__)
 
@@ -23,15 +36,28 @@ FIELD_DATA = blpapi.Name("fieldData")
 FIELD_EXCEPTIONS = blpapi.Name("fieldExceptions")
 FIELD_ID = blpapi.Name("fieldId")
 ERROR_INFO = blpapi.Name("errorInfo")
+DATE = blpapi.Name("date")
 BLP_FIELD_LIMIT = 24
-header = True
+
+
+class RequestFailure(Exception):
+    ## the service answered a request with a REQUEST_STATUS failure, e.g. a timeout
+    pass
 
 ##############################################################################################
 # Program Entry Point
 ##############################################################################################
 
-def readBloombergData(tickers, fields, startdate=None, enddate=None, output=None, periodicity='DAILY', tickerRange=None, checkpoint=False):
+def readBloombergData(tickers, fields, startdate=None, enddate=None, output=None, periodicity='DAILY', tickerRange=None, checkpoint=False, inFlight=1, sessions=1, fmt=None, incremental=False,
+                      adaptive=False, targetPoints=TARGET_POINTS):
     records = 0
+    mktDataAr = MarketDataBuffer()
+    store = None
+    marks = None
+    manifest = None
+    planner = BatchPlanner(targetPoints) if adaptive else None
+    units = []
+    completed = False
     try:
         ################################################################################################################
         # open bloomberg session...
@@ -41,134 +67,349 @@ def readBloombergData(tickers, fields, startdate=None, enddate=None, output=None
                 yield l[idx:idx + n]
         if not tickerRange:
             tickerRange = len(tickers)
+        incremental = incremental and bool(output and startdate)
 
-        if checkpoint and output:
-            ##if program interuppted restart from where left off...
-            path = output
-            if output.endswith('.csv'):
-                path = os.path.dirname(output)
-            if os.path.exists(path):
-                try:
-                    files = glob.glob('%s/*.csv' % output)
-                    latest = max(files, key=os.path.getctime)
-                    df = pd.read_csv(latest)
-                    endticker = df.iloc[-1,2]
-                    idx = tickers.index(endticker) + 1
-                    tickers = tickers[idx:]
-                    header = False
-                except Exception as ex:
-                    pass
-        ## start bloomberg session
-        logger.info('Started Reading Bloomberg data')
-        sessionOptions = blpapi.SessionOptions()
-        # sessionOptions.setServerHost('localhost')
-        sessionOptions.setServerHost('127.0.0.1')
-        sessionOptions.setServerPort(8194)
-        session = blpapi.Session(sessionOptions)
-        mktDataAr = []
-        if session.start():
-            if session.openService('//blp/refdata'):
+        if incremental:
+            ## only the dates after the high water mark of each (ticker, field), new rows go to a file per run
+            path, filename, fmt = splitOutput(output, fmt)
+            marks = HighWaterMarks(path, periodicity)
+            enddate = enddate or dt.datetime.now().strftime('%Y%m%d')
+            requests = planRequests(marks, tickers, fields, startdate, enddate, periodicity, tickerRange, BLP_FIELD_LIMIT,
+                                    lambda seq, tickerList, fieldList, start: BloombergRequest(seq, tickerList, fieldList, start, enddate, periodicity),
+                                    planner)
+            store = MarketDataStore(path, checkpoint, fmt, filename=runFilename(filename), numbered=True)
+            if checkpoint and not planner:
+                ##if program interuppted restart from where left off, skipping the requests in the manifest...
+                manifest = Manifest(store.outdir)
+                requests = manifest.pending(requests)
+        else:
+            if output:
+                ## values are flushed to disk in batches as they arrive, one file per ticker chunk with checkpoint
+                if planner:
+                    ## batches differ between runs, so partitions are numbered and named after the run
+                    path, filename, fmt = splitOutput(output, fmt)
+                    store = MarketDataStore(path, checkpoint, fmt, filename=runFilename(filename), numbered=True)
+                else:
+                    store = MarketDataStore(output, checkpoint, fmt)
+            if checkpoint and output:
+                manifest = Manifest(store.outdir)
+
+            if planner:
+                ## batches sized to targetPoints as the responses come back, the field chunks already in the manifest are skipped
+                groups = OrderedDict()
+                for ticker in tickers:
+                    todo = tuple(field for fieldList in chunks(fields, BLP_FIELD_LIMIT)
+                                 if not (manifest and manifest.isComplete(ticker, requestFields(fieldList, startdate), startdate, enddate, periodicity))
+                                 for field in fieldList)
+                    if todo:
+                        groups.setdefault(todo, []).append(ticker)
+                requests = itertools.chain.from_iterable(
+                    planner.plan(tickerGroup, list(fieldGroup), startdate, enddate, periodicity, BLP_FIELD_LIMIT,
+                                 lambda seq, tickerList, fieldList: BloombergRequest(seq, tickerList, fieldList, startdate, enddate, periodicity))
+                    for fieldGroup, tickerGroup in groups.items())
+            else:
                 ## do 25 fields at a time... bloomberg limit
+                requests = []
                 for tickerList in chunks(tickers, tickerRange):
                     for fieldList in chunks(fields, BLP_FIELD_LIMIT):
-                        if startdate:
-                            subArray = GetHistoricalData(session, startdate, enddate, tickerList, fieldList, periodicity)
-                        else:
-                            subArray = GetIntradayData(session, tickerList, fieldList)
-                        records += len(subArray)
-                        mktDataAr.extend(subArray)
-                        logger.info("read %s records from Bloomberg..." % records)
-                    if checkpoint and output:
-                        writeMarketData(mktDataAr, output, checkpoint)
-                        mktDataAr = []
-            else:
-                logger.exception("Failed to open bloomberg service...")
-        else:
-            logger.exception("Failed to start bloomberg session...")
+                        requests.append(BloombergRequest(len(requests), tickerList, fieldList, startdate, enddate, periodicity))
+                    requests[-1].last = True
+
+                if manifest:
+                    ##if program interuppted restart from where left off, skipping the requests in the manifest...
+                    requests = manifest.pending(requests)
+
+        while requests:
+            for request, subArray in fetchRequests(requests, inFlight, sessions):
+                if planner:
+                    planner.feedback(request, subArray)
+                if request.error:
+                    ## nothing of a failed request is kept or recorded, the planner sends it again in smaller pieces
+                    logger.error('Bloomberg request %s for %s tickers failed: %s' % (request.seq, len(request.tickers), request.error))
+                    subArray = MarketDataBuffer()
+                records += len(subArray)
+                if marks and not request.error:
+                    marks.observe(subArray, request.tickers, request.fields, request.startdate, request.enddate)
+                if store:
+                    store.append(subArray, request.tickers, request.last)
+                    if not request.error:
+                        units.append((request, len(subArray)))
+                    if request.last and checkpoint:
+                        ## the ticker chunk is on disk now
+                        if manifest:
+                            manifest.record(units, store.lastFile)
+                        units = []
+                        if marks:
+                            marks.commit()
+                elif not checkpoint:
+                    mktDataAr.extend(subArray)
+                logger.info("read %s records from Bloomberg..." % records)
+            ## failures seen after the last batch was handed out go round again
+            requests = planner.plan([], fields, startdate, enddate, periodicity, BLP_FIELD_LIMIT, None) if planner and planner.pending() else None
+        completed = True
+        if planner:
+            logger.info('adaptive batching:\n%s' % planner.report())
     except Exception as ex:
-        logger.exception("Failed to execute...", ex)
+        logger.exception('Failed to execute...: %r', ex)
     finally:
         ret = records
-        if not checkpoint:
-            if output:
-                writeMarketData(mktDataAr, output, checkpoint)
+        if store:
+            ## an interrupted ticker chunk is left unfinished so a checkpointed or incremental restart reads it again
+            if completed or not (checkpoint or incremental):
+                store.close()
+                if marks:
+                    marks.commit()
             else:
-                columns = ['Date', 'Ticker', 'Field', 'Value']
-                ret = pd.DataFrame(mktDataAr, columns=columns)
-        if session:
-            session.stop()
+                store.abort()
+        elif not checkpoint:
+            ret = mktDataAr.toFrame()
         return ret
 
+def runFilename(filename):
+    ## a name no other run can write: the start time to the microsecond and the process id
+    base, ext = os.path.splitext(filename)
+    return '%s-%s-%s%s' % (base, dt.datetime.now().strftime('%Y%m%d-%H%M%S-%f'), os.getpid(), ext)
+
+def fetchRequests(requests, inFlight=1, sessions=1):
+    '''
+    generator of (request, MarketDataBuffer) in request order; with inFlight or sessions above one
+    the requests are pipelined, otherwise each is sent once the previous response is complete
+    '''
+    sessionAr = []
+    try:
+        ## start bloomberg session
+        logger.info('Started Reading Bloomberg data')
+        sessionAr = [openSession() for _ in range(max(sessions, 1))]
+        if all(sessionAr):
+            if inFlight > 1 or len(sessionAr) > 1:
+                ## keep several requests outstanding on every session, results come back in request order
+                from pipeline import RequestPipeline
+                results = RequestPipeline(sessionAr, inFlight).run(requests)
+            else:
+                results = ((request, request.fetch(sessionAr[0])) for request in requests)
+            for result in results:
+                yield result
+    finally:
+        for session in sessionAr:
+            if session:
+                session.stop()
+
+def openSession(host='127.0.0.1', port=8194):
+    sessionOptions = blpapi.SessionOptions()
+    # sessionOptions.setServerHost('localhost')
+    sessionOptions.setServerHost(host)
+    sessionOptions.setServerPort(port)
+    session = blpapi.Session(sessionOptions)
+    if not session.start():
+        logger.exception("Failed to start bloomberg session...")
+    elif not session.openService('//blp/refdata'):
+        logger.exception("Failed to open bloomberg service...")
+    else:
+        return session
+    session.stop()
+    return None
+
+def requestFields(fields, startdate):
+    ## the fields actually requested, reference requests lead with the date field
+    return list(fields) if startdate else ['LAST_UPDATE_DT'] + list(fields)
+
+class BloombergRequest(object):
+    '''
+    one (tickerList, fieldList) chunk of a download: a ReferenceDataRequest when there is no start
+    date, otherwise a HistoricalDataRequest; last marks the final field chunk of a ticker list.
+    names holds the blpapi Names of the fields for decoding; points, elapsed and error describe the request for the adaptive planner
+    '''
+    def __init__(self, seq, tickers, fields, startdate=None, enddate=None, periodicity='DAILY'):
+        self.seq = seq
+        self.tickers = tickers
+        self.startdate = startdate
+        self.enddate = enddate
+        self.periodicity = periodicity
+        self.last = False
+        self.points = 0
+        self.elapsed = None
+        self.error = None
+        self.fields = requestFields(fields, startdate)
+        self.names = fieldNames(self.fields)
+        self.parse = parseHistoricalMessage if startdate else parseReferenceMessage
+
+    def split(self, tickers):
+        ## the same request for some of its tickers
+        return BloombergRequest(self.seq, tickers, self.fields if self.startdate else self.fields[1:], self.startdate, self.enddate, self.periodicity)
+
+    def create(self, session):
+        if self.startdate:
+            return createHistoricalRequest(session, self.startdate, self.enddate, self.tickers, self.fields, self.periodicity)
+        return createReferenceRequest(session, self.tickers, self.fields)
+
+    def fetch(self, session):
+        ## send the request and block until its response is complete
+        self.error = None
+        started = time.time()
+        journal.event('request', seq=self.seq, tickers=len(self.tickers), fields=len(self.fields))
+        try:
+            if self.startdate:
+                subArray = GetHistoricalData(session, self.startdate, self.enddate, self.tickers, self.fields, self.periodicity)
+            else:
+                subArray = GetIntradayData(session, self.tickers, self.fields[1:])
+        except RequestFailure as ex:
+            self.error = str(ex)
+            subArray = MarketDataBuffer()
+        self.elapsed = time.time() - started
+        journal.event('response', seq=self.seq, rows=len(subArray) if subArray is not None else None, elapsed=self.elapsed, error=self.error)
+        if subArray is None:
+            raise RuntimeError('Bloomberg request %s failed' % self.seq)
+        return subArray
+
+##############################################################################################
+# Request builders and response parsers shared by the sequential and pipelined readers
+##############################################################################################
+def createReferenceRequest(session, tickers, fields):
+    service = session.getService('//blp/refdata')
+    request = service.createRequest("ReferenceDataRequest")
+
+    ###########################################################
+    # add tickers to the request
+    ###########################################################
+    for ticker in tickers:
+        request.append('securities', ticker)
+    ###########################################################
+    # add field to the request
+    ###########################################################
+    for field in fields:
+        request.append('fields', field)
+    return request
+
+def createHistoricalRequest(session, startdate, enddate, tickers, fields, periodicity):
+    service = session.getService('//blp/refdata')
+    ################################################################################################################
+    # add start and end date for historical data
+    ################################################################################################################
+    request = service.createRequest("HistoricalDataRequest")
+    request.set("periodicityAdjustment", "ACTUAL")
+    request.set("periodicitySelection", periodicity.upper())
+    startDate = pd.to_datetime(startdate).strftime('%Y%m%d')
+    endDate = pd.to_datetime(enddate).strftime('%Y%m%d')
+    request.set("startDate", startDate)
+    request.set("endDate", endDate)
+    # request.set("maxDataPoints", 100)
+
+    ###########################################################
+    # add tickers to the request
+    ###########################################################
+    for ticker in tickers:
+        request.append('securities', ticker)
+    ###########################################################
+    # add field to the request
+    ###########################################################
+    for field in fields:
+        request.append('fields', field)
+    return request
+
+def fieldNames(fields):
+    ## blpapi Names of the requested fields to the field strings, built once per request
+    if isinstance(fields, dict):
+        return fields
+    return OrderedDict((blpapi.Name(field), field) for field in fields)
+
+def asDateField(value):
+    if isinstance(value, dt.date):
+        return value
+    if isinstance(value, dt.time):
+        return dt.datetime.combine(dt.datetime.now().date(), value)
+    return None
+
+def parseReferenceMessage(msg, fields, mktDataAr):
+    ###########################################################
+    # Realtime response is structured with array of securities
+    # each with a fieldData structure
+    ###########################################################
+    names = fieldNames(fields)
+    ## date field must be first in list
+    dateName = next(iter(names))
+    add = mktDataAr.add
+    securityDataArray = msg.getElement(SECURITY_DATA)
+    for securityData in securityDataArray.values():
+        ticker = None
+        try:
+            ticker = securityData.getElementAsString(SECURITY)
+            fieldData = securityData.getElement(FIELD_DATA)
+            dateField = asDateField(fieldData.getElementValue(dateName)) if fieldData.hasElement(dateName, True) else None
+            if dateField is None:
+                logger.error("Error: missing date field %s: %s" % (ticker, names[dateName]))
+                continue
+            ###########################################################
+            # transpose the fields present to secId, fieldId, value, date;
+            # date values are converted to epoch when the buffer is flushed
+            ###########################################################
+            for element in fieldData.elements():
+                name = element.name()
+                if name != dateName and name in names and not element.isNull():
+                    add(dateField, ticker, names[name], element.getValue())
+        except Exception as ex:
+            logger.exception("Error Reading data for %s: %r" % (ticker, ex))
+
+def parseHistoricalMessage(msg, fields, mktDataAr):
+    ###########################################################
+    # Historical response is structured with array of fieldData
+    # for each security
+    ###########################################################
+    names = fieldNames(fields)
+    add = mktDataAr.add
+    securityData = msg.getElement(SECURITY_DATA)
+    ticker = securityData.getElementAsString(SECURITY)
+    fieldDataArray = securityData.getElement(FIELD_DATA)
+    for fieldData in fieldDataArray.values():
+        try:
+            ###########################################################
+            # get date field first
+            ###########################################################
+            dateField = asDateField(fieldData.getElementValue(DATE))
+            if dateField is None:
+                logger.error("Error: missing date field %s" % ticker)
+                continue
+            ###########################################################
+            # transpose the fields present to secId, fieldId, value, date
+            ###########################################################
+            for element in fieldData.elements():
+                field = names.get(element.name())
+                if field is not None and not element.isNull():
+                    add(dateField, ticker, field, element.getValue())
+        except Exception as ex:
+            logger.exception("Error Reading data for %s: %r" % (ticker, ex))
+
+def readResponse(session, cid, parse, fields):
+    ###########################################################
+    # loop through response and add to array
+    ###########################################################
+    mktDataAr = MarketDataBuffer()
+    while (True):
+        try:
+            ev = session.nextEvent(500)
+            for msg in ev:
+                if cid in msg.correlationIds():
+                    if ev.eventType() == blpapi.Event.REQUEST_STATUS:
+                        raise RequestFailure(str(msg))
+                    parse(msg, fields, mktDataAr)
+            if ev.eventType() == blpapi.Event.RESPONSE:
+                break
+        except RequestFailure:
+            raise
+        except Exception as ex:
+            logger.exception("Error Reading Bloomberg event data: %r" % ex)
+    return mktDataAr
+
 ##############################################################################################
 # Get Daily Marketdata
 ##############################################################################################
 def GetIntradayData(session, tickers, fields):
     try:
-        service = session.getService('//blp/refdata')
-        request = service.createRequest("ReferenceDataRequest")
-
-        ###########################################################
-        # add tickers to the request
-        ###########################################################
-        for ticker in tickers:
-            request.append('securities', ticker)
-        ###########################################################
-        # add field to the request
-        ###########################################################
         fields = ['LAST_UPDATE_DT'] + fields
-        for field in fields:
-            request.append('fields', field)
+        request = createReferenceRequest(session, tickers, fields)
         cid = session.sendRequest(request)
-        ###########################################################
-        # loop through response and add to array
-        #
-        # Realtime response is structured with array of securities
-        # each with a fieldData structure
-        ###########################################################
-        mktDataAr = []
-        while (True):
-            try:
-                ev = session.nextEvent(500)
-                for msg in ev:
-                    if cid in msg.correlationIds():
-                        securityDataArray = msg.getElement(SECURITY_DATA)
-                        for securityData in securityDataArray.values():
-                            try:
-                                ###########################################################
-                                # date field must be first in list
-                                ###########################################################
-                                dateField = None
-                                ticker = securityData.getElementAsString(SECURITY)
-                                fieldData = securityData.getElement(FIELD_DATA)
-                                for field in fields:
-                                    if fieldData.hasElement(field, True):
-                                        fieldValue = fieldData.getElementValue(field)
-                                        if not dateField:
-                                            if isinstance(fieldValue, dt.date):
-                                                dateField = fieldValue
-                                            elif isinstance(fieldValue, dt.time):
-                                                dateField = dt.datetime.combine(dt.datetime.now().date(), fieldValue)
-                                            else:
-                                                logger.error("Error: missing date field %s: %s: %r" % (ticker, field))
-                                        else:
-                                            ###########################################################
-                                            # transpose data to secId, fieldId, value, date
-                                            ###########################################################
-                                            # convert date fields to epoch
-                                            if isinstance(fieldValue, dt.date):
-                                                fieldValue = calendar.timegm(fieldValue.timetuple())
-                                            rowData = []
-                                            rowData.append(dateField)
-                                            rowData.append(ticker)
-                                            rowData.append(field)
-                                            rowData.append(fieldValue)
-                                            mktDataAr.append(rowData)
-                            except Exception as ex:
-                                logger.exception("Error Reading data for %s: %r" % (ticker, ex))
-                if ev.eventType() == blpapi.Event.RESPONSE:
-                    break
-            except Exception as ex:
-                logger.exception("Error Reading Bloomberg event data: %r" % ex)
+        mktDataAr = readResponse(session, cid, parseReferenceMessage, fieldNames(fields))
+    except RequestFailure:
+        raise
     except Exception as ex:
         logger.exception("Error Reading Bloomberg data: %r" % ex)
     else:
@@ -179,102 +420,12 @@ def GetIntradayData(session, tickers, fields):
 ##############################################################################################
 def GetHistoricalData(session, startdate, enddate, tickers, fields, periodicity):
     try:
-        service = session.getService('//blp/refdata')
-        ################################################################################################################
-        # add start and end date for historical data
-        ################################################################################################################
-        request = service.createRequest("HistoricalDataRequest")
-        request.set("periodicityAdjustment", "ACTUAL")
-        request.set("periodicitySelection", periodicity.upper())
-        startDate = pd.to_datetime(startdate).strftime('%Y%m%d')
-        endDate = pd.to_datetime(enddate).strftime('%Y%m%d')
-        request.set("startDate", startDate)
-        request.set("endDate", endDate)
-        # request.set("maxDataPoints", 100)
-
-        ###########################################################
-        # add tickers to the request
-        ###########################################################
-        for ticker in tickers:
-            request.append('securities', ticker)
-        ###########################################################
-        # add field to the request
-        ###########################################################
-        for field in fields:
-            request.append('fields', field)
-
-        ###########################################################
-        # loop through response and add to array
-        #
-        # Historical response is structured with array of fieldData
-        # for each security
-        ###########################################################
+        request = createHistoricalRequest(session, startdate, enddate, tickers, fields, periodicity)
         cid = session.sendRequest(request)
-        mktDataAr = []
-        while (True):
-            try:
-                ev = session.nextEvent(500)
-                for msg in ev:
-                    if cid in msg.correlationIds():
-                        securityData = msg.getElement(SECURITY_DATA)
-                        ticker = securityData.getElementAsString(SECURITY)
-                        fieldDataArray = securityData.getElement(FIELD_DATA)
-                        for fieldData in fieldDataArray.values():
-                            try:
-                                ###########################################################
-                                # get date field first
-                                ###########################################################
-                                fieldValue = fieldData.getElementValue('date')
-                                if isinstance(fieldValue, dt.date):
-                                    dateField = fieldValue
-                                elif isinstance(fieldValue, dt.time):
-                                    dateField = dt.datetime.combine(dt.datetime.now().date(), fieldValue)
-                                if dateField:
-                                    for field in fields:
-                                        if fieldData.hasElement(field, True):
-                                            fieldValue = fieldData.getElementValue(field)
-                                            ###########################################################
-                                            # transpose data to secId, fieldId, value, date
-                                            ###########################################################
-                                            rowData = []
-                                            rowData.append(dateField)
-                                            rowData.append(ticker)
-                                            rowData.append(field)
-                                            if isinstance(fieldValue, dt.date):
-                                                fieldValue = calendar.timegm(fieldValue.timetuple())
-                                            rowData.append(fieldValue)
-                                            mktDataAr.append(rowData)
-                                else:
-                                    logger.error("Error: missing date field %s: %s: %r" % (ticker, field))
-                            except Exception as ex:
-                                logger.exception("Error Reading data for %s: %r" % (ticker, ex))
-                if ev.eventType() == blpapi.Event.RESPONSE:
-                    break
-            except Exception as ex:
-                logger.exception("Error Reading Bloomberg event data: %r" % ex)
+        mktDataAr = readResponse(session, cid, parseHistoricalMessage, fieldNames(fields))
+    except RequestFailure:
+        raise
     except Exception as ex:
         logger.exception("Error Reading Bloomberg data: %r" % ex)
     else:
         return mktDataAr
-
-def writeMarketData(mktDataAr, output, checkpoint):
-    try:
-        if len(mktDataAr):
-            if output.endswith('.csv'):
-                outdir = os.path.dirname(output)
-                filename = os.path.basename(output)
-            else:
-                outdir = output
-                filename = 'marketdata.csv'
-            columns = ['Date', 'Ticker', 'FieldId', 'Value']
-            df = pd.DataFrame(mktDataAr, columns=columns)
-            if checkpoint:
-                startTicker = mktDataAr[1][1]
-                endTicker = mktDataAr[-1][1]
-                filename = '%s-%s-%s' % (startTicker, endTicker, filename)
-            if not os.path.exists(outdir):
-                os.makedirs(outdir, 0o755)
-            df.to_csv('%s/%s' % (outdir, filename), header=header)
-            logger.info('wrote file: %s' % filename)
-    except Exception as ex:
-        logger.error('Error saving file: %s\n%r' % (filename, ex))
\ No newline at end of file
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+'''
+Local stand-in for the parts of blpapi used by bloombergReader
+
+Sessions answer ReferenceDataRequest and HistoricalDataRequest with deterministic made up
+values after a simulated round trip, LATENCY seconds plus ROW_COST per row.  Requests sent
+together are worked on concurrently, up to CONCURRENCY of them per session with the others
+queued behind them the way the real service queues a session's requests.  A request of more than
+MAX_POINTS data points fails with a RequestFailure status after the time it would have taken,
+as an oversized request times out on the real service.  This makes it possible to exercise the
+readers and measure the effect of pipelining and batching on a machine without a terminal:
+
+    import fakeBlpapi
+    fakeBlpapi.install(latency=0.05)
+    import bloombergReader as blp
+'''
+import sys
+import zlib
+import time
+import heapq
+import itertools
+import threading
+import datetime as dt
+
+LATENCY = 0.05
+ROW_COST = 0.0
+# roughly one in MISSING_RATE (ticker, field, date) values is left out of a response
+MISSING_RATE = 11
+# requests of a session worked on at once, None for no limit
+CONCURRENCY = None
+# largest request in data points (tickers x fields x dates) answered, None for no limit
+MAX_POINTS = None
+
+STATS = {'requests': 0, 'events': 0, 'maxInFlight': 0, 'failed': 0}
+
+
+def configure(latency=None, rowCost=None, maxPoints=False, concurrency=False):
+    global LATENCY, ROW_COST, MAX_POINTS, CONCURRENCY
+    if latency is not None:
+        LATENCY = latency
+    if rowCost is not None:
+        ROW_COST = rowCost
+    if maxPoints is not False:
+        MAX_POINTS = maxPoints
+    if concurrency is not False:
+        CONCURRENCY = concurrency
+
+
+def install(latency=None, rowCost=None, maxPoints=False, concurrency=False):
+    ## make "import blpapi" resolve to this module
+    configure(latency, rowCost, maxPoints, concurrency)
+    module = sys.modules[__name__]
+    sys.modules['blpapi'] = module
+    return module
+
+
+def resetStats():
+    for key in STATS:
+        STATS[key] = 0
+
+
+class Name(str):
+    ## a str so Names hash and compare at C speed the way interned blpapi Names do
+    def __repr__(self):
+        return 'Name(%r)' % str(self)
+
+
+class CorrelationId(object):
+    _counter = itertools.count(1 << 32)
+
+    def __init__(self, value=None):
+        self._value = next(self._counter) if value is None else value
+
+    def value(self):
+        return self._value
+
+    def __hash__(self):
+        return hash(self._value)
+
+    def __eq__(self, other):
+        return isinstance(other, CorrelationId) and self._value == other._value
+
+    def __repr__(self):
+        return 'CorrelationId(%r)' % (self._value,)
+
+
+class Element(object):
+    ## value is a list for arrays, a list of Elements for sequences, anything else is a scalar
+    def __init__(self, name, value, isArray=False):
+        self._name = Name(name)
+        self._value = value
+        self._isArray = isArray
+        self._children = None if isArray or not isinstance(value, list) else dict((str(e.name()), e) for e in value)
+
+    def name(self):
+        return self._name
+
+    def isArray(self):
+        return self._isArray
+
+    def isNull(self):
+        return self._value is None
+
+    def numValues(self):
+        return len(self._value) if self._isArray else 1
+
+    def numElements(self):
+        return len(self._children) if self._children is not None else 0
+
+    def values(self):
+        return iter(self._value) if self._isArray else iter([self._value])
+
+    def elements(self):
+        return iter(self._value) if self._children is not None else iter([])
+
+    def getValue(self, index=0):
+        return self._value[index] if self._isArray else self._value
+
+    def getElement(self, name):
+        try:
+            return self._children[str(name)]
+        except (KeyError, TypeError):
+            raise KeyError('no element %s in %s' % (name, self._name))
+
+    def hasElement(self, name, excludeNullElements=False):
+        return self._children is not None and str(name) in self._children
+
+    def getElementValue(self, name):
+        return self.getElement(name).getValue()
+
+    def getElementAsString(self, name):
+        return str(self.getElementValue(name))
+
+    def __str__(self):
+        if self._isArray:
+            return '%s[] = {%s}' % (self._name, ', '.join(str(v) for v in self._value))
+        if self._children is not None:
+            return '%s = {%s}' % (self._name, ' '.join(str(e) for e in self._value))
+        return '%s = %s' % (self._name, self._value)
+
+
+class Message(object):
+    def __init__(self, messageType, cid, element):
+        self._type = Name(messageType)
+        self._cid = cid
+        self._element = element
+
+    def messageType(self):
+        return self._type
+
+    def correlationIds(self):
+        return [self._cid] if self._cid is not None else []
+
+    def asElement(self):
+        return self._element
+
+    def getElement(self, name):
+        return self._element.getElement(name)
+
+    def hasElement(self, name, excludeNullElements=False):
+        return self._element.hasElement(name, excludeNullElements)
+
+    def __str__(self):
+        return str(self._element)
+
+
+class Event(object):
+    ADMIN = 1
+    SESSION_STATUS = 2
+    SUBSCRIPTION_STATUS = 3
+    REQUEST_STATUS = 4
+    RESPONSE = 5
+    PARTIAL_RESPONSE = 6
+    SUBSCRIPTION_DATA = 8
+    SERVICE_STATUS = 9
+    TIMEOUT = 10
+
+    def __init__(self, eventType, messages=()):
+        self._type = eventType
+        self._messages = list(messages)
+
+    def eventType(self):
+        return self._type
+
+    def __iter__(self):
+        return iter(self._messages)
+
+
+class SessionOptions(object):
+    def __init__(self):
+        self.host = 'localhost'
+        self.port = 8194
+
+    def setServerHost(self, host):
+        self.host = host
+
+    def setServerPort(self, port):
+        self.port = port
+
+
+class Request(object):
+    def __init__(self, requestType):
+        self.requestType = requestType
+        self.params = {}
+
+    def append(self, name, value):
+        self.params.setdefault(str(name), []).append(value)
+
+    def set(self, name, value):
+        self.params[str(name)] = value
+
+    def get(self, name, default=None):
+        return self.params.get(name, default)
+
+
+class Service(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def createRequest(self, requestType):
+        return Request(requestType)
+
+
+def fakeValue(ticker, field, date):
+    ## deterministic price-like value, a date for *_DT fields, None for the values left out of the response
+    h = zlib.crc32(('%s|%s|%s' % (ticker, field, date)).encode())
+    if h % MISSING_RATE == 0:
+        return None
+    if field.endswith('_DT'):
+        return date - dt.timedelta(h % 30)
+    return round(10.0 + (h % 100000) / 100.0, 2)
+
+
+def businessDays(start, end, periodicity):
+    start = dt.datetime.strptime(start, '%Y%m%d').date()
+    end = dt.datetime.strptime(end, '%Y%m%d').date()
+    days = [start + dt.timedelta(n) for n in range((end - start).days + 1)]
+    days = [d for d in days if d.weekday() < 5]
+    if periodicity == 'MONTHLY':
+        days = [d for d, n in zip(days, days[1:] + [None]) if n is None or n.month != d.month]
+    elif periodicity == 'WEEKLY':
+        days = [d for d, n in zip(days, days[1:] + [None]) if n is None or n.isocalendar()[1] != d.isocalendar()[1]]
+    return days
+
+
+def referenceResponse(request, cid):
+    today = dt.date.today()
+    securities = []
+    for ticker in request.get('securities', []):
+        fieldData = []
+        for field in request.get('fields', []):
+            value = today if field == 'LAST_UPDATE_DT' else fakeValue(ticker, field, today)
+            if value is not None:
+                fieldData.append(Element(field, value))
+        securities.append(Element('securityData', [Element('security', ticker), Element('fieldData', fieldData)]))
+    element = Element('ReferenceDataResponse', [Element('securityData', securities, isArray=True)])
+    return [(Event.RESPONSE, [Message('ReferenceDataResponse', cid, element)])], len(securities)
+
+
+def historicalResponse(request, cid):
+    ## one message per security, the last one in the RESPONSE event
+    days = businessDays(request.get('startDate'), request.get('endDate'), request.get('periodicitySelection', 'DAILY'))
+    fields = request.get('fields', [])
+    events = []
+    rows = 0
+    tickers = request.get('securities', [])
+    for seq, ticker in enumerate(tickers):
+        fieldData = []
+        for day in days:
+            values = [Element('date', day)]
+            for field in fields:
+                value = fakeValue(ticker, field, day)
+                if value is not None:
+                    values.append(Element(field, value))
+            fieldData.append(Element('fieldData', values))
+        rows += len(days) * len(fields)
+        securityData = Element('securityData', [Element('security', ticker),
+                                                Element('sequenceNumber', seq),
+                                                Element('fieldData', fieldData, isArray=True)])
+        element = Element('HistoricalDataResponse', [securityData])
+        eventType = Event.RESPONSE if seq == len(tickers) - 1 else Event.PARTIAL_RESPONSE
+        events.append((eventType, [Message('HistoricalDataResponse', cid, element)]))
+    return events, rows
+
+
+def requestPoints(request):
+    points = len(request.get('securities', [])) * len(request.get('fields', []))
+    if request.requestType == 'HistoricalDataRequest':
+        points *= len(businessDays(request.get('startDate'), request.get('endDate'), request.get('periodicitySelection', 'DAILY')))
+    return points
+
+
+def failureResponse(cid, points):
+    reason = Element('reason', [Element('source', 'fake'), Element('category', 'TIMEOUT'),
+                                Element('message', 'request of %s points exceeds %s' % (points, MAX_POINTS))])
+    return [(Event.REQUEST_STATUS, [Message('RequestFailure', cid, Element('RequestFailure', [reason]))])]
+
+
+class Session(object):
+    def __init__(self, options=None, eventHandler=None):
+        self.options = options or SessionOptions()
+        self._events = []
+        self._seq = itertools.count()
+        self._inFlight = 0
+        ## times at which each of the CONCURRENCY request slots is free again
+        self._slots = []
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        self._started = True
+        return True
+
+    def stop(self):
+        ## the requests still queued are dropped and the session reports it is terminated
+        with self._cond:
+            self._started = False
+            self._events = [(time.time(), next(self._seq), Event.SESSION_STATUS,
+                             [Message('SessionTerminated', None, Element('SessionTerminated', []))])]
+            self._inFlight = 0
+            self._cond.notify_all()
+        return True
+
+    def openService(self, name):
+        return self._started
+
+    def getService(self, name):
+        return Service(name)
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=''):
+        cid = correlationId if correlationId is not None else CorrelationId()
+        points = requestPoints(request)
+        if MAX_POINTS is not None and points > MAX_POINTS:
+            events, rows = failureResponse(cid, points), points
+            STATS['failed'] += 1
+        elif request.requestType == 'HistoricalDataRequest':
+            events, rows = historicalResponse(request, cid)
+        else:
+            events, rows = referenceResponse(request, cid)
+        with self._cond:
+            start = time.time()
+            if CONCURRENCY:
+                if len(self._slots) >= CONCURRENCY:
+                    start = max(start, heapq.heappop(self._slots))
+            ready = start + LATENCY + rows * ROW_COST
+            if CONCURRENCY:
+                heapq.heappush(self._slots, ready)
+            for eventType, messages in events:
+                heapq.heappush(self._events, (ready, next(self._seq), eventType, messages))
+            self._inFlight += 1
+            STATS['requests'] += 1
+            STATS['maxInFlight'] = max(STATS['maxInFlight'], self._inFlight)
+            self._cond.notify_all()
+        return cid
+
+    def nextEvent(self, timeout=0):
+        deadline = time.time() + timeout / 1000.0 if timeout else None
+        with self._cond:
+            while True:
+                now = time.time()
+                if self._events and self._events[0][0] <= now:
+                    _, _, eventType, messages = heapq.heappop(self._events)
+                    if eventType in (Event.RESPONSE, Event.REQUEST_STATUS):
+                        self._inFlight -= 1
+                    STATS['events'] += 1
+                    return Event(eventType, messages)
+                wait = self._events[0][0] - now if self._events else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return Event(Event.TIMEOUT)
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._cond.wait(wait)
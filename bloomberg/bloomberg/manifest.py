@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+'''
+Append-only manifest of the completed work units of a checkpointed Bloomberg pull
+
+Every (ticker chunk, field chunk, date range) request whose rows are safely on disk gets one
+JSON line with its output file and row count, written and fsynced once the file it went to is
+complete.  Completion is keyed per ticker within the field chunk and date range, so a restart
+reads the manifest, not the data, and drops exactly the work already recorded whatever order it
+finished in and however the tickers were batched; units that returned no rows are recorded too
+so they are not asked for again.  A line torn by a crash is ignored and that unit is repeated.
+'''
+import os
+import json
+import hashlib
+import logging
+import datetime as dt
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.jsonl'
+
+
+def unitKey(ticker, fields, startdate, enddate, periodicity):
+    ## a reference request is a snapshot, so the same securities and fields on another day are new work
+    asof = enddate if startdate else str(dt.date.today())
+    unit = [ticker, list(fields), startdate, asof, periodicity]
+    return hashlib.sha1(json.dumps(unit).encode()).hexdigest()
+
+
+def requestKeys(request):
+    return [unitKey(ticker, request.fields, request.startdate, request.enddate, request.periodicity) for ticker in request.tickers]
+
+
+class Manifest(object):
+    def __init__(self, outdir):
+        self.path = os.path.join(outdir, MANIFEST_FILE)
+        self.completed = set()
+        torn = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    torn = not line.endswith('\n')
+                    try:
+                        self.completed.update(json.loads(line)['keys'])
+                    except (ValueError, KeyError):
+                        logger.warning('ignoring incomplete manifest line in %s' % self.path)
+        if torn:
+            ## end the torn line, or the next record would be appended to it and lost with it
+            with open(self.path, 'a') as f:
+                f.write('\n')
+
+    def isComplete(self, ticker, fields, startdate, enddate, periodicity):
+        return unitKey(ticker, fields, startdate, enddate, periodicity) in self.completed
+
+    def pending(self, requests):
+        '''
+        the requests trimmed to the tickers not yet completed, dropping those with none left, with
+        last recomputed for the ticker chunks that remain
+        '''
+        todo = []
+        for request in requests:
+            keys = requestKeys(request)
+            if any(key in self.completed for key in keys):
+                request.tickers = [ticker for ticker, key in zip(request.tickers, keys) if key not in self.completed]
+            if request.tickers:
+                todo.append(request)
+        for request, following in zip(todo, todo[1:] + [None]):
+            request.last = following is None or following.tickers != request.tickers
+        if len(todo) < len(requests):
+            logger.info('resuming from manifest: %s of %s requests already completed' % (len(requests) - len(todo), len(requests)))
+        return todo
+
+    def record(self, units, filename):
+        ## units is a list of (request, rows) now on disk in filename
+        lines = []
+        for request, rows in units:
+            keys = requestKeys(request)
+            self.completed.update(keys)
+            lines.append(json.dumps({'keys': keys,
+                                     'tickers': list(request.tickers),
+                                     'fields': list(request.fields),
+                                     'startdate': request.startdate,
+                                     'enddate': request.enddate,
+                                     'file': os.path.basename(filename) if filename else None,
+                                     'rows': rows,
+                                     'time': dt.datetime.now().isoformat()}))
+        with open(self.path, 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
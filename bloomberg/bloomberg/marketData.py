@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+'''
+Column buffers and streaming writers for downloaded Bloomberg data
+
+The readers append each (date, ticker, field, value) into a MarketDataBuffer: dates, tickers
+and fields are dictionary coded into int arrays, numeric values go to a float array and the few
+text values are kept aside by row, so a buffer costs a few bytes per value instead of a Python
+list.  Date valued fields are dictionary coded as they arrive and converted to epoch seconds
+in one batch, one conversion per distinct date, when the buffer is flushed.  MarketDataStore flushes the buffers in batches of FLUSH_ROWS to compressed Parquet or
+Feather (Arrow IPC) files, one file per ticker chunk when checkpointing, so memory stays bounded
+during long pulls.  CSV is still available.  Every format is written with the same Date, Ticker,
+Field, Value, Text columns: Value holds the numbers and date values as epoch seconds, Text the
+text values, and readMarketData returns that frame whichever format a file has.
+'''
+import os
+import glob
+import logging
+import datetime as dt
+import numpy as np
+import pandas as pd
+from array import array
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ['Date', 'Ticker', 'Field', 'Value']
+# columns of the files written, in every format
+FILE_COLUMNS = COLUMNS + ['Text']
+FORMATS = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
+FORMAT = 'parquet'
+COMPRESSION = 'zstd'
+FLUSH_ROWS = 1000000
+FILENAME = 'marketdata'
+
+
+class MarketDataBuffer(object):
+    def __init__(self):
+        self.dates = array('i')
+        self.tickers = array('i')
+        self.fields = array('i')
+        self.values = array('d')
+        self.textRows = array('q')
+        self.textValues = []
+        self.epochRows = array('q')
+        self.epochs = array('i')
+        self.epochCodes = {}
+        self.dateCodes = {}
+        self.tickerCodes = {}
+        self.fieldCodes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, date, ticker, field, value):
+        dates = self.dateCodes
+        tickers = self.tickerCodes
+        fields = self.fieldCodes
+        self.dates.append(dates.setdefault(date, len(dates)))
+        self.tickers.append(tickers.setdefault(ticker, len(tickers)))
+        self.fields.append(fields.setdefault(field, len(fields)))
+        if isinstance(value, (int, float)):
+            self.values.append(value)
+        elif isinstance(value, dt.date):
+            epochs = self.epochCodes
+            self.epochRows.append(len(self.values))
+            self.epochs.append(epochs.setdefault(value, len(epochs)))
+            self.values.append(np.nan)
+        else:
+            self.textRows.append(len(self.values))
+            self.textValues.append(value)
+            self.values.append(np.nan)
+
+    def extend(self, other):
+        offset = len(self)
+        for name in ('dates', 'tickers', 'fields'):
+            mine, theirs = getattr(self, name[:-1] + 'Codes'), getattr(other, name[:-1] + 'Codes')
+            remap = np.array([mine.setdefault(key, len(mine)) for key in theirs], dtype=np.int32)
+            codes = np.frombuffer(getattr(other, name), dtype=np.int32)
+            getattr(self, name).frombytes(remap[codes].tobytes() if len(remap) else b'')
+        self.values.extend(other.values)
+        self.textRows.extend(row + offset for row in other.textRows)
+        self.textValues.extend(other.textValues)
+        if other.epochRows:
+            remap = np.array([self.epochCodes.setdefault(key, len(self.epochCodes)) for key in other.epochCodes], dtype=np.int32)
+            self.epochs.frombytes(remap[np.frombuffer(other.epochs, dtype=np.int32)].tobytes())
+            self.epochRows.extend(row + offset for row in other.epochRows)
+
+    def resolveDates(self):
+        ## date values to epoch seconds, as calendar.timegm gives, converting each distinct date once
+        if self.epochRows:
+            keys = np.array(list(self.epochCodes), dtype='datetime64[s]').astype(np.int64)
+            values = np.frombuffer(self.values, dtype=float)
+            values[np.frombuffer(self.epochRows, dtype=np.int64)] = keys[np.frombuffer(self.epochs, dtype=np.int32)]
+            self.epochRows = array('q')
+            self.epochs = array('i')
+            self.epochCodes = {}
+
+    def decode(self, name):
+        ## expand a dictionary coded column, the dictionary itself is converted once
+        codes = np.frombuffer(getattr(self, name), dtype=np.int32)
+        keys = list(getattr(self, name[:-1] + 'Codes'))
+        if name == 'dates':
+            return pd.DatetimeIndex(pd.to_datetime(keys)).values[codes] if keys else np.array([], dtype='datetime64[ns]')
+        return np.array(keys, dtype=object)[codes] if keys else np.array([], dtype=object)
+
+    def text(self):
+        text = np.full(len(self), None, dtype=object)
+        if self.textValues:
+            text[np.frombuffer(self.textRows, dtype=np.int64)] = [str(value) for value in self.textValues]
+        return text
+
+    def toFrame(self):
+        ## Date, Ticker, Field, Value with the text values merged into Value
+        self.resolveDates()
+        values = np.frombuffer(self.values, dtype=float).copy()
+        if self.textValues:
+            values = values.astype(object)
+            values[np.frombuffer(self.textRows, dtype=np.int64)] = self.textValues
+        return pd.DataFrame({'Date': self.decode('dates'),
+                             'Ticker': self.decode('tickers'),
+                             'Field': self.decode('fields'),
+                             'Value': values}, columns=COLUMNS)
+
+    def toColumns(self):
+        ## the FILE_COLUMNS arrays, text values in Text with a nan Value
+        self.resolveDates()
+        return [self.decode('dates'), self.decode('tickers'), self.decode('fields'),
+                np.frombuffer(self.values, dtype=float), self.text()]
+
+    def toArrow(self):
+        import pyarrow as pa
+        types = [pa.timestamp('ns'), pa.string(), pa.string(), pa.float64(), pa.string()]
+        return pa.Table.from_arrays([pa.array(column, type=t) for column, t in zip(self.toColumns(), types)], names=FILE_COLUMNS)
+
+
+class MarketDataWriter(object):
+    '''
+    streams buffers into a single file, parquet row groups, feather record batches or csv appends;
+    the file is written under a temporary name and renamed into place on close, which raises
+    FileExistsError rather than replace a file when overwrite is off
+    '''
+    def __init__(self, path, fmt=FORMAT, compression=COMPRESSION, overwrite=True):
+        self.path = path
+        self.fmt = fmt
+        self.compression = compression
+        self.overwrite = overwrite
+        self.tmp = path + '.tmp'
+        self.rows = 0
+        self.writer = None
+
+    def write(self, buffer):
+        if not len(buffer):
+            return
+        if self.fmt == 'csv':
+            df = pd.DataFrame(dict(zip(FILE_COLUMNS, buffer.toColumns())), columns=FILE_COLUMNS)
+            df.to_csv(self.tmp, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        else:
+            table = buffer.toArrow()
+            if self.writer is None:
+                self.writer = self.open(table.schema)
+            self.writer.write_table(table)
+        self.rows += len(buffer)
+
+    def open(self, schema):
+        import pyarrow as pa
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(self.tmp, schema, compression=self.compression)
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        return pa.ipc.new_file(self.tmp, schema, options=options)
+
+    def closeWriter(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def abort(self):
+        self.closeWriter()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def close(self):
+        self.closeWriter()
+        if self.rows:
+            if not self.overwrite and os.path.exists(self.path):
+                raise FileExistsError('%s already exists, its rows are left in %s' % (self.path, self.tmp))
+            os.replace(self.tmp, self.path)
+            logger.info('wrote file: %s rows: %s' % (os.path.basename(self.path), self.rows))
+
+
+def splitOutput(output, fmt=None):
+    ## (directory, filename, format) from an output file or directory
+    base, ext = os.path.splitext(output)
+    for name, suffix in FORMATS.items():
+        if ext == suffix:
+            return os.path.dirname(output), os.path.basename(output), name
+    fmt = fmt or FORMAT
+    return output, FILENAME + FORMATS[fmt], fmt
+
+
+class MarketDataStore(object):
+    '''
+    output of a download: one file for the whole pull, or when checkpointing one file per ticker
+    chunk named after its first and last ticker, completed only once the chunk is
+    '''
+    def __init__(self, output, checkpoint=False, fmt=None, flushRows=FLUSH_ROWS, filename=None, numbered=False):
+        self.outdir, self.filename, self.fmt = splitOutput(output, fmt)
+        self.filename = filename or self.filename
+        # number the partitions when the same ticker chunk can occur more than once in a run; the
+        # file names are then those of one run and an existing file is never replaced
+        self.numbered = numbered
+        self.partitions = 0
+        self.checkpoint = checkpoint
+        self.flushRows = flushRows
+        self.buffer = MarketDataBuffer()
+        self.writer = None
+        self.files = []
+        self.lastFile = None
+        if self.outdir and not os.path.exists(self.outdir):
+            os.makedirs(self.outdir, 0o755)
+
+    def partitionPath(self, tickers):
+        filename = '%s-%s-%s' % (tickers[0], tickers[-1], self.filename) if self.checkpoint else self.filename
+        if self.checkpoint and self.numbered:
+            filename = '%04d-%s' % (self.partitions, filename)
+        self.partitions += 1
+        return os.path.join(self.outdir, filename)
+
+    def append(self, buffer, tickers, last=False):
+        if self.writer is None:
+            self.writer = MarketDataWriter(self.partitionPath(tickers), self.fmt, overwrite=not self.numbered)
+        self.buffer.extend(buffer)
+        if len(self.buffer) >= self.flushRows:
+            self.flush()
+        if last and self.checkpoint:
+            self.closePartition()
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.write(self.buffer)
+        self.buffer = MarketDataBuffer()
+
+    def closePartition(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.lastFile = self.writer.path if self.writer.rows else None
+            if self.lastFile:
+                self.files.append(self.lastFile)
+            self.writer = None
+
+    def close(self):
+        self.closePartition()
+
+    def abort(self):
+        ## stop without completing the current partition, its rows are read again on restart
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+
+def readFile(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.feather'):
+        return pd.read_feather(path)
+    df = pd.read_csv(path, parse_dates=['Date'], dtype={'Ticker': object, 'Field': object, 'Text': object})
+    df['Text'] = df.Text.where(df.Text.notnull(), None)
+    return df
+
+
+def readMarketData(output, fmt=None):
+    ## load a file, or every completed file of the format in a directory, back into one frame
+    if os.path.isfile(output):
+        return readFile(output)
+    files = sorted(glob.glob(os.path.join(output, '*' + FORMATS[fmt or FORMAT])))
+    if not files:
+        return pd.DataFrame(columns=FILE_COLUMNS)
+    return pd.concat([readFile(f) for f in files], ignore_index=True)
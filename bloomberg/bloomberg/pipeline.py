@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+'''
+Pipelined Bloomberg requests
+
+RequestPipeline keeps up to inFlight requests outstanding on each session, every request sent
+with its own correlation id, and dispatches the messages of each event to the request they
+belong to as they arrive.  Each session is driven by its own thread; the requests are handed
+out from a shared queue so a slow response on one session does not hold up the others.
+Completed requests are yielded in request order, so callers see the same sequence of results
+as the sequential reader and checkpoint files still end on a complete ticker list.  Requests
+are drawn lazily, so a planner can size later requests from the responses already seen, and
+no more than window requests past the next one to yield are drawn, which bounds the responses
+held for reordering.  A session that reports it is down, or that answers none of its requests
+for responseTimeout seconds, fails the requests it holds and takes no more.
+'''
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+
+import blpapi
+
+## journal is shared with the sibling backtests package
+BACKTESTS = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backtests'))
+if BACKTESTS not in sys.path:
+    sys.path.append(BACKTESTS)
+import journal
+from marketData import MarketDataBuffer
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT = 4
+EVENT_TIMEOUT = 500
+# requests drawn past the next one to yield, at least every request in flight
+WINDOW = 64
+# seconds without an event for any request in flight before a session is given up on
+RESPONSE_TIMEOUT = 600.0
+SESSION_DOWN = (blpapi.Name('SessionTerminated'), blpapi.Name('SessionConnectionDown'), blpapi.Name('SessionStartupFailure'))
+
+
+# returned by nextRequest when the window is drawn
+FULL = object()
+
+
+class SessionDown(Exception):
+    pass
+
+
+class RequestPipeline(object):
+    def __init__(self, sessions, inFlight=IN_FLIGHT, timeout=EVENT_TIMEOUT, window=WINDOW, responseTimeout=RESPONSE_TIMEOUT):
+        self.sessions = sessions
+        self.inFlight = max(inFlight, 1)
+        self.timeout = timeout
+        self.window = max(window, self.inFlight * len(sessions))
+        self.responseTimeout = responseTimeout
+
+    def run(self, requests):
+        '''
+        generator of (request, MarketDataBuffer) in the order requests yields them; requests may be a
+        lazy iterable, it is drawn from as sessions have room.  Each request needs create(session),
+        names and parse(msg, names, rows) as BloombergRequest has; sent, elapsed and error are set on it
+        '''
+        source = iter(requests)
+        cond = threading.Condition()
+        ## requests drawn, the order of the next one to yield, and whether the caller went away
+        counter = [0]
+        expected = [0]
+        stopped = [False]
+
+        def nextRequest(wait):
+            ## (order, request) drawn under the lock so the order matches the iterable; FULL when
+            ## the window is drawn and wait is off, None when there are no more requests
+            with cond:
+                while counter[0] >= expected[0] + self.window and not stopped[0]:
+                    if not wait:
+                        return FULL
+                    cond.wait()
+                request = None if stopped[0] else next(source, None)
+                if request is None:
+                    return None
+                counter[0] += 1
+                return counter[0] - 1, request
+
+        done = queue.Queue()
+        workers = [threading.Thread(target=self.worker, args=(session, nextRequest, done), daemon=True) for session in self.sessions]
+        for worker in workers:
+            worker.start()
+
+        ## reorder buffer: hold responses that overtook an earlier request, at most window of them
+        buffered = {}
+        running = len(workers)
+        try:
+            while running or buffered:
+                if expected[0] in buffered:
+                    item = buffered.pop(expected[0])
+                    with cond:
+                        expected[0] += 1
+                        cond.notify_all()
+                    yield item
+                    continue
+                if not running:
+                    raise RuntimeError('Bloomberg pipeline stopped before request %s completed' % expected[0])
+                item = done.get()
+                if item is None:
+                    running -= 1
+                else:
+                    buffered[item[0]] = item[1:]
+        finally:
+            with cond:
+                stopped[0] = True
+                cond.notify_all()
+
+    def worker(self, session, nextRequest, done):
+        pending = {}
+        exhausted = False
+        try:
+            while True:
+                ## top up the requests in flight on this session, waiting for the window only when idle
+                while not exhausted and len(pending) < self.inFlight:
+                    item = nextRequest(not pending)
+                    if item is FULL:
+                        break
+                    if item is None:
+                        exhausted = True
+                        break
+                    if not pending:
+                        heard = time.time()
+                    self.send(session, item[0], item[1], pending)
+                if not pending:
+                    return
+                if self.dispatch(session.nextEvent(self.timeout), pending, done):
+                    heard = time.time()
+                elif time.time() - heard > self.responseTimeout:
+                    raise SessionDown('no response in %ss' % self.responseTimeout)
+        except Exception as ex:
+            if not isinstance(ex, SessionDown):
+                logger.exception('Bloomberg pipeline worker failed: %r' % ex)
+            self.fail(pending, done, ex)
+        finally:
+            done.put(None)
+
+    def fail(self, pending, done, ex):
+        ## the requests a dead session holds are completed with an error, the caller sees them in order
+        for order in sorted(pending):
+            request = pending[order][1]
+            request.error = 'Bloomberg session failed: %s' % ex
+            request.elapsed = time.time() - request.sent
+            logger.error('Bloomberg request %s: %s' % (request.seq, request.error))
+            done.put(pending.pop(order))
+
+    def send(self, session, order, request, pending):
+        request.error = None
+        request.sent = time.time()
+        session.sendRequest(request.create(session), correlationId=blpapi.CorrelationId(order))
+        pending[order] = (order, request, MarketDataBuffer())
+        journal.event('request', seq=request.seq, order=order, tickers=len(request.tickers), fields=len(request.fields), inFlight=len(pending))
+
+    def dispatch(self, ev, pending, done):
+        ## True when the event had a message for a request in flight
+        heard = False
+        final = ev.eventType() in (blpapi.Event.RESPONSE, blpapi.Event.REQUEST_STATUS)
+        for msg in ev:
+            if ev.eventType() == blpapi.Event.SESSION_STATUS and msg.messageType() in SESSION_DOWN:
+                raise SessionDown(msg.messageType())
+            for cid in msg.correlationIds():
+                entry = pending.get(cid.value())
+                if entry is None:
+                    continue
+                order, request, rows = entry
+                heard = True
+                if ev.eventType() == blpapi.Event.REQUEST_STATUS:
+                    request.error = str(msg)
+                else:
+                    try:
+                        request.parse(msg, request.names, rows)
+                    except Exception as ex:
+                        logger.exception('Error Reading Bloomberg event data: %r' % ex)
+                if final:
+                    request.elapsed = time.time() - request.sent
+                    journal.event('response', seq=request.seq, order=order, rows=len(rows), elapsed=request.elapsed, error=request.error)
+                    done.put(pending.pop(order))
+                else:
+                    journal.event('partial', seq=request.seq, order=order, rows=len(rows))
+        return heard
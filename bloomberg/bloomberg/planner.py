@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+'''
+Adaptive request batching for Bloomberg downloads
+
+Instead of a fixed number of tickers per request, BatchPlanner sizes each batch of tickers so a
+request carries about targetPoints data points (tickers x fields x periods for the periodicity
+and date range), and never less than one ticker.  Until a request fails or times out the target
+grows to GROWTH times the largest completed request; a failed request is split into pieces of
+the target and sent again, and from then on the target is the midpoint between the largest
+completed and the smallest failed request, so the batches settle just under the server limit.
+A request slower than targetSeconds lowers the target in proportion.  The running counts,
+throughput and current target are available from report() for tuning.  The plan is drawn by
+pipeline worker threads while feedback() is called on the reading thread, so the target, the
+retry queue and the counts are only touched under the planner's lock.
+'''
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+TARGET_POINTS = 100000
+MIN_POINTS = 1000
+MAX_POINTS = 5000000
+TARGET_SECONDS = 30.0
+GROWTH = 2.0
+MAX_RETRIES = 3
+
+PERIODS_PER_YEAR = {'WEEKLY': 52, 'MONTHLY': 12, 'QUARTERLY': 4, 'SEMI_ANNUALLY': 2, 'YEARLY': 1}
+
+
+def countPeriods(startdate, enddate, periodicity='DAILY'):
+    ## data points per ticker and field in the range, one for a reference request
+    if not startdate:
+        return 1
+    start = pd.to_datetime(startdate)
+    end = pd.to_datetime(enddate) if enddate else pd.Timestamp.today().normalize()
+    if end < start:
+        return 0
+    periodicity = (periodicity or 'DAILY').upper()
+    if periodicity == 'DAILY':
+        return int(np.busday_count(start.date(), (end + pd.Timedelta(days=1)).date()))
+    years = (end - start).days / 365.25
+    return int(np.ceil(years * PERIODS_PER_YEAR.get(periodicity, 261))) + 1
+
+
+def chunks(l, n):
+    for idx in range(0, len(l), n):
+        yield l[idx:idx + n]
+
+
+class BatchPlanner(object):
+    def __init__(self, targetPoints=TARGET_POINTS, targetSeconds=TARGET_SECONDS, minPoints=MIN_POINTS, maxPoints=MAX_POINTS):
+        self.targetPoints = float(targetPoints)
+        self.targetSeconds = targetSeconds
+        self.minPoints = minPoints
+        self.ceiling = float(maxPoints)
+        ## the largest completed and the smallest failed request, in points
+        self.largest = 0
+        self.smallestFailed = None
+        self.retry = deque()
+        self.lock = threading.Lock()
+        self.started = None
+        self.stats = {'requests': 0, 'completed': 0, 'failed': 0, 'retried': 0, 'rows': 0, 'points': 0, 'requestSeconds': 0.0}
+
+    def tickersPerRequest(self, fields, periods):
+        return max(1, int(self.targetPoints // max(fields * periods, 1)))
+
+    def plan(self, tickers, fields, startdate, enddate, periodicity, fieldLimit, factory):
+        '''
+        generator of requests; each batch of tickers is sized with the target at the time it is
+        taken, so batches planned after a response already follow it.  factory(seq, tickers,
+        fields) builds a request, and the field chunks of a batch end with last set
+        '''
+        self.started = self.started or time.time()
+        periods = countPeriods(startdate, enddate, periodicity)
+        fieldChunks = list(chunks(fields, fieldLimit))
+        width = max(len(chunk) for chunk in fieldChunks) if fieldChunks else 1
+        seq = 0
+        pos = 0
+        while True:
+            ## the retries first, then the next batch; taken under the lock, yielded outside it
+            with self.lock:
+                if self.retry:
+                    batch = [self.retry.popleft()]
+                    batch[0].seq = seq
+                elif pos < len(tickers):
+                    size = self.tickersPerRequest(width, periods)
+                    tickerList = tickers[pos:pos + size]
+                    pos += size
+                    ## last is set before the batch is handed out, a pipelined request may complete at once
+                    batch = [factory(seq + n, tickerList, fieldList) for n, fieldList in enumerate(fieldChunks)]
+                    for request, fieldList in zip(batch, fieldChunks):
+                        request.points = len(tickerList) * len(fieldList) * periods
+                    batch[-1].last = True
+                else:
+                    break
+                seq += len(batch)
+                for request in batch:
+                    self.sent(request)
+            for request in batch:
+                yield request
+
+    def sent(self, request):
+        self.stats['requests'] += 1
+        request.retries = getattr(request, 'retries', 0)
+        return request
+
+    def feedback(self, request, rows):
+        ## adapt the target to a completed request, or split and queue a failed one again
+        with self.lock:
+            self.adapt(request, rows)
+
+    def adapt(self, request, rows):
+        elapsed = getattr(request, 'elapsed', None)
+        points = getattr(request, 'points', 0)
+        if elapsed is not None:
+            self.stats['requestSeconds'] += elapsed
+        if getattr(request, 'error', None):
+            self.stats['failed'] += 1
+            if points:
+                self.smallestFailed = min(self.smallestFailed or points, points)
+                self.ceiling = max(self.minPoints, min(self.ceiling, points - 1))
+                self.targetPoints = min(self.targetPoints, (self.largest + self.smallestFailed) / 2)
+            self.requeue(request)
+        else:
+            self.stats['completed'] += 1
+            self.stats['rows'] += len(rows)
+            self.stats['points'] += points
+            self.largest = max(self.largest, points)
+            if self.smallestFailed is None:
+                ## grown from a size that completed, not from batches still in flight
+                target = max(self.targetPoints, self.largest * GROWTH)
+            else:
+                target = (self.largest + self.smallestFailed) / 2
+            if elapsed and points and elapsed > self.targetSeconds:
+                target = min(target, points * self.targetSeconds / elapsed)
+            self.targetPoints = min(target, self.ceiling)
+        self.targetPoints = max(self.targetPoints, self.minPoints)
+
+    def requeue(self, request):
+        if request.retries >= MAX_RETRIES:
+            logger.error('giving up on Bloomberg request for %s after %s retries: %s' % (request.tickers, request.retries, request.error))
+            return
+        ## pieces of the target lowered by the failure, at least two
+        pieces = min(len(request.tickers), max(2, int(np.ceil(request.points / self.targetPoints))))
+        for tickers in chunks(request.tickers, -(-len(request.tickers) // pieces)):
+            retry = request.split(tickers)
+            retry.points = request.points * len(tickers) // len(request.tickers)
+            retry.retries = request.retries + 1
+            retry.last = True
+            self.retry.append(retry)
+            self.stats['retried'] += 1
+
+    def pending(self):
+        ## failed requests waiting to be sent again
+        with self.lock:
+            return len(self.retry)
+
+    def report(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        with self.lock:
+            stats = dict(self.stats)
+            target = self.targetPoints
+        stats.update({'seconds': elapsed,
+                      'rowsPerSecond': stats['rows'] / elapsed if elapsed else 0.0,
+                      'meanPoints': stats['points'] / stats['completed'] if stats['completed'] else 0.0,
+                      'meanRequestSeconds': stats['requestSeconds'] / stats['requests'] if stats['requests'] else 0.0,
+                      'targetPoints': target})
+        return pd.Series(stats)
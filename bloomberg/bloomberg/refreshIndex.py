@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+'''
+High-water-mark index for incremental Bloomberg refreshes
+
+For every (ticker, field) the index keeps the latest date already stored in the output
+directory.  planRequests starts each historical request on the day after that mark, grouping
+the tickers that share a start date and field list into the usual ticker and field chunks, so a
+nightly refresh only asks for the days since the last run.  The index lives next to the data as
+a small JSON file per periodicity and is only advanced once the rows it covers are on disk.
+'''
+import os
+import json
+import logging
+import itertools
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'hwm-%s.json'
+
+
+def chunks(l, n):
+    for idx in range(0, len(l), n):
+        yield l[idx:idx + n]
+
+
+class HighWaterMarks(object):
+    def __init__(self, outdir, periodicity='DAILY'):
+        self.path = os.path.join(outdir, INDEX_FILE % periodicity.upper())
+        self.marks = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.marks = json.load(f)['marks']
+        self.pending = {}
+
+    def get(self, ticker, field):
+        mark = self.marks.get(ticker, {}).get(field)
+        return pd.Timestamp(mark) if mark else None
+
+    def observe(self, buffer, tickers, fields, startdate, enddate):
+        '''
+        marks from a completed request, held until commit: every requested (ticker, field) is
+        complete up to the end of the range, capped at yesterday as today's values may still
+        change, and further up to the latest date it has a row for
+        '''
+        final = min(pd.Timestamp(enddate), pd.Timestamp.today().normalize() - pd.Timedelta(days=1))
+        if final >= pd.Timestamp(startdate):
+            final = str(final.date())
+            for ticker in tickers:
+                marks = self.pending.setdefault(ticker, {})
+                for field in fields:
+                    if final > marks.get(field, ''):
+                        marks[field] = final
+        if not len(buffer):
+            return
+        dates = buffer.decode('dates')
+        key = np.frombuffer(buffer.tickers, dtype=np.int32).astype(np.int64) * len(buffer.fieldCodes) + np.frombuffer(buffer.fields, dtype=np.int32)
+        order = np.lexsort((dates, key))
+        last = np.flatnonzero(np.append(key[order][1:] != key[order][:-1], True))
+        tickerKeys = list(buffer.tickerCodes)
+        fieldKeys = list(buffer.fieldCodes)
+        for k, date in zip(key[order][last], dates[order][last]):
+            ticker, field = tickerKeys[k // len(fieldKeys)], fieldKeys[k % len(fieldKeys)]
+            mark = str(pd.Timestamp(date).date())
+            marks = self.pending.setdefault(ticker, {})
+            if mark > marks.get(field, ''):
+                marks[field] = mark
+
+    def commit(self):
+        ## advance the marks to the rows now on disk and save the index atomically
+        for ticker, marks in self.pending.items():
+            current = self.marks.setdefault(ticker, {})
+            for field, mark in marks.items():
+                if mark > current.get(field, ''):
+                    current[field] = mark
+        self.pending = {}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'marks': self.marks}, f)
+        os.replace(tmp, self.path)
+
+
+def planRequests(marks, tickers, fields, startdate, enddate, periodicity, tickerRange, fieldLimit, factory, planner=None):
+    '''
+    requests for the dates after each (ticker, field) mark; tickers with the same start date and
+    fields are chunked together, factory(seq, tickers, fields, startdate) builds each request.
+    With a BatchPlanner the groups are batched by it and the requests are generated lazily
+    '''
+    start = pd.to_datetime(startdate)
+    end = pd.to_datetime(enddate)
+    groups = OrderedDict()
+    skipped = 0
+    for ticker in tickers:
+        byStart = OrderedDict()
+        for field in fields:
+            mark = marks.get(ticker, field)
+            first = max(start, mark + pd.Timedelta(days=1)) if mark is not None else start
+            if first <= end:
+                byStart.setdefault(first, []).append(field)
+            else:
+                skipped += 1
+        for first, fieldList in byStart.items():
+            groups.setdefault((first, tuple(fieldList)), []).append(ticker)
+
+    if planner:
+        logger.info('incremental refresh: %s groups, %s (ticker, field) pairs already up to date' % (len(groups), skipped))
+        return itertools.chain.from_iterable(
+            planner.plan(tickerGroup, list(fieldList), first, enddate, periodicity, fieldLimit,
+                         lambda seq, tickerList, fieldChunk, first=first: factory(seq, tickerList, fieldChunk, first.strftime('%Y%m%d')))
+            for (first, fieldList), tickerGroup in groups.items())
+
+    requests = []
+    for (first, fieldList), tickerGroup in groups.items():
+        for tickerList in chunks(tickerGroup, tickerRange or len(tickerGroup)):
+            for fieldChunk in chunks(list(fieldList), fieldLimit):
+                requests.append(factory(len(requests), tickerList, fieldChunk, first.strftime('%Y%m%d')))
+            requests[-1].last = True
+    logger.info('incremental refresh: %s requests in %s groups, %s (ticker, field) pairs already up to date' % (len(requests), len(groups), skipped))
+    return requests
@@ -0,0 +1,65 @@
+import calendar
+import datetime as dt
+import pandas as pd
+
+import fakeBlpapi
+import bloombergReader as blp
+from benchDecode import legacyHistorical, recordMessages
+from marketData import MarketDataBuffer
+
+FIELDS = ['FIELD_%02d' % n for n in range(20)] + ['FIELD_%02d_DT' % n for n in range(4)]
+KEY = ['Date', 'Ticker', 'Field']
+
+
+def legacyReference(msg, fields, mktDataAr):
+    ## the reference decode loop before the Name based one: a getElement per requested field,
+    ## the first is the date, date values converted to epoch one at a time
+    securityDataArray = msg.getElement(blp.SECURITY_DATA)
+    for securityData in securityDataArray.values():
+        dateField = None
+        ticker = securityData.getElementAsString(blp.SECURITY)
+        fieldData = securityData.getElement(blp.FIELD_DATA)
+        for field in fields:
+            if fieldData.hasElement(field, True):
+                fieldValue = fieldData.getElementValue(field)
+                if not dateField:
+                    dateField = fieldValue
+                else:
+                    if isinstance(fieldValue, dt.date):
+                        fieldValue = calendar.timegm(fieldValue.timetuple())
+                    mktDataAr.add(dateField, ticker, field, fieldValue)
+
+
+def decode(messages, parse, fields):
+    rows = MarketDataBuffer()
+    for msg in messages:
+        parse(msg, fields, rows)
+    return rows.toFrame().sort_values(KEY).reset_index(drop=True)
+
+
+def referenceMessages(numTickers, fields):
+    request = fakeBlpapi.Request('ReferenceDataRequest')
+    for ticker in ['T%04d US EQUITY' % n for n in range(numTickers)]:
+        request.append('securities', ticker)
+    for field in fields:
+        request.append('fields', field)
+    events, rows = fakeBlpapi.referenceResponse(request, fakeBlpapi.CorrelationId(0))
+    return [msg for eventType, messages in events for msg in messages]
+
+
+def test_historical_decode_matches_the_field_lookups():
+    messages = recordMessages(12, FIELDS, '20190101', '20190630')
+    expected = decode(messages, legacyHistorical, FIELDS)
+    df = decode(messages, blp.parseHistoricalMessage, blp.fieldNames(FIELDS))
+    assert len(df) > 12 * 120 * 20
+    assert df.Field.str.endswith('_DT').any()
+    pd.testing.assert_frame_equal(df.astype({'Value': float}), expected.astype({'Value': float}), check_exact=True)
+
+
+def test_reference_decode_matches_the_field_lookups():
+    fields = blp.requestFields(FIELDS, None)
+    messages = referenceMessages(30, fields)
+    expected = decode(messages, legacyReference, fields)
+    df = decode(messages, blp.parseReferenceMessage, blp.fieldNames(fields))
+    assert set(df.Ticker) == set(expected.Ticker) and len(df) > 30 * 20
+    pd.testing.assert_frame_equal(df.astype({'Value': float}), expected.astype({'Value': float}), check_exact=True)
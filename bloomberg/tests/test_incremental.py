@@ -0,0 +1,32 @@
+import os
+import pandas as pd
+import pytest
+
+import bloombergReader as blp
+import marketData
+
+TICKERS = ['T%04d US EQUITY' % n for n in range(3)]
+FIELDS = ['F0', 'F1']
+
+
+def test_refreshes_within_a_second_keep_every_row(tmp_path):
+    ## each refresh writes a file of its own however close together the runs are
+    ends = [d.strftime('%Y%m%d') for d in pd.date_range('2019-01-31', periods=12, freq='M')]
+    for end in ends:
+        blp.readBloombergData(TICKERS, FIELDS, '20190101', end, str(tmp_path), tickerRange=3, incremental=True)
+    stored = marketData.readMarketData(str(tmp_path))
+    full = blp.readBloombergData(TICKERS, FIELDS, '20190101', ends[-1], None, tickerRange=3)
+    key = ['Date', 'Ticker', 'Field']
+    assert len(stored) == len(full)
+    pd.testing.assert_frame_equal(stored.sort_values(key).reset_index(drop=True)[full.columns],
+                                  full.sort_values(key).reset_index(drop=True), check_dtype=False)
+
+
+def test_existing_file_is_not_replaced(tmp_path, monkeypatch):
+    ## a name clash fails the refresh and leaves the high water marks where they were
+    monkeypatch.setattr(blp, 'runFilename', lambda filename: 'marketdata-run.parquet')
+    blp.readBloombergData(TICKERS, FIELDS, '20190101', '20190131', str(tmp_path), incremental=True)
+    marks = open(os.path.join(str(tmp_path), 'hwm-DAILY.json')).read()
+    with pytest.raises(FileExistsError):
+        blp.readBloombergData(TICKERS, FIELDS, '20190101', '20190228', str(tmp_path), incremental=True)
+    assert open(os.path.join(str(tmp_path), 'hwm-DAILY.json')).read() == marks
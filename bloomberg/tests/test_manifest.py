@@ -0,0 +1,56 @@
+import os
+import json
+import pandas as pd
+
+import fakeBlpapi
+import bloombergReader as blp
+import marketData
+from manifest import Manifest, MANIFEST_FILE
+from refreshIndex import HighWaterMarks
+
+TICKERS = ['T%04d US EQUITY' % n for n in range(6)]
+FIELDS = ['F0', 'F1']
+KEY = ['Date', 'Ticker', 'Field']
+
+
+def refresh(output):
+    return blp.readBloombergData(TICKERS, FIELDS, '20190101', '20190331', output, tickerRange=2, checkpoint=True, incremental=True)
+
+
+def test_resume_after_a_torn_manifest_line(tmp_path, monkeypatch):
+    ## the run dies writing the manifest line of the second ticker chunk: that chunk's file is on
+    ## disk, its line is torn and its marks were never committed, so the restart repeats it
+    output = str(tmp_path / 'crashed')
+    record = Manifest.record
+    def tornRecord(self, units, filename):
+        if os.path.exists(self.path):
+            with open(self.path, 'a') as f:
+                f.write('{"keys": ["')
+            raise OSError('killed')
+        record(self, units, filename)
+    monkeypatch.setattr(Manifest, 'record', tornRecord)
+    refresh(output)
+    monkeypatch.setattr(Manifest, 'record', record)
+
+    marks = HighWaterMarks(output)
+    assert [ticker for ticker in TICKERS if marks.get(ticker, 'F0') is not None] == TICKERS[:2]
+    with open(os.path.join(output, MANIFEST_FILE)) as f:
+        lines = f.read().split('\n')
+    assert len(lines) == 2 and json.loads(lines[0])['tickers'] == TICKERS[:2] and lines[1] == '{"keys": ["'
+
+    fakeBlpapi.resetStats()
+    refresh(output)
+    assert fakeBlpapi.STATS['requests'] == 2
+
+    full = str(tmp_path / 'full')
+    refresh(full)
+    assert HighWaterMarks(output).marks == HighWaterMarks(full).marks
+    manifest = Manifest(output)
+    assert all(manifest.isComplete(ticker, FIELDS, '20190101', '20190331', 'DAILY') for ticker in TICKERS)
+
+    ## the rows of the repeated chunk are stored twice, every other row once
+    stored = marketData.readMarketData(output)
+    expected = marketData.readMarketData(full).sort_values(KEY).reset_index(drop=True)
+    repeated = stored[stored.duplicated(KEY, keep=False)]
+    assert set(repeated.Ticker) == set(TICKERS[2:4])
+    pd.testing.assert_frame_equal(stored.drop_duplicates(KEY).sort_values(KEY).reset_index(drop=True), expected)
@@ -0,0 +1,44 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+import pytest
+
+import marketData
+
+
+def makeBuffer():
+    ## numbers, date values and text, with a flush boundary between two buffers
+    buffers = [marketData.MarketDataBuffer(), marketData.MarketDataBuffer()]
+    for n in range(40):
+        date = dt.date(2019, 1, 1) + dt.timedelta(n)
+        buffer = buffers[n // 25]
+        buffer.add(date, 'T%d US EQUITY' % (n % 3), 'PX_LAST', 10.0 + n / 4)
+        buffer.add(date, 'T%d US EQUITY' % (n % 3), 'VOLUME', n * 100)
+        buffer.add(date, 'T%d US EQUITY' % (n % 3), 'DVD_EX_DT', date - dt.timedelta(30))
+        if n % 7 == 0:
+            buffer.add(date, 'T%d US EQUITY' % (n % 3), 'NAME', 'Name, %d "Co"' % n)
+    return buffers
+
+
+def expectedFrame(buffers):
+    whole = marketData.MarketDataBuffer()
+    for buffer in buffers:
+        whole.extend(buffer)
+    df = pd.DataFrame(dict(zip(marketData.FILE_COLUMNS, whole.toColumns())))
+    df['Date'] = df.Date.astype('datetime64[ns]')
+    return df
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather', 'csv'])
+def test_written_file_reads_back(tmp_path, fmt):
+    path = str(tmp_path / ('marketdata' + marketData.FORMATS[fmt]))
+    writer = marketData.MarketDataWriter(path, fmt)
+    for buffer in makeBuffer():
+        writer.write(buffer)
+    writer.close()
+    df = marketData.readMarketData(path)
+    assert list(df.columns) == marketData.FILE_COLUMNS
+    pd.testing.assert_frame_equal(df, expectedFrame(makeBuffer()), check_exact=True)
+    assert df.Text.notnull().sum() == 6 and df.Value[df.Text.notnull()].isnull().all()
+    dates = df[df.Field == 'DVD_EX_DT']
+    np.testing.assert_array_equal(pd.to_datetime(dates.Value, unit='s'), dates.Date - pd.Timedelta(days=30))
@@ -0,0 +1,85 @@
+import time
+import pandas as pd
+
+import fakeBlpapi
+import bloombergReader as blp
+from pipeline import RequestPipeline
+
+TICKERS = ['T%04d US EQUITY' % n for n in range(40)]
+FIELDS = ['F0', 'F1', 'F2']
+# tickers per request: the large ones are answered after the small ones sent behind them
+SIZES = [8, 1, 1, 4, 1, 2, 6, 1, 1, 3, 1, 1]
+
+
+def makeRequests():
+    requests, pos = [], 0
+    for seq, size in enumerate(SIZES):
+        requests.append(blp.BloombergRequest(seq, TICKERS[pos:pos + size], FIELDS, '20190101', '20190331'))
+        pos += size
+    return requests
+
+
+def sessions(n):
+    return [blp.openSession() for _ in range(n)]
+
+
+def test_responses_out_of_order_are_yielded_in_request_order(monkeypatch):
+    monkeypatch.setattr(fakeBlpapi, 'LATENCY', 0.01)
+    monkeypatch.setattr(fakeBlpapi, 'ROW_COST', 0.0002)
+    requests = makeRequests()
+    results = list(RequestPipeline(sessions(2), inFlight=4).run(requests))
+    assert [request.seq for request, rows in results] == list(range(len(SIZES)))
+    completed = [request.sent + request.elapsed for request, rows in results]
+    assert completed != sorted(completed)
+
+    ## each response went to the request of its correlation id
+    monkeypatch.setattr(fakeBlpapi, 'ROW_COST', 0.0)
+    session = blp.openSession()
+    for request, rows in results:
+        assert request.error is None
+        expected = request.fetch(session).toFrame()
+        assert set(expected.Ticker) == set(request.tickers)
+        pd.testing.assert_frame_equal(rows.toFrame(), expected)
+
+
+def test_requests_drawn_stay_within_the_window(monkeypatch):
+    ## the first request is slow, the others are not drawn further than the window past it
+    monkeypatch.setattr(fakeBlpapi, 'LATENCY', 0.005)
+    monkeypatch.setattr(fakeBlpapi, 'ROW_COST', 0.0005)
+    drawn = []
+    def requests():
+        for request in makeRequests():
+            drawn.append(request.seq)
+            yield request
+    pipeline = RequestPipeline(sessions(2), inFlight=2, window=4)
+    for n, (request, rows) in enumerate(pipeline.run(requests())):
+        assert request.seq == n
+        assert len(drawn) <= n + 1 + pipeline.window
+    assert len(drawn) == len(SIZES)
+
+
+def test_dead_session_fails_its_requests(monkeypatch):
+    ## the requests of a terminated session come back with an error, the live session takes the rest
+    monkeypatch.setattr(fakeBlpapi, 'LATENCY', 0.05)
+    live, dead = sessions(2)
+    send = dead.sendRequest
+    def sendAndStop(request, correlationId=None):
+        send(request, correlationId=correlationId)
+        dead.stop()
+    monkeypatch.setattr(dead, 'sendRequest', sendAndStop)
+    results = list(RequestPipeline([live, dead], inFlight=2).run(makeRequests()))
+    assert [request.seq for request, rows in results] == list(range(len(SIZES)))
+    failed = [request for request, rows in results if request.error]
+    assert len(failed) == 2 and all('SessionTerminated' in request.error for request in failed)
+    assert all(len(rows) for request, rows in results if not request.error)
+
+
+def test_silent_session_times_out(monkeypatch):
+    ## a session that never answers fails its requests after responseTimeout instead of blocking
+    session = sessions(1)[0]
+    monkeypatch.setattr(session, 'sendRequest', lambda request, correlationId=None: correlationId)
+    start = time.time()
+    results = list(RequestPipeline([session], inFlight=2, timeout=20, responseTimeout=0.2).run(makeRequests()[:2]))
+    assert time.time() - start < 5
+    assert [request.seq for request, rows in results] == [0, 1]
+    assert all('no response' in request.error for request, rows in results)
@@ -0,0 +1,76 @@
+import pandas as pd
+
+import fakeBlpapi
+import bloombergReader as blp
+from planner import BatchPlanner
+
+TICKERS = ['T%04d US EQUITY' % n for n in range(40)]
+FIELDS = ['FIELD_%02d' % n for n in range(30)]
+KEY = ['Date', 'Ticker', 'Field']
+
+
+def read(**kwargs):
+    fakeBlpapi.resetStats()
+    df = blp.readBloombergData(TICKERS, FIELDS, '20190101', '20191231', None, inFlight=4, **kwargs)
+    return df.sort_values(KEY).reset_index(drop=True), dict(fakeBlpapi.STATS)
+
+
+def test_adaptive_batches_grow_to_the_limit_and_keep_every_row(monkeypatch):
+    ## 24 fields x 261 days is 6264 points a ticker, so the largest request that completes has 6 tickers
+    monkeypatch.setattr(fakeBlpapi, 'LATENCY', 0.0)
+    monkeypatch.setattr(fakeBlpapi, 'MAX_POINTS', 40000)
+    single, singleStats = read(tickerRange=1)
+    adaptive, stats = read(adaptive=True, targetPoints=10000)
+    pd.testing.assert_frame_equal(adaptive, single)
+    assert singleStats['requests'] == 80
+    assert stats['requests'] < 40
+    assert stats['failed'] <= 8
+
+
+def test_failed_request_is_split_below_the_failure():
+    planner = BatchPlanner(targetPoints=100000)
+    request = blp.BloombergRequest(0, TICKERS[:12], FIELDS[:24], '20190101', '20191231', 'DAILY')
+    request.points, request.retries, request.error = 75168, 0, 'timeout'
+    planner.largest = 37584
+    planner.feedback(request, None)
+    assert planner.targetPoints == (37584 + 75168) / 2
+    assert [len(retry.tickers) for retry in planner.retry] == [6, 6]
+
+
+def test_feedback_from_another_thread_keeps_every_ticker():
+    ## the plan is drawn on one thread while the failures and completions are fed back on another
+    import threading
+    import queue
+    tickers = ['T%05d US EQUITY' % n for n in range(3000)]
+    planner = BatchPlanner(targetPoints=2000, minPoints=10)
+    drawn = queue.Queue()
+    def draw():
+        for request in planner.plan(tickers, FIELDS[:2], None, None, 'DAILY', 24,
+                                    lambda seq, tickerList, fieldList: blp.BloombergRequest(seq, tickerList, fieldList)):
+            drawn.put(request)
+        drawn.put(None)
+    thread = threading.Thread(target=draw)
+    thread.start()
+    completed = []
+    while True:
+        request = drawn.get()
+        if request is None:
+            if not planner.pending():
+                break
+            ## failures fed back after the plan ran dry go round again
+            thread.join()
+            thread = threading.Thread(target=draw)
+            tickers = []
+            thread.start()
+            continue
+        request.elapsed = 0.01
+        if request.retries == 0 and len(request.tickers) > 1 and len(completed) % 3 == 0:
+            request.error = 'timeout'
+            planner.feedback(request, None)
+        else:
+            completed.extend(request.tickers)
+            planner.feedback(request, [None] * len(request.tickers))
+    thread.join()
+    assert sorted(completed) == ['T%05d US EQUITY' % n for n in range(3000)]
+    assert planner.stats['failed'] > 0
+    assert planner.stats['requests'] == planner.stats['completed'] + planner.stats['failed']